@@ -6,23 +6,27 @@ CardioProtect Extractor API (Local Llama3)
 FastAPI wrapper for mapper.py that fills Excel templates
 offline using Llama3 reasoning (via Ollama API).
 Includes progress + preview support + live progress stream + resume mode + auto cache cleanup.
+Extraction routes run as asyncio background tasks on the mapper's async engine.
 """
 
-import sys, os, threading, time, uuid, warnings, json
+import sys, os, threading, time, uuid, warnings, json, asyncio
+from types import MappingProxyType
 warnings.filterwarnings("ignore")
 
-from fastapi import FastAPI
+from fastapi import FastAPI, BackgroundTasks
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse, StreamingResponse
 import pandas as pd
 from dotenv import load_dotenv
-import mapper
 
-# --- Load environment ---
+# --- Load environment (before mapper so its env-driven config sees .env) ---
 load_dotenv()
+import mapper
+from extractor.parse_cache import file_sha256
 
 MODEL_NAME = os.getenv("OLLAMA_MODEL", "llama3:8b")
 OLLAMA_API = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+CRITERIA_PDF = os.getenv("CRITERIA_PDF", "")
 
 app = FastAPI(title="CardioProtect Extractor (Local Llama3)", version="3.4")
 
@@ -30,6 +34,8 @@ app = FastAPI(title="CardioProtect Extractor (Local Llama3)", version="3.4")
 _STATE = {}      # session_id → sheet_name → DataFrame
 _PROGRESS = {}   # session_id → {progress, stage, status}
 CACHE_FILE = getattr(mapper, "PARTIAL_SAVE_PATH", "partial_extraction_cache.json")
+_CRITERIA = {}   # abs criteria path → read-only {text, sections, mtime, size, sha256}
+_CRITERIA_LOCK = threading.Lock()
 
 
 # ------------------ REQUEST MODEL ------------------
@@ -47,6 +53,12 @@ class ExtractRequest(BaseModel):
     session_id: str | None = None
     output_xlsx_path: str | None = None
 
+    # Multi-PDF only: worker processes (None → mapper.PDF_WORKERS)
+    workers: int | None = None
+
+    # Skip the LLM response cache and always query the model
+    bypass_llm_cache: bool = False
+
 
 
 # ------------------ UTILITIES ------------------
@@ -67,12 +79,15 @@ def make_json_safe(obj):
 
 
 def update_progress(sid: str, pct: int, stage: str, status: str = "running"):
-    """Update session progress safely."""
-    _PROGRESS[sid] = {
+    """Update session progress safely (keeps per-sheet token counters)."""
+    entry = {
         "progress": pct,
         "stage": stage,
         "status": status,
     }
+    if pct > 0 and "sheets" in _PROGRESS.get(sid, {}):
+        entry["sheets"] = _PROGRESS[sid]["sheets"]
+    _PROGRESS[sid] = entry
 
 
 def cleanup_cache():
@@ -104,15 +119,74 @@ def cleanup_session_caches(session_id: str):
     except Exception as e:
         print(f"Session cache cleanup failed for {session_id}: {e}")
 
+# ------------------ CRITERIA REGISTRY ------------------
+def get_criteria(path: str):
+    """
+    Shared read-only criteria document (parsed text + section split).
+    Parsed once per file; re-parsed only when mtime/size change AND the content hash differs.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    with _CRITERIA_LOCK:
+        entry = _CRITERIA.get(key)
+        if entry and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+            return entry
+
+        digest = file_sha256(key)
+        if entry and entry["sha256"] == digest:
+            # touched but unchanged → keep parsed content, refresh stat
+            entry = MappingProxyType({**entry, "mtime": st.st_mtime, "size": st.st_size})
+        else:
+            doc = mapper.load_document(key)
+            text = doc.text
+            entry = MappingProxyType({
+                "path": key,
+                "text": text,
+                "sections": MappingProxyType(doc.sections),
+                "mtime": st.st_mtime,
+                "size": st.st_size,
+                "sha256": digest,
+            })
+            print(f"📚 Criteria loaded: {os.path.basename(key)} ({len(text)} chars)")
+        _CRITERIA[key] = entry
+        return entry
+
+
+mapper._criteria_provider = lambda path: get_criteria(path)["text"]
+
+
+@app.on_event("startup")
+def preload_criteria():
+    """Parse the configured CRITERIA_PDF once at startup (others load on first use)."""
+    if CRITERIA_PDF and os.path.exists(CRITERIA_PDF):
+        try:
+            get_criteria(CRITERIA_PDF)
+        except Exception as e:
+            print(f"⚠️ Criteria preload failed for {CRITERIA_PDF}: {e}")
+
+
 # Connect progress callback to mapper
-def mapper_progress(status, step, percent):
-    """Callback passed into mapper for live updates."""
-    for sid, prog in _PROGRESS.items():
-        if prog.get("status") in ("running", "starting"):
-            _PROGRESS[sid] = {"progress": percent, "stage": step, "status": status}
+def mapper_progress(status, step, percent, sid=None):
+    """Callback passed into mapper for live updates (only the session that is reporting)."""
+    prog = _PROGRESS.get(sid)
+    if prog is None or prog.get("status") not in ("running", "starting"):
+        return
+    _PROGRESS[sid] = {**prog, "progress": percent, "stage": step, "status": status}
+
+
+def mapper_sheet_progress(sid, sheet, tokens, done):
+    """Callback for streamed token counts: _PROGRESS[sid]["sheets"][sheet] = {tokens, status}."""
+    prog = _PROGRESS.get(sid)
+    if prog is None:
+        return
+    sheets = dict(prog.get("sheets", {}))
+    sheets[sheet] = {"tokens": tokens, "status": "done" if done else "streaming"}
+    # new dict each time so /live_progress sees the change
+    _PROGRESS[sid] = {**prog, "sheets": sheets}
 
 
 mapper._update_progress = mapper_progress
+mapper._update_sheet_progress = mapper_sheet_progress
 
 
 # ------------------ ROUTES ------------------
@@ -120,23 +194,38 @@ mapper._update_progress = mapper_progress
 def health():
     """Check service and model status."""
     model_name = getattr(mapper, "MODEL_NAME", MODEL_NAME)
-    return {"status": "ok", "model": model_name}
+    return {"status": "ok", "model": model_name, "ollama": mapper.get_ollama_client().status(),
+            "prompt_budget": mapper._get_prompt_compiler().stats()}
+
+
+def write_session_preview(sheet_dfs: dict, template_path: str, preview_path: str):
+    """Write per-sheet DataFrames to a preview workbook, aligned to template columns."""
+    with pd.ExcelWriter(preview_path, engine="openpyxl") as writer:
+        for sheet, df in sheet_dfs.items():
+            try:
+                base_df = pd.read_excel(template_path, sheet_name=sheet)
+                cols = list(base_df.columns)
+                df = df.reindex(columns=cols, fill_value="NR")
+            except Exception:
+                pass
+            df.to_excel(writer, index=False, sheet_name=sheet[:31])
 
 
 @app.post("/extract")
-def extract(req: ExtractRequest):
+async def extract(req: ExtractRequest, background_tasks: BackgroundTasks):
     """Run field extraction and return preview Excel."""
     sid = req.session_id or str(uuid.uuid4())
     update_progress(sid, 0, "Starting extraction")
 
-    def run_extraction():
+    async def run_extraction():
         try:
             update_progress(sid, 10, "Reading PDFs")
-            preview = mapper.extract_fields(
+            preview = await mapper.extract_fields_async(
                 study_pdf=req.pdf_path,
                 criteria_pdf=req.criteria_pdf,
                 template_xlsx=req.template_path,
-                session_id=sid
+                session_id=sid,
+                use_llm_cache=not req.bypass_llm_cache
             )
 
             update_progress(sid, 80, "Formatting extracted data")
@@ -145,15 +234,7 @@ def extract(req: ExtractRequest):
             _STATE[sid] = sheet_dfs
 
             preview_path = f"preview_{sid}.xlsx"
-            with pd.ExcelWriter(preview_path, engine="openpyxl") as writer:
-                for sheet, df in sheet_dfs.items():
-                    try:
-                        base_df = pd.read_excel(req.template_path, sheet_name=sheet)
-                        cols = list(base_df.columns)
-                        df = df.reindex(columns=cols, fill_value="NR")
-                    except Exception:
-                        pass
-                    df.to_excel(writer, index=False, sheet_name=sheet[:31])
+            await asyncio.to_thread(write_session_preview, sheet_dfs, req.template_path, preview_path)
 
             update_progress(sid, 100, "Extraction complete ✅", status="done")
 
@@ -167,8 +248,7 @@ def extract(req: ExtractRequest):
         except Exception as e:
             update_progress(sid, 0, f"Error: {str(e)}", status="failed")
 
-    thread = threading.Thread(target=run_extraction)
-    thread.start()
+    background_tasks.add_task(run_extraction)
 
     return {
         "session_id": sid,
@@ -176,11 +256,8 @@ def extract(req: ExtractRequest):
     }
 
 
-
-import threading
-
 @app.post("/extract/multi_pdf")
-def extract_multi(req: ExtractRequest):
+async def extract_multi(req: ExtractRequest, background_tasks: BackgroundTasks):
     """Batch extraction for all PDFs in a specified folder (async)."""
     sid = req.session_id or str(uuid.uuid4())
     pdf_dir = req.study_pdf
@@ -193,22 +270,22 @@ def extract_multi(req: ExtractRequest):
     preview_dir = os.path.join("multi_previews", sid)
     os.makedirs(preview_dir, exist_ok=True)
 
-    def run_batch():
+    async def run_batch():
         try:
-            from mapper import process_multiple_pdfs
             update_progress(sid, 5, f"📁 Found PDFs — starting batch...", status="running")
-            results = process_multiple_pdfs(
+            results = await mapper.process_multiple_pdfs_async(
                 pdf_dir, criteria, template, sid,
                 preview_dir=preview_dir,
-                auto_merge=True, completeness_threshold=95.0
+                auto_merge=True, completeness_threshold=95.0,
+                workers=req.workers,
+                use_llm_cache=not req.bypass_llm_cache
             )
             update_progress(sid, 100, "✅ Multi-PDF extraction complete", status="saved")
         except Exception as e:
             update_progress(sid, 0, f"❌ Error: {e}", status="failed")
 
     # Run in background so Swagger returns immediately
-    thread = threading.Thread(target=run_batch)
-    thread.start()
+    background_tasks.add_task(run_batch)
 
     return {
     "session_id": sid,
@@ -244,7 +321,9 @@ def resume_multi(req: ExtractRequest):
         results = resume_multiple_pdfs(
             pdf_dir, criteria, template, sid,
             preview_dir=preview_dir,
-            completeness_threshold=95.0
+            completeness_threshold=95.0,
+            workers=req.workers,
+            use_llm_cache=not req.bypass_llm_cache
         )
         update_progress(sid, 100, "✅ Resume pass complete", status="saved")
         return {
@@ -259,7 +338,7 @@ def resume_multi(req: ExtractRequest):
 
 
 @app.post("/resume")
-def resume(req: ExtractRequest):
+async def resume(req: ExtractRequest, background_tasks: BackgroundTasks):
     """
     Resume extraction only for missing ('NR' or empty) fields using existing cache.
     Automatically updates cache and preview Excel.
@@ -267,17 +346,16 @@ def resume(req: ExtractRequest):
     sid = req.session_id or "resume_manual"
     update_progress(sid, 0, "Starting resume process...")
 
-    def run_resume():
+    async def run_resume():
         try:
-            from mapper import resume_incomplete_fields
-
             preview_path = req.output_xlsx_path or f"preview_{sid}.xlsx"
-            updated_cache = resume_incomplete_fields(
+            updated_cache = await mapper.resume_incomplete_fields_async(
                 study_pdf=req.pdf_path,
                 criteria_pdf=req.criteria_pdf,
                 template_xlsx=req.template_path,
                 preview_path=preview_path,
-                session_id=sid
+                session_id=sid,
+                use_llm_cache=not req.bypass_llm_cache
             )
 
             update_progress(sid, 100, "Resume completed ✅", status="done")
@@ -286,8 +364,7 @@ def resume(req: ExtractRequest):
         except Exception as e:
             update_progress(sid, 0, f"Resume failed: {str(e)}", status="failed")
 
-    thread = threading.Thread(target=run_resume)
-    thread.start()
+    background_tasks.add_task(run_resume)
 
     return {
         "session_id": sid,
@@ -296,7 +373,7 @@ def resume(req: ExtractRequest):
 
 
 @app.post("/resume/{session_id}")
-def resume(session_id: str, req: ExtractRequest):
+async def resume_session(session_id: str, req: ExtractRequest, background_tasks: BackgroundTasks):
     """
     Resume a previously interrupted extraction using mapper resume mode.
     Re-processes only missing batches from partial_extraction_cache.json,
@@ -304,14 +381,15 @@ def resume(session_id: str, req: ExtractRequest):
     """
     update_progress(session_id, 5, "Resuming extraction from cache...")
 
-    def run_resume():
+    async def run_resume():
         try:
             update_progress(session_id, 10, "Loading cached batches...")
-            preview = mapper.extract_fields(
+            preview = await mapper.extract_fields_async(
                 study_pdf=req.pdf_path,
                 criteria_pdf=req.criteria_pdf,
                 template_xlsx=req.template_path,
-                session_id=session_id
+                session_id=session_id,
+                use_llm_cache=not req.bypass_llm_cache
             )
 
             update_progress(session_id, 85, "Merging cached + new batches")
@@ -320,15 +398,7 @@ def resume(session_id: str, req: ExtractRequest):
             _STATE[session_id] = sheet_dfs
 
             preview_path = f"preview_resume_{session_id}.xlsx"
-            with pd.ExcelWriter(preview_path, engine="openpyxl") as writer:
-                for sheet, df in sheet_dfs.items():
-                    try:
-                        base_df = pd.read_excel(req.template_path, sheet_name=sheet)
-                        cols = list(base_df.columns)
-                        df = df.reindex(columns=cols, fill_value="NR")
-                    except Exception:
-                        pass
-                    df.to_excel(writer, index=False, sheet_name=sheet[:31])
+            await asyncio.to_thread(write_session_preview, sheet_dfs, req.template_path, preview_path)
 
             # ✅ Cleanup cache after successful resume
             cleanup_session_caches(session_id)
@@ -338,8 +408,7 @@ def resume(session_id: str, req: ExtractRequest):
         except Exception as e:
             update_progress(session_id, 0, f"Resume failed: {str(e)}", status="failed")
 
-    thread = threading.Thread(target=run_resume)
-    thread.start()
+    background_tasks.add_task(run_resume)
 
     return {
         "session_id": session_id,
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cleaner.py — Boilerplate / reference-list stripping before the StudyDocument is built
+-------------------------------------------------------------------------------------
+- Running headers / footers: lines (digits ignored) repeated on at least half the pages (3 or more) are
+  kept once, on the first page that has them, and dropped everywhere else; lines without letters
+  (page numbers, "§") only count in the first / last lines of a page
+- Reference list: the "References" heading line stays (body_end() and every rule scope keep working),
+  the entries after it go — the rest of the heading page when it is citation-dense, then every following
+  page until the first one that is not (appendix tables and figure legends after the list are kept)
+- Line-break hyphenation joined ("throm-\\nboembolism" → "thromboembolism"; a hyphenated compound the
+  document spells with its hyphen elsewhere keeps it) only when the joined word occurs elsewhere in the document
+  or the right-hand piece is no word of its own there ("pre-\\nand" across two columns stays as it is);
+  ligature code points expanded, soft hyphens removed
+- clean_pages(): page texts in, cleaned page texts + counts out (a page left empty drops out of the document);
+  StudyDocument.from_pages passes each page's own text, before table rows / OCR are appended
+"""
+
+import math
+import re
+from collections import defaultdict
+
+CLEANER_VERSION = "2"
+_EDGE_LINES = 3         # first / last lines of a page where bare page numbers and symbols count as boilerplate
+_MAX_BOILERPLATE = 160  # longer lines are body text, however often they repeat
+_REF_DENSITY = 0.4      # share of citation-like lines that marks a reference-list page
+_REF_TAIL_DENSITY = 0.5  # same, for the rest of the heading page (Discussion / reference columns mixed stay below)
+
+_LIGATURES = {"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st", "­": ""}
+_LIGATURE_RE = re.compile("|".join(_LIGATURES))
+# Heading alone on its line, or sharing it with the other column's text (two-column layouts)
+_REF_HEADING = re.compile(
+    r"^\s*(?:References|REFERENCES|Bibliography|BIBLIOGRAPHY|Literature Cited)\b|\b(?:References|REFERENCES)\s*$")
+_CITATION = re.compile(
+    r"\bet al\b|\b(?:19|20)\d{2}\s*[;,.)]|\bdoi\b|\b10\.\d{4,9}/|\d+\s*\(\d+\)\s*:\s*\d+|\b\d+\s*:\s*\d+\s*[-–]\s*\d+|"
+    r"^\s*\[?\d{1,3}[.\]]\s+[A-Z]|PubMed|Google Scholar|CrossRef|PMID", re.I)
+_HYPHEN_BREAK = re.compile(r"(\w*[^\W\d_])-\n([^\W\d_]\w*)")
+_HYPHENATED = re.compile(r"\w+(?:-\w+)+")
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def _key(line: str) -> str:
+    return re.sub(r"\d+", "#", re.sub(r"\s+", " ", line).strip())
+
+
+def _letters(key: str) -> int:
+    return sum(ch.isalpha() for ch in key)
+
+
+def _repeated_lines(pages: list[list[str]]) -> tuple[list[list[str]], int]:
+    """Drop running headers / footers (first page with each one keeps it) → (pages, lines removed)."""
+    need = max(3, math.ceil(len(pages) / 2))
+    if len(pages) < need:
+        return pages, 0
+
+    def candidates(lines):
+        for i, line in enumerate(lines):
+            key = _key(line)
+            if not key or len(key) > _MAX_BOILERPLATE:
+                continue
+            if _letters(key) >= 4 or not _letters(key) and (i < _EDGE_LINES or i >= len(lines) - _EDGE_LINES):
+                yield i, key
+
+    seen = defaultdict(list)
+    for p, lines in enumerate(pages):
+        for key in {k for _, k in candidates(lines)}:
+            seen[key].append(p)
+    boiler = {key: ps[0] for key, ps in seen.items() if len(ps) >= need}
+    if not boiler:
+        return pages, 0
+
+    out, removed = [], 0
+    for p, lines in enumerate(pages):
+        drop = {i for i, key in candidates(lines) if key in boiler and boiler[key] != p}
+        removed += len(drop)
+        out.append([line for i, line in enumerate(lines) if i not in drop])
+    return out, removed
+
+
+def _dense(lines: list[str], threshold: float = _REF_DENSITY) -> bool:
+    lines = [l for l in lines if l.strip()]
+    return bool(lines) and sum(bool(_CITATION.search(l)) for l in lines) / len(lines) >= threshold
+
+
+def _after(pages: list[list[str]], p: int) -> list[str]:
+    return pages[p + 1] if p + 1 < len(pages) else []
+
+
+def _reference_list(pages: list[list[str]]) -> tuple[list[list[str]], int]:
+    """Drop the reference entries after the last "References" heading past the first third → (pages, lines removed)."""
+    total = sum(len(line) + 1 for lines in pages for line in lines)
+    heading, pos = None, 0
+    for p, lines in enumerate(pages):
+        for i, line in enumerate(lines):
+            if pos > total // 3 and _REF_HEADING.search(line) and (_dense(lines[i + 1:]) or _dense(_after(pages, p))):
+                heading = (p, i)
+            pos += len(line) + 1
+    if heading is None:
+        return pages, 0
+
+    p, i = heading
+    out, removed = [list(lines) for lines in pages], 0
+    if _dense(out[p][i + 1:], _REF_TAIL_DENSITY):
+        removed += len(out[p]) - i - 1
+        out[p] = out[p][:i + 1]
+    for q in range(p + 1, len(out)):
+        if not _dense(out[q]):
+            break
+        removed += len(out[q])
+        out[q] = []
+    return out, removed
+
+
+def _dehyphenate(text: str, vocabulary: set, words: set) -> tuple[str, int]:
+    """Join line-break hyphens; vocabulary = hyphenated compounds, words = plain words seen outside the breaks."""
+    joins = 0
+
+    def join(m):
+        nonlocal joins
+        left, right = m.group(1), m.group(2)
+        if not left[-1].islower() or not right[0].islower():
+            return m.group(0)
+        word = f"{left}-{right}"
+        if word.lower() in vocabulary:
+            joins += 1
+            return word
+        if (left + right).lower() in words or right.lower() not in words:
+            joins += 1
+            return left + right
+        return m.group(0)  # "pre-" + the next column's "and": two words, not one
+
+    return _HYPHEN_BREAK.sub(join, text), joins
+
+
+def clean_pages(texts: list[str]) -> tuple[list[str], dict]:
+    """
+    Cleaned text for each page (same order and length) + {chars_before, chars_after, boilerplate_lines,
+    reference_lines, hyphen_joins}.
+    ✅ Page-local edits only: nothing moves between pages, so page numbers and spans stay true
+    🔹 A study without repeated lines or a detectable reference list only gets the character-level fixes
+    """
+    texts = [_LIGATURE_RE.sub(lambda m: _LIGATURES[m.group(0)], t or "") for t in texts]
+    pages = [t.split("\n") for t in texts]
+    pages, boilerplate = _repeated_lines(pages)
+    pages, references = _reference_list(pages)
+
+    vocabulary = {w.lower() for t in texts for w in _HYPHENATED.findall(t)}
+    words = {w.lower() for t in texts for w in _WORD.findall(_HYPHEN_BREAK.sub(" ", t))}
+    out, joins = [], 0
+    for lines in pages:
+        text, n = _dehyphenate("\n".join(lines), vocabulary, words)
+        out.append(text.strip())
+        joins += n
+    stats = {"chars_before": sum(len(t) for t in texts), "chars_after": sum(len(t) for t in out),
+             "boilerplate_lines": boilerplate, "reference_lines": references, "hyphen_joins": joins}
+    return out, stats
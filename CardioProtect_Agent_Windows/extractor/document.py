@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+document.py — Structured model of one parsed study PDF
+------------------------------------------------------
+- Built once per PDF from the page records (single regex pass for sections/headings)
+- Holds the assembled text, per-page character spans, headings, section spans and tables
+- to_dict()/from_dict() for a JSON round trip (the parse cache stores page records; documents are rebuilt from them)
+- page_of() / pages_text() let later stages pull only the pages they need
+"""
+
+import re, threading
+from bisect import bisect_right
+
+from extractor.retrieval import ChunkIndex, _HEADING_RE
+
+DOCUMENT_MODEL_VERSION = "1"
+
+# Section keywords (same set and matching rule the section splitter has always used)
+SECTION_NAMES = ("Introduction", "Methods", "Results", "Discussion", "Conclusion")
+_SECTION_RE = re.compile(r"(" + "|".join(SECTION_NAMES) + r")[:\s\n]+", re.I)
+# Reference list heading on its own line (facts after it belong to cited studies)
+_REFERENCES_RE = re.compile(r"\n\s*(?:References|REFERENCES|Bibliography|Literature Cited)\s*\n")
+
+
+def split_sections(text: str) -> dict:
+    """
+    { section: text } in one pass over the text.
+    A section starts at its keyword's first match and ends at the next match of any *other* keyword.
+    """
+    spans = _section_spans(text or "")
+    return {name: text[s:e] for name, (s, e) in spans.items()}
+
+
+def _section_spans(text: str) -> dict:
+    hits = [(m.start(), m.group(1).lower()) for m in _SECTION_RE.finditer(text)]
+    spans = {}
+    for i, (start, name) in enumerate(hits):
+        if name in spans:
+            continue
+        end = len(text)
+        for pos, other in hits[i + 1:]:
+            if other != name and pos > start:
+                end = pos
+                break
+        spans[name] = (start, end)
+    return spans
+
+
+class StudyDocument:
+    """Parsed study: text + page / heading / section / table structure, all as character offsets."""
+
+    def __init__(self, text: str, pages: list[dict], headings: list[dict], section_spans: dict,
+                 tables: list[dict], source: str = ""):
+        self.text = text
+        self.pages = pages                  # [{page, start, end}]
+        self.headings = headings            # [{title, start, page}]
+        self.section_spans = section_spans  # {section: (start, end)}
+        self.tables = tables                # [{page, rows}]
+        self.source = source
+        self._page_starts = [p["start"] for p in pages]
+        self._sections = None
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    # ---------------- BUILD ----------------
+    @classmethod
+    def from_pages(cls, page_records, page_text, source: str = "", clean=None) -> "StudyDocument":
+        """
+        Assemble text exactly as read_pdf_text does ("\\n"-joined, stripped, empty pages skipped)
+        while recording where each page lands. page_text(rec) → assembled page string.
+        page_records may be any iterable (consumed once, page by page — e.g. a streaming parser).
+        clean(page texts) → page texts runs over the whole document before assembly (boilerplate stripping),
+        on each page's own text only (rec["text"], or its OCR text on a text-less page): table rows and
+        OCR added by page_text are never cut as header / footer or reference-list lines.
+        """
+        numbers, bodies, tables, records = [], [], [], []
+        for rec in page_records:
+            for rows in rec.get("tables") or []:
+                tables.append({"page": rec.get("page"), "rows": rows})
+            numbers.append(rec.get("page"))
+            if clean is None:
+                bodies.append(page_text(rec).strip())
+            else:
+                records.append(rec)
+        if clean is not None:
+            fields = ["text" if (rec.get("text") or "").strip() or not rec.get("ocr") else "ocr" for rec in records]
+            cleaned = clean([rec.get(field) or "" for rec, field in zip(records, fields)])
+            bodies = [page_text({**rec, field: text}).strip() for rec, field, text in zip(records, fields, cleaned)]
+
+        parts, pages, pos = [], [], 0
+        for number, body in zip(numbers, bodies):
+            body = body.strip()
+            if not body:
+                continue
+            if parts:
+                pos += 1  # joining newline
+            pages.append({"page": number, "start": pos, "end": pos + len(body)})
+            parts.append(body)
+            pos += len(body)
+        text = "\n".join(parts)
+
+        doc = cls(text, pages, [], _section_spans(text), tables, source)
+        offset = 0
+        for line in text.split("\n"):
+            m = _HEADING_RE.match(line)
+            if m:
+                doc.headings.append({"title": m.group(1), "start": offset, "page": doc.page_of(offset)})
+            offset += len(line) + 1
+        return doc
+
+    # ---------------- SERIALIZE ----------------
+    def to_dict(self) -> dict:
+        return {
+            "version": DOCUMENT_MODEL_VERSION, "source": self.source, "text": self.text,
+            "pages": self.pages, "headings": self.headings,
+            "section_spans": {k: list(v) for k, v in self.section_spans.items()},
+            "tables": self.tables,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StudyDocument":
+        if data.get("version") != DOCUMENT_MODEL_VERSION:
+            raise ValueError(f"document model version {data.get('version')} != {DOCUMENT_MODEL_VERSION}")
+        return cls(data["text"], data["pages"], data["headings"],
+                   {k: tuple(v) for k, v in data["section_spans"].items()},
+                   data["tables"], data.get("source", ""))
+
+    def __getstate__(self):
+        # Lazily built views are cheap to rebuild; keep pickles (process pool) small
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state["text"], state["pages"], state["headings"],
+                      {k: tuple(v) for k, v in state["section_spans"].items()},
+                      state["tables"], state.get("source", ""))
+
+    # ---------------- VIEWS ----------------
+    @property
+    def sections(self) -> dict:
+        """{ section: text } — same result as the legacy splitter."""
+        if self._sections is None:
+            self._sections = {name: self.text[s:e] for name, (s, e) in self.section_spans.items()}
+        return self._sections
+
+    def page_of(self, offset: int):
+        """Page number containing a character offset (None for an empty document)."""
+        i = bisect_right(self._page_starts, offset) - 1
+        return self.pages[max(i, 0)]["page"] if self.pages else None
+
+    def pages_text(self, page_numbers) -> str:
+        """Text of just the requested pages, in document order."""
+        wanted = set(page_numbers)
+        return "\n".join(self.text[p["start"]:p["end"]] for p in self.pages if p["page"] in wanted)
+
+    def body_end(self) -> int:
+        """Offset where the reference list starts (len(text) when no such heading follows the first third)."""
+        def build():
+            cut = [m.start() for m in _REFERENCES_RE.finditer(self.text)]
+            return cut[-1] if cut and cut[-1] > len(self.text) // 3 else len(self.text)
+        return self.memo("body_end", build)
+
+    def memo(self, key, build):
+        """Per-document memo for derived views (indexes, shared prompt prefixes); not serialized."""
+        with self._memo_lock:
+            if key in self._memo:
+                return self._memo[key]
+        value = build()  # outside the lock: builders may use other memoized views
+        with self._memo_lock:
+            return self._memo.setdefault(key, value)
+
+    def chunk_index(self, chunk_chars: int = 800) -> ChunkIndex:
+        """Memoized passage index; every chunk carries the page it starts on."""
+        def build():
+            index = ChunkIndex.from_text(self.text, chunk_chars=chunk_chars)
+            for chunk in index.chunks:
+                chunk["page"] = self.page_of(chunk["start"])
+            return index
+        return self.memo(("chunk_index", chunk_chars), build)
+
+    def __len__(self):
+        return len(self.text)
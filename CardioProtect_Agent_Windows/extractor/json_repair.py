@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+json_repair.py — Tolerant, single-pass JSON recovery for model output
+---------------------------------------------------------------------
+One left-to-right pass over the text (no regex rewrites, no second model call):
+- skips prose / code fences before the first '{' or '[' and drops trailing garbage after it closes
+- closes truncated strings, arrays and objects at end of input
+- bare tokens: NR / NA / words → strings; true/false/null (+ Python True/False/None) → literals
+  (only outside strings — values like "None reported" are left alone)
+- tolerates single quotes, unquoted keys, trailing / missing commas, // and /* */ comments
+Each repair is noted so callers can log what was fixed.
+"""
+
+import re, json
+
+# Bare tokens end at a structural character (values also at an opening bracket / quote)
+_BARE_VALUE = re.compile(r'[^,:}\]\n\r{\["]+')
+_BARE_KEY = re.compile(r"[^,:}\]\n\r{]+")
+_WS = re.compile(r"[ \t\r\n\ufeff]*")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_SKIP = object()  # placeholder values ("...", "…") that are dropped from arrays / objects
+# Runs of ordinary string characters, consumed in one step per quote style
+_PLAIN = {'"': re.compile(r'[^"\\\x00-\x1f]*'), "'": re.compile(r"[^'\\\x00-\x1f]*")}
+
+
+class JsonRepairError(ValueError):
+    """No JSON value could be recovered from the text."""
+
+
+def truncated(repairs: list) -> bool:
+    """Did recovery have to close a cut-off string / array / object or skip a mismatched bracket?"""
+    return any(r.startswith(("closed truncated", "stray ")) for r in repairs)
+
+
+def loads(text: str, repairs: list | None = None):
+    """
+    Parse text as JSON, repairing what a model typically gets wrong.
+    ✅ Strict json.loads fast path for already-valid input
+    🔹 repairs (optional list) receives a short note per fix
+    """
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        pass
+    return _Parser(text or "", repairs if repairs is not None else []).parse()
+
+
+class _Parser:
+    def __init__(self, text: str, repairs: list):
+        self.s = text
+        self.n = len(text)
+        self.i = 0
+        self.repairs = repairs
+
+    def note(self, msg: str):
+        if len(self.repairs) < 50:
+            self.repairs.append(f"{msg} @{self.i}")
+
+    # ---------------- TOP LEVEL ----------------
+    def parse(self):
+        starts = [p for p in (self.s.find("{"), self.s.find("[")) if p >= 0]
+        if not starts:
+            raise JsonRepairError("no JSON object or array in model output")
+        self.i = min(starts)
+        if self.i:
+            self.note("skipped leading text")
+        value = self.value()
+        self.ws()
+        if self.i < self.n:
+            self.note("dropped trailing text")
+        return value
+
+    def ws(self):
+        s, n = self.s, self.n
+        while True:
+            self.i = _WS.match(s, self.i).end()
+            if self.i >= n or s[self.i] not in "/`":
+                return
+            if s.startswith("//", self.i):
+                end = s.find("\n", self.i)
+                self.i = n if end < 0 else end + 1
+            elif s.startswith("/*", self.i):
+                end = s.find("*/", self.i + 2)
+                self.i = n if end < 0 else end + 2
+            elif s.startswith("```", self.i):
+                self.i += 3
+                while self.i < n and s[self.i].isalpha():  # ```json
+                    self.i += 1
+            else:
+                return
+
+    # ---------------- VALUES ----------------
+    def value(self):
+        self.ws()
+        if self.i >= self.n:
+            self.note("missing value at end of input")
+            return None
+        ch = self.s[self.i]
+        if ch in ",}]":  # {"a": , ...} — leave the delimiter to the enclosing object / array
+            self.note("missing value")
+            return None
+        if ch == "{":
+            return self.obj()
+        if ch == "[":
+            return self.arr()
+        if ch in "\"'":
+            return self.string(ch)
+        return self.bare()
+
+    def obj(self):
+        self.i += 1
+        out, placeholder = {}, False
+        while True:
+            self.ws()
+            if self.i >= self.n:
+                self.note("closed truncated object")
+                return out
+            ch = self.s[self.i]
+            if ch == "}":
+                self.i += 1
+                return _SKIP if placeholder and not out else out
+            if ch == ",":
+                self.i += 1
+                continue
+            if ch == "]":
+                self.note("stray ']' in object")
+                self.i += 1
+                continue
+            key = self.string(ch) if ch in "\"'" else self.bare(key=True)
+            if key is _SKIP:
+                continue
+            if not key.strip(".…") and ch not in "\"'":  # {...}
+                self.note("dropped placeholder")
+                placeholder = True
+                continue
+            self.ws()
+            if self.i < self.n and self.s[self.i] == ":":
+                self.i += 1
+            elif self.i >= self.n:
+                self.note(f"dropped key {key!r} without value")
+                return out
+            else:
+                self.note(f"missing ':' after {key!r}")
+            val = self.value()
+            if val is not _SKIP:
+                out[key] = val
+            self.ws()
+            if self.i < self.n and self.s[self.i] not in ",}":
+                self.note("missing ',' in object")
+
+    def arr(self) -> list:
+        self.i += 1
+        out = []
+        while True:
+            self.ws()
+            if self.i >= self.n:
+                self.note("closed truncated array")
+                return out
+            ch = self.s[self.i]
+            if ch == "]":
+                self.i += 1
+                return out
+            if ch == ",":
+                self.i += 1
+                continue
+            if ch in "}:":
+                self.note(f"stray {ch!r} in array")
+                self.i += 1
+                continue
+            val = self.value()
+            if val is not _SKIP:
+                out.append(val)
+
+    def string(self, quote: str) -> str:
+        s, n, plain = self.s, self.n, _PLAIN[quote]
+        self.i += 1
+        parts, start = [], self.i
+        while self.i < n:
+            self.i = plain.match(s, self.i).end()
+            if self.i >= n:
+                break
+            ch = s[self.i]
+            if ch == quote:
+                parts.append(s[start:self.i])
+                self.i += 1
+                return "".join(parts)
+            if ch == "\\" and self.i + 1 < n:
+                parts.append(s[start:self.i])
+                esc = s[self.i + 1]
+                if esc == "u" and self.i + 6 <= n:
+                    try:
+                        parts.append(chr(int(s[self.i + 2:self.i + 6], 16)))
+                        self.i += 6
+                        start = self.i
+                        continue
+                    except ValueError:
+                        pass
+                parts.append(_ESCAPES.get(esc, esc))
+                self.i += 2
+                start = self.i
+                continue
+            if ch < " ":  # raw control characters → space
+                parts.append(s[start:self.i] + " ")
+                self.i += 1
+                start = self.i
+                continue
+            self.i += 1
+        parts.append(s[start:])
+        self.note("closed truncated string")
+        return "".join(parts)
+
+    def bare(self, key: bool = False):
+        start = self.i
+        m = (_BARE_KEY if key else _BARE_VALUE).match(self.s, start)
+        if not m:  # unexpected single character: consume it so the pass always advances
+            self.i += 1
+            self.note(f"skipped {self.s[start]!r}")
+            return _SKIP
+        self.i = m.end()
+        token = m.group(0).strip()
+        if key:
+            return token
+        if token in _LITERALS:
+            if token[0].isupper():
+                self.note(f"converted {token}")
+            return _LITERALS[token]
+        if not token.strip(".…"):
+            self.note("dropped placeholder")
+            return _SKIP
+        if token[0] in "-0123456789":
+            try:
+                return json.loads(token)
+            except ValueError:
+                pass
+        self.note(f"quoted bare token {token[:20]!r}")
+        return token
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+json_stream.py — Incremental JSON boundary scanner for streamed model output
+----------------------------------------------------------------------------
+Fed chunk-by-chunk (Ollama NDJSON "response" pieces), it tracks string/escape
+state and bracket nesting so the caller can stop generation as soon as:
+- the top-level object closes  → state "complete"
+- the output can no longer become valid JSON → state "broken"
+"""
+
+PENDING, OPEN, COMPLETE, BROKEN = "pending", "open", "complete", "broken"
+
+_CLOSERS = {"}": "{", "]": "["}
+
+
+class JsonStreamScanner:
+    """Linear-time scanner; feed() is O(len(chunk))."""
+
+    def __init__(self, max_preamble: int = 2000):
+        self.state = PENDING
+        self.max_preamble = max_preamble  # non-JSON chars tolerated before the first '{'
+        self.reason = ""
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._preamble = 0
+        self._parts = []
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk; returns the new state."""
+        if self.state in (COMPLETE, BROKEN) or not chunk:
+            return self.state
+
+        start = 0
+        for i, ch in enumerate(chunk):
+            if self.state == PENDING:
+                if ch == "{":
+                    self.state = OPEN
+                    self._stack.append("{")
+                    start = i
+                elif not ch.isspace():
+                    self._preamble += 1
+                    if self._preamble > self.max_preamble:
+                        return self._break("no JSON object in output preamble")
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack or self._stack[-1] != _CLOSERS[ch]:
+                    self._parts.append(chunk[start:i + 1])
+                    return self._break(f"mismatched '{ch}'")
+                self._stack.pop()
+                if not self._stack:
+                    self._parts.append(chunk[start:i + 1])
+                    self.state = COMPLETE
+                    return self.state
+
+        if self.state == OPEN:
+            self._parts.append(chunk[start:])
+        return self.state
+
+    def _break(self, reason: str) -> str:
+        self.state = BROKEN
+        self.reason = reason
+        return self.state
+
+    @property
+    def text(self) -> str:
+        """JSON text captured so far (from the first '{')."""
+        return "".join(self._parts)
+
+    @property
+    def depth(self) -> int:
+        return len(self._stack)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+llm_cache.py — SQLite-backed cache of Ollama responses
+------------------------------------------------------
+- Key = SHA-256 of the final request payload (model, system, prompt, options, format)
+- TTL expiry + size bound in bytes of stored responses (least-recently-used rows dropped first)
+- One short-lived connection per call (closed after its transaction) → safe from threads and worker processes
+"""
+
+import os, json, time, hashlib, sqlite3
+from contextlib import contextmanager
+
+# Payload fields that do not change the answer (transport-only)
+_TRANSPORT_KEYS = ("stream", "keep_alive")
+
+
+def payload_key(payload: dict) -> str:
+    """Stable hash of everything in the payload that affects the completion."""
+    material = {k: v for k, v in payload.items() if k not in _TRANSPORT_KEYS}
+    blob = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Disk cache of raw model responses with TTL and size-bounded LRU eviction."""
+
+    def __init__(self, db_path: str = "llm_cache.sqlite", ttl_seconds: float = 7 * 24 * 3600,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT,"
+                " response TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection: commit (or roll back) its transaction, then close it."""
+        con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def get(self, key: str):
+        """Cached response text, or None when missing/expired."""
+        now = time.time()
+        try:
+            with self._connect() as con:
+                row = con.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if not row:
+                    return None
+                response, created = row
+                if self.ttl_seconds and now - created > self.ttl_seconds:
+                    con.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                con.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                return response
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache read failed: {e}")
+            return None
+
+    def put(self, key: str, response: str, model: str = ""):
+        """Store a response, then apply TTL and size eviction."""
+        now = time.time()
+        try:
+            with self._connect() as con:
+                con.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, response, now, now),
+                )
+                self._evict(con, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache write failed: {e}")
+
+    def _evict(self, con, now: float):
+        if self.ttl_seconds:
+            con.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        if self.max_bytes:
+            # keep the most recently used responses whose running size fits in max_bytes
+            con.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM (SELECT key, SUM(length(CAST(response AS BLOB)))"
+                " OVER (ORDER BY accessed DESC, key) AS running FROM responses) WHERE running > ?)",
+                (self.max_bytes,),
+            )
+
+    def clear(self):
+        with self._connect() as con:
+            con.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._connect() as con:
+            n, size = con.execute("SELECT COUNT(*), COALESCE(SUM(length(CAST(response AS BLOB))), 0)"
+                                  " FROM responses").fetchone()
+        return {"db": os.path.abspath(self.db_path), "entries": n, "size_mb": round(size / (1024 * 1024), 2),
+                "ttl_hours": round(self.ttl_seconds / 3600, 1), "max_mb": round(self.max_bytes / (1024 * 1024), 2)}
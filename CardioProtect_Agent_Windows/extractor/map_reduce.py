@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+map_reduce.py — Map-reduce extraction for studies larger than one prompt
+------------------------------------------------------------------------
+- windows(): consecutive passage windows covering the whole study body (reference list excluded),
+  each sized to the evidence budget of one call; passages keep their section / page tags
+- evidence(): BM25 relevance of every window to a sheet's query (drives the "evidence" policy)
+- reduce_rows(): merge the partial rows one sheet got from each window, deterministically:
+    first     → first non-NR value in document order
+    majority  → most frequent non-NR value (ties → earliest window)
+    evidence  → non-NR value from the window most relevant to the sheet (ties → earliest window)
+  Rows are matched across windows by their identity columns (arm / outcome / timepoint / AE / subgroup);
+  sheets without identity columns are study-level and merge row by row. All-NR rows are dropped when a
+  window answered anything, and a partly identified row folds into the one row that completes its identity.
+"""
+
+import re
+from collections import Counter
+
+POLICIES = ("first", "majority", "evidence")
+EMPTY = ("NR", "", None, "NA")
+_KEY_RE = re.compile(r"^(?:Arm_Name|Arm_Comparison|Outcome_Name|Timepoint|AE_Name|Pre-specified_Subgroups)\b")
+_SKIP_SECTIONS = ("references", "acknowledgments", "acknowledgements")
+
+
+def windows(index, budget: int, cost, body_end: int | None = None) -> list[list[dict]]:
+    """Greedy, document-order windows of passages whose cost(passage) sum stays ≤ budget."""
+    out, current, used = [], [], 0
+    for chunk in index.chunks:
+        if chunk["section"] in _SKIP_SECTIONS or (body_end is not None and chunk["start"] >= body_end):
+            continue
+        price = cost(chunk)
+        if current and used + price > budget:
+            out.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += price
+    if current:
+        out.append(current)
+    return out
+
+
+def evidence(index, wins: list[list[dict]], weights) -> list[float]:
+    """Summed BM25 score of each window's passages for one query."""
+    scores = index.score(weights)
+    return [round(sum(scores[c["id"]] for c in win), 3) for win in wins]
+
+
+def _norm(value) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(value).lower())
+
+
+def _pick(candidates: list[tuple], policy: str):
+    """candidates: [(window, score, value)] non-empty, in window order."""
+    if policy == "first":
+        return candidates[0][2]
+    if policy == "majority":
+        counts = Counter(_norm(v) for _, _, v in candidates)
+        best = max(counts.values())
+        return next(v for _, _, v in candidates if counts[_norm(v)] == best)
+    top = max(score for _, score, _ in candidates)
+    return next(v for _, score, v in candidates if score == top)
+
+
+def _fold(groups: dict, idents: dict):
+    """
+    Merge each group into the one smallest group whose identity strictly contains its own
+    (CTRCD / NR timepoint → CTRCD / 12 months); kept apart when two such groups compete.
+    """
+    for key in sorted(groups, key=lambda k: len(idents[k])):
+        supers = [o for o in groups if o != key and idents[key].items() < idents[o].items()]
+        minimal = [o for o in supers if not any(idents[x].items() < idents[o].items() for x in supers)]
+        if len(minimal) == 1:
+            groups[minimal[0]].extend(groups.pop(key))
+
+
+def reduce_rows(partials: list[tuple], columns: list[str], policy: str = "evidence") -> list[dict]:
+    """
+    partials: [(window index, evidence score, rows)] for one sheet → merged rows ([] when none).
+    ✅ Row identity = normalized identity columns; rows without identity values align by position
+    ✅ All-NR rows are dropped as soon as any window answered a real row
+    ✅ A row identified by fewer columns folds into the one row that matches it on all of them
+    ✅ Each cell keeps the value the policy picks among non-NR candidates (NR when there are none)
+    """
+    keys = [c for c in columns if _KEY_RE.match(c)]
+    parts = [(wi, score, [r for r in rows or [] if isinstance(r, dict)])
+             for wi, score, rows in sorted(partials, key=lambda p: p[0])]
+    real = any(v not in EMPTY for _, _, rows in parts for r in rows for v in r.values())
+    groups, idents = {}, {}
+    for wi, score, rows in parts:
+        for ri, row in enumerate(rows):
+            if real and all(row.get(c) in EMPTY for c in columns):
+                continue
+            ident = {k: _norm(row.get(k)) for k in keys if row.get(k) not in EMPTY}
+            key = ("id",) + tuple(sorted(ident.items())) if ident else ("row", ri)
+            groups.setdefault(key, []).append((wi, score, row))
+            idents[key] = ident
+    if keys:
+        _fold(groups, idents)
+    merged = []
+    for members in groups.values():
+        members.sort(key=lambda m: m[0])
+        out = {}
+        for col in columns:
+            candidates = [(wi, score, row[col]) for wi, score, row in members if row.get(col) not in EMPTY]
+            out[col] = _pick(candidates, policy) if candidates else "NR"
+        merged.append(out)
+    return merged
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ocr.py — OCR stage for text-less (scanned) pages
+------------------------------------------------
+- render(): one page of the already open PyMuPDF document → grayscale pixels at a configurable DPI
+- page_key(): SHA-256 of the rendered pixels + DPI + language + OCR_VERSION, so a re-scanned PDF with
+  identical pages, and duplicate pages inside one PDF, resolve to the same cache entry
+- run(): pages render one at a time; cache hits and duplicates are answered at once, misses go to
+  tesseract — in one process pool reused for the life of the process (at most 2 renders queued per
+  worker), or inline when workers == 1
+- results: { page number: text | Exception } (errors are returned, never cached)
+"""
+
+import hashlib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+
+OCR_VERSION = "1"
+_IN_FLIGHT = 2  # rendered pages queued per worker (bounds the images held in memory)
+_POOL, _POOL_SIZE = None, 0
+_POOL_LOCK = threading.Lock()
+
+
+def render(page, dpi: int) -> tuple[int, int, bytes]:
+    """(width, height, 8-bit grayscale samples) of one page."""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return pix.width, pix.height, pix.samples
+
+
+def page_key(image: tuple, dpi: int, lang: str) -> str:
+    width, height, samples = image
+    h = hashlib.sha256(f"ocr{OCR_VERSION}|{dpi}|{lang}|{width}x{height}|".encode("utf-8"))
+    h.update(samples)
+    return h.hexdigest()
+
+
+def _tesseract(image: tuple, lang: str, tesseract_cmd: str | None = None) -> str:
+    """Worker: tesseract on one grayscale image (top-level so process pools can pickle it)."""
+    import pytesseract
+    from PIL import Image
+
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    width, height, samples = image
+    img = Image.frombytes("L", (width, height), samples)
+    return pytesseract.image_to_string(img, lang=lang).strip()
+
+
+def _result(fut):
+    try:
+        return fut.result()
+    except Exception as e:
+        return e
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    """The process's OCR pool (created on first use, reused across documents and OCR batches)."""
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_SIZE != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            _POOL, _POOL_SIZE = ProcessPoolExecutor(max_workers=workers), workers
+        return _POOL
+
+
+def _drop_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False)
+        _POOL = None
+
+
+def run(doc, page_numbers, dpi: int = 300, lang: str = "eng", workers: int = 1, cache=None,
+        tesseract_cmd: str | None = None) -> dict:
+    """
+    OCR the given 1-based pages of an open PyMuPDF document.
+    ✅ Pages render lazily, in this process; at most _IN_FLIGHT × workers renders wait for a worker,
+       and only the pixels travel to it
+    ✅ Identical renders (cached or duplicated within the document) are OCR'd once
+    ✅ workers > 1 → one process pool per process, reused by every call (workers == 1 → inline)
+    🔹 cache: any object with get(key) / put(key, payload) — the parse cache in practice
+    """
+    page_numbers = list(page_numbers)
+    results, texts, waiting, futures = {}, {}, {}, {}
+    pool = _pool(workers) if workers > 1 and len(page_numbers) > 1 else None
+
+    def finish(key, text):
+        texts[key] = text
+        if cache is not None and not isinstance(text, Exception):
+            cache.put(key, {"text": text})
+        for number in waiting.pop(key):
+            results[number] = text
+
+    def ocr_inline(key, image):
+        try:
+            finish(key, _tesseract(image, lang, tesseract_cmd))
+        except Exception as e:
+            finish(key, e)
+
+    for number in page_numbers:
+        image = render(doc[number - 1], dpi)
+        key = page_key(image, dpi, lang)
+        if key in texts:
+            results[number] = texts[key]
+            continue
+        if key in waiting:
+            waiting[key].append(number)
+            continue
+        hit = cache.get(key) if cache is not None else None
+        if isinstance(hit, dict) and "text" in hit:
+            results[number] = texts[key] = hit["text"]
+            continue
+        waiting[key] = [number]
+        if pool is None:
+            ocr_inline(key, image)
+            continue
+        try:
+            futures[pool.submit(_tesseract, image, lang, tesseract_cmd)] = key
+        except BrokenProcessPool:
+            _drop_pool()
+            pool = None
+            ocr_inline(key, image)
+            continue
+        del image
+        if len(futures) >= _IN_FLIGHT * workers:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                finish(futures.pop(fut), _result(fut))
+
+    for fut in as_completed(list(futures)):
+        finish(futures.pop(fut), _result(fut))
+    if any(isinstance(t, BrokenProcessPool) for t in texts.values()):
+        _drop_pool()
+    return results
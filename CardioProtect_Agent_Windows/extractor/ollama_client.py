@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ollama_client.py — Shared, pooled HTTP clients for the local Ollama server
+--------------------------------------------------------------------------
+- One requests.Session with a sized connection pool (keep-alive, no per-call TCP setup)
+- Liveness probe (/api/tags) cached for a short TTL (only the probe writes the verdict)
+- Circuit breaker: after N consecutive failures every caller fails fast;
+  after reset_timeout a single half-open probe decides whether to close again
+- AsyncOllamaClient: httpx-based twin for the asyncio engine, sharing the same breaker
+"""
+
+import time, threading
+import requests
+from requests.adapters import HTTPAdapter
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class OllamaUnavailableError(RuntimeError):
+    """Raised when the server gave no answer (down, open circuit, 5xx, retries exhausted) — never an empty one."""
+
+
+class CircuitOpenError(OllamaUnavailableError):
+    """Raised when the breaker is open and the call was not attempted."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker + cached liveness, shared by sync and async clients."""
+
+    def __init__(self, alive_ttl: float = 10.0, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.alive_ttl = alive_ttl
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._alive_at = 0.0
+        self._alive = False
+
+    def acquire(self) -> bool:
+        """May a call go out now? Moves open → half-open after reset_timeout (one caller only)."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open slot without a verdict (e.g. caller-side error)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def cached_alive(self):
+        """Fresh cached liveness verdict, or None when a probe is due."""
+        with self._lock:
+            if self._state == CLOSED and time.time() - self._alive_at < self.alive_ttl:
+                return self._alive
+        return None
+
+    def record_success(self, probe: bool = False):
+        """A call (or the liveness probe, probe=True) got through; only the probe refreshes cached_alive()."""
+        with self._lock:
+            if self._state != CLOSED:
+                print("🟢 Ollama reachable again — circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            if probe:
+                self._alive, self._alive_at = True, time.time()
+
+    def record_failure(self, probe: bool = False):
+        """
+        A call (or the liveness probe, probe=True) failed.
+        🔹 A failed generate only counts towards the threshold: it never caches "not alive" for other callers
+        """
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if probe:
+                self._alive, self._alive_at = False, time.time()
+            if self._state == HALF_OPEN:
+                print("🛑 Ollama recovery probe failed — circuit re-opened")
+            elif self._state == CLOSED and self._failures >= self.failure_threshold:
+                print(f"🛑 Ollama circuit opened after {self._failures} failure(s) — failing fast for {self.reset_timeout:.0f}s")
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.time()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"circuit": self._state, "consecutive_failures": self._failures, "last_alive": self._alive}
+
+
+class OllamaClient:
+    """Thread-safe Ollama client shared by all sessions in a process."""
+
+    def __init__(self, generate_url: str = "http://localhost:11434/api/generate", pool_size: int = 16,
+                 alive_ttl: float = 10.0, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.generate_url = generate_url
+        self.base_url = generate_url.split("/api/")[0]
+        self.breaker = CircuitBreaker(alive_ttl, failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # ---------------- LIVENESS ----------------
+    def alive(self) -> bool:
+        """Cached /api/tags probe; never probes while the circuit is open."""
+        cached = self.breaker.cached_alive()
+        if cached is not None:
+            return cached
+        if not self.breaker.acquire():
+            return False
+        try:
+            r = self.session.get(f"{self.base_url}/api/tags", timeout=5)
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+        if ok:
+            self.breaker.record_success(probe=True)
+        else:
+            self.breaker.record_failure(probe=True)
+        return ok
+
+    # ---------------- GENERATE ----------------
+    def generate(self, payload: dict, timeout: float = 600, stream: bool = False) -> requests.Response:
+        """POST /api/generate through the pool; connection errors and 5xx feed the breaker."""
+        if not self.breaker.acquire():
+            raise CircuitOpenError("Ollama circuit open")
+        try:
+            resp = self.session.post(self.generate_url, json=payload, timeout=timeout, stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.release()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    def status(self) -> dict:
+        return {**self.breaker.status(), "url": self.base_url}
+
+
+class AsyncOllamaClient:
+    """
+    asyncio twin of OllamaClient (httpx.AsyncClient with a bounded pool).
+    Bind one instance per event loop; pass the sync client's breaker to share circuit state.
+    """
+
+    def __init__(self, generate_url: str = "http://localhost:11434/api/generate", pool_size: int = 16,
+                 breaker: CircuitBreaker | None = None):
+        import httpx
+        self._httpx = httpx
+        self.generate_url = generate_url
+        self.base_url = generate_url.split("/api/")[0]
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+        )
+
+    async def alive(self) -> bool:
+        cached = self.breaker.cached_alive()
+        if cached is not None:
+            return cached
+        if not self.breaker.acquire():
+            return False
+        try:
+            r = await self.client.get(f"{self.base_url}/api/tags", timeout=5)
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+        if ok:
+            self.breaker.record_success(probe=True)
+        else:
+            self.breaker.record_failure(probe=True)
+        return ok
+
+    async def generate(self, payload: dict, timeout: float = 600):
+        """Non-streaming POST; returns the decoded JSON body (raises on HTTP ≥ 500)."""
+        if not self.breaker.acquire():
+            raise CircuitOpenError("Ollama circuit open")
+        try:
+            resp = await self.client.post(self.generate_url, json=payload, timeout=timeout)
+        except (self._httpx.TransportError, self._httpx.TimeoutException):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+            resp.raise_for_status()
+        self.breaker.record_success()
+        return resp.json()
+
+    def stream(self, payload: dict, timeout: float = 600):
+        """Streaming POST context manager (async with … as resp: async for line in resp.aiter_lines())."""
+        if not self.breaker.acquire():
+            raise CircuitOpenError("Ollama circuit open")
+        return _BreakerStream(self, payload, timeout)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class _BreakerStream:
+    """async context manager that feeds the breaker from a streaming response."""
+
+    def __init__(self, owner: AsyncOllamaClient, payload: dict, timeout: float):
+        self._owner = owner
+        self._cm = owner.client.stream("POST", owner.generate_url, json=payload, timeout=timeout)
+
+    async def __aenter__(self):
+        httpx = self._owner._httpx
+        try:
+            resp = await self._cm.__aenter__()
+        except (httpx.TransportError, httpx.TimeoutException):
+            self._owner.breaker.record_failure()
+            raise
+        except BaseException:
+            self._owner.breaker.release()
+            raise
+        if resp.status_code >= 500:
+            self._owner.breaker.record_failure()
+        else:
+            self._owner.breaker.record_success()
+        return resp
+
+    async def __aexit__(self, *exc):
+        return await self._cm.__aexit__(*exc)
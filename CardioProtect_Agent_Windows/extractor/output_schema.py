@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+output_schema.py — JSON Schema for sheet answers (Ollama structured outputs)
+----------------------------------------------------------------------------
+- sheet_schema(): { sheet: [ {col: string, ...} ] } schema built from template columns,
+  sent as the payload's "format" so the model can only emit that shape
+- validate(): small local validator for exactly the subset of JSON Schema built here
+- conform(): coerce a near-miss answer onto the schema (no second model call)
+"""
+
+import re
+
+NR = "NR"
+
+
+def sheet_schema(sheets: dict) -> dict:
+    """
+    Schema for one call answering { sheet: [columns] }.
+    ✅ Every sheet and every column is required; cells are strings ("NR" when not reported)
+    🔹 No extra keys, so grammar-constrained decoding cannot invent or rename columns
+    """
+    return {
+        "type": "object",
+        "properties": {
+            sheet: {
+                "type": "array",
+                "minItems": 1,
+                "items": {
+                    "type": "object",
+                    "properties": {col: {"type": "string"} for col in columns},
+                    "required": list(columns),
+                    "additionalProperties": False,
+                },
+            }
+            for sheet, columns in sheets.items()
+        },
+        "required": list(sheets),
+        "additionalProperties": False,
+    }
+
+
+def validate(data, schema: dict, path: str = "$") -> list[str]:
+    """Violations of a sheet_schema() schema ([] when data conforms)."""
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(data, dict):
+            return [f"{path}: expected object"]
+        props = schema.get("properties", {})
+        errors = [f"{path}: missing {key!r}" for key in schema.get("required", []) if key not in data]
+        for key, value in data.items():
+            if key in props:
+                errors += validate(value, props[key], f"{path}.{key}")
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected {key!r}")
+        return errors
+    if kind == "array":
+        if not isinstance(data, list):
+            return [f"{path}: expected array"]
+        errors = [f"{path}: fewer than {schema['minItems']} item(s)"] if len(data) < schema.get("minItems", 0) else []
+        for i, item in enumerate(data):
+            errors += validate(item, schema.get("items", {}), f"{path}[{i}]")
+        return errors
+    if kind == "string" and not isinstance(data, str):
+        return [f"{path}: expected string"]
+    return []
+
+
+def _cell(value) -> str:
+    if value is None:
+        return NR
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, (list, tuple)):
+        return "; ".join(_cell(v) for v in value) or NR
+    if isinstance(value, dict):
+        return "; ".join(f"{k}: {_cell(v)}" for k, v in value.items()) or NR
+    return str(value).strip() or NR
+
+
+def _norm(key) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(key).lower())
+
+
+def _lookup(obj: dict, key: str):
+    """obj[key], else the entry whose key matches ignoring case / spacing / punctuation."""
+    if key in obj:
+        return obj[key]
+    want = _norm(key)
+    for k, v in obj.items():
+        if _norm(k) == want:
+            return v
+    return None
+
+
+def conform(data, sheets: dict) -> dict:
+    """
+    Map an answer onto { sheet: [ {col: str} ] } for the given sheets.
+    ✅ A single row object becomes a one-row list; non-string cells are stringified
+    ✅ Sheet / column keys match ignoring case, spacing and punctuation ("study id" → "Study_ID")
+    ✅ Missing columns → "NR", unknown columns dropped; missing sheets are left out
+    🔹 A bare row (no sheet key) is accepted when exactly one sheet was asked for
+    """
+    if not isinstance(data, dict):
+        return {}
+    if len(sheets) == 1 and all(_lookup(data, s) is None for s in sheets):
+        only = next(iter(sheets))
+        if any(_lookup(data, col) is not None for col in sheets[only]):
+            data = {only: [data]}
+
+    out = {}
+    for sheet, columns in sheets.items():
+        rows = _lookup(data, sheet)
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not isinstance(rows, list):
+            continue
+        rows = [r for r in rows if isinstance(r, dict)] or [{}]
+        out[sheet] = [{col: _cell(_lookup(r, col)) for col in columns} for r in rows]
+    return out
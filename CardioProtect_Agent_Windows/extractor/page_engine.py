@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+page_engine.py — Hybrid PyMuPDF / pdfplumber page parser
+---------------------------------------------------------
+- Body text for every page comes from PyMuPDF (fast), laid out the way pdfplumber's extract_text()
+  does it: words clustered into lines by their top edge (3 pt tolerance), lines top-to-bottom,
+  words left-to-right joined by one space, ligatures expanded, page rotation applied; only horizontal
+  lines form the body — rotated lines (landscape tables, margin notes) follow it as their own blocks
+- table_candidate(): cheap ruling-line check on the page's vector drawings — pdfplumber's default
+  ("lines") table finder only builds cells from ruling lines / rectangle edges and keeps tables of
+  two or more cells, so a page whose edges cross fewer than 6 times (or whose ruled grid holds no
+  words) cannot yield a table row and is never sent to it
+- pdfplumber extract_tables() runs only on flagged pages (opened lazily, once per PDF); each
+  pdfplumber page's layout cache is dropped right after, so memory stays flat on long supplements
+- iter_pages() yields the usual page records one by one: {page, text, tables, ocr, table_candidate};
+  parse() is the list form
+"""
+
+import fitz
+import pdfplumber
+
+PAGE_ENGINE_VERSION = "2"
+# pdfplumber defaults: y_tolerance for line clustering, edge_min_length / snap tolerance for table edges
+_LINE_TOLERANCE = 3.0
+_EDGE_MIN = 3.0
+_SNAP_TOLERANCE = 3.0
+_MIN_INTERSECTIONS = 6  # 3 x 2 crossings = two adjacent cells
+_WORD_FLAGS = fitz.TEXTFLAGS_WORDS & ~fitz.TEXT_PRESERVE_LIGATURES
+# Rotation that turns each writing direction (on the displayed page) into left-to-right
+_UPRIGHT = {(1, 0): fitz.Matrix(0), (0, -1): fitz.Matrix(90), (-1, 0): fitz.Matrix(180), (0, 1): fitz.Matrix(270)}
+OCR_BATCH = 16  # consecutive text-less pages OCR'd together (bounds held records and rendered images)
+
+
+def _direction(d, matrix) -> tuple[int, int]:
+    """Writing direction of a line on the displayed page, snapped to the nearest axis."""
+    v = fitz.Point(d) * fitz.Matrix(matrix.a, matrix.b, matrix.c, matrix.d, 0, 0)
+    if abs(v.x) >= abs(v.y):
+        return (1 if v.x >= 0 else -1), 0
+    return 0, (1 if v.y > 0 else -1)
+
+
+def _lines(rows: list) -> list[str]:
+    """(top, x0, word) rows → lines: top-edge clustering (3 pt), words left-to-right."""
+    rows.sort()
+    lines, current, last_top = [], [], None
+    for top, x0, word in rows:
+        if current and top - last_top > _LINE_TOLERANCE:
+            lines.append(current)
+            current = []
+        current.append((x0, word))
+        last_top = top
+    if current:
+        lines.append(current)
+    return [" ".join(word for _, word in sorted(line)) for line in lines]
+
+
+def page_text(page, words=None, textpage=None) -> str:
+    """
+    pdfplumber-style plain text of one PyMuPDF page.
+    🔹 Only horizontal lines form the body; rotated lines (landscape tables, margin notes) are laid out
+       the same way in their own reading frame and follow the body as separate blocks
+    """
+    if textpage is None:
+        textpage = page.get_textpage(flags=_WORD_FLAGS)
+    if words is None:
+        words = page.get_text("words", textpage=textpage)
+    matrix = page.rotation_matrix
+    dirs = {(b, l): line["dir"]
+            for b, block in enumerate(page.get_text("dict", textpage=textpage)["blocks"])
+            for l, line in enumerate(block.get("lines", ()))}
+    groups = {}
+    for w in words:
+        key = _direction(dirs.get((w[5], w[6]), (1, 0)), matrix)
+        r = fitz.Rect(w[:4]) * matrix
+        if key != (1, 0):
+            r *= _UPRIGHT[key]
+        groups.setdefault(key, []).append((r.y0, r.x0, w[4]))
+    body = _lines(groups.pop((1, 0), []))
+    for key in sorted(groups):
+        body += _lines(groups[key])
+    return "\n".join(body)
+
+
+def _edges(page) -> tuple[list, list]:
+    """Horizontal (y, x0, x1) and vertical (x, y0, y1) ruling edges from lines and rectangles."""
+    horizontal, vertical = [], []
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= _EDGE_MIN:
+                    horizontal.append((p1.y, min(p1.x, p2.x), max(p1.x, p2.x)))
+                elif abs(p1.x - p2.x) < 1 and abs(p1.y - p2.y) >= _EDGE_MIN:
+                    vertical.append((p1.x, min(p1.y, p2.y), max(p1.y, p2.y)))
+            elif item[0] in ("re", "qu"):
+                r = item[1].rect if item[0] == "qu" else item[1]
+                if r.width >= _EDGE_MIN:
+                    horizontal += [(r.y0, r.x0, r.x1), (r.y1, r.x0, r.x1)]
+                if r.height >= _EDGE_MIN:
+                    vertical += [(r.x0, r.y0, r.y1), (r.x1, r.y0, r.y1)]
+    return horizontal, vertical
+
+
+def table_candidate(page, words=None) -> bool:
+    """
+    True when the page's ruling lines cross often enough to form a two-cell table with text in it.
+    🔹 pdfplumber drops single-cell "tables" (plain frames / boxes), so ≥ 6 snapped intersections are needed
+    🔹 A ruled grid with no words inside (plot axes, figure frames) only yields empty rows
+    """
+    horizontal, vertical = _edges(page)
+    if len(horizontal) < 3 and len(vertical) < 3:
+        return False
+    tol = _SNAP_TOLERANCE
+    points = {}
+    for y, x0, x1 in horizontal:
+        for x, y0, y1 in vertical:
+            if x0 - tol <= x <= x1 + tol and y0 - tol <= y <= y1 + tol:
+                points[(round(x / tol), round(y / tol))] = (x, y)
+    if len(points) < _MIN_INTERSECTIONS:
+        return False
+    xs = [x for x, _ in points.values()]
+    ys = [y for _, y in points.values()]
+    grid = fitz.Rect(min(xs), min(ys), max(xs), max(ys))
+    words = page.get_text("words", flags=_WORD_FLAGS) if words is None else words
+    return any(grid.intersects(w[:4]) for w in words)
+
+
+def _tables(plumber_page) -> list:
+    """Table rows of one pdfplumber page, then drop the page's layout cache (chars, edges, objects)."""
+    try:
+        return [[row for row in table if any(row)] for table in plumber_page.extract_tables() or []]
+    finally:
+        plumber_page.close()
+
+
+def _needs_ocr(rec: dict) -> bool:
+    return not rec["text"].strip() and not any(rec["tables"])
+
+
+def _ocr_records(doc, records: list[dict], ocr) -> None:
+    """Fill "ocr" on the given text-less records (one batched OCR call)."""
+    by_page = {rec["page"]: rec for rec in records}
+    for number, text in ocr(doc, list(by_page)).items():
+        if isinstance(text, Exception):
+            by_page[number]["ocr_error"] = str(text)  # keeps this parse out of the cache
+        else:
+            by_page[number]["ocr"] = text
+
+
+def _stream(doc, records, ocr, ocr_batch: int):
+    """
+    Yield records in page order; runs of text-less pages are held back and OCR'd together
+    (at most ocr_batch at a time) while the document is still open.
+    """
+    held = []
+    for rec in records:
+        if ocr is not None and _needs_ocr(rec):
+            held.append(rec)
+            if len(held) >= ocr_batch:
+                _ocr_records(doc, held, ocr)
+                yield from held
+                held = []
+            continue
+        if held:
+            _ocr_records(doc, held, ocr)
+            yield from held
+            held = []
+        yield rec
+    if held:
+        _ocr_records(doc, held, ocr)
+        yield from held
+
+
+def iter_pages(pdf_path: str, ocr=None, ocr_batch: int = OCR_BATCH):
+    """
+    Page records for a PDF, one at a time (no caching).
+    ✅ Text: PyMuPDF on every page; tables: pdfplumber on table-candidate pages only
+    ✅ Each page's PyMuPDF / pdfplumber objects are released before the next page is read
+    🔹 ocr(doc, page numbers) → { page: text | Exception } runs on the still-open document for the
+       pages that have no text and no tables
+    """
+    plumber = None
+
+    def records(doc):
+        nonlocal plumber
+        for i in range(1, doc.page_count + 1):
+            page = doc.load_page(i - 1)
+            textpage = page.get_textpage(flags=_WORD_FLAGS)
+            words = page.get_text("words", textpage=textpage)
+            rec = {"page": i, "text": page_text(page, words, textpage), "tables": [], "ocr": "",
+                   "table_candidate": table_candidate(page, words)}
+            del page, words, textpage
+            if rec["table_candidate"]:
+                if plumber is None:
+                    plumber = pdfplumber.open(pdf_path)
+                rec["tables"] = _tables(plumber.pages[i - 1])
+            yield rec
+
+    try:
+        with fitz.open(pdf_path) as doc:
+            yield from _stream(doc, records(doc), ocr, ocr_batch)
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+
+def iter_pages_full(pdf_path: str, ocr=None, ocr_batch: int = OCR_BATCH):
+    """Reference path: pdfplumber text + tables on every page (slow; for comparisons / fallback)."""
+    def records(pdf):
+        for i, page in enumerate(pdf.pages, start=1):
+            text = page.extract_text() or ""
+            yield {"page": i, "text": text, "tables": _tables(page), "ocr": ""}
+
+    with pdfplumber.open(pdf_path) as pdf, fitz.open(pdf_path) as doc:
+        yield from _stream(doc, records(pdf), ocr, ocr_batch)
+
+
+def parse(pdf_path: str, ocr=None) -> list[dict]:
+    """All page records of a PDF (hybrid engine)."""
+    return list(iter_pages(pdf_path, ocr))
+
+
+def parse_full(pdf_path: str, ocr=None) -> list[dict]:
+    """All page records of a PDF (pdfplumber reference path)."""
+    return list(iter_pages_full(pdf_path, ocr))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+parse_cache.py — Content-addressed cache for parsed PDF pages
+-------------------------------------------------------------
+- Key = SHA-256 of the PDF bytes + extractor version + parse settings
+- One JSON file per entry: page records [ {page, text, tables, ocr}, ... ] (StudyDocuments are built from them)
+- Size-bounded LRU eviction (last access tracked via file mtime)
+- Safe across threads and worker processes (atomic temp-file writes)
+
+💡 Usage examples:
+
+# Show cache size / entry count
+python -m extractor.parse_cache --stats
+
+# Pre-parse a folder of PDFs so later runs skip PDF parsing
+python -m extractor.parse_cache --warm Input_PDFs
+
+# Drop everything
+python -m extractor.parse_cache --clear
+"""
+
+import os, json, hashlib, tempfile, shutil, threading, time
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Stream a file through SHA-256 (no full read into memory)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache:
+    """On-disk LRU cache of parsed page records, addressed by document content."""
+
+    def __init__(self, cache_dir: str = "parse_cache", max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._digests = {}  # (path, mtime_ns, size) → sha256, so page + document lookups hash once
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ---------------- KEYS ----------------
+    def key_for(self, pdf_path: str, version: str, settings: dict | None = None) -> str:
+        """Cache key for a PDF under a given extractor version and settings."""
+        blob = json.dumps({"sha256": self._digest(pdf_path), "version": version,
+                           "settings": settings or {}}, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _digest(self, path: str) -> str:
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            digest = self._digests[memo_key] = file_sha256(path)
+        return digest
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    # ---------------- READ / WRITE ----------------
+    def get(self, key: str):
+        """Return cached payload or None. A hit refreshes the entry's LRU position."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path, None)  # mark as recently used
+            return data
+        except Exception as e:
+            print(f"⚠️ Parse cache entry unreadable ({os.path.basename(path)}): {e}")
+            return None
+
+    def put(self, key: str, payload) -> bool:
+        """Atomically store payload, then evict least-recently-used entries over budget."""
+        path = self._path(key)
+        try:
+            with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8",
+                                             dir=self.cache_dir, suffix=".tmp") as tmp:
+                json.dump(payload, tmp, ensure_ascii=False)
+                tmp_path = tmp.name
+            shutil.move(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️ Failed writing parse cache entry: {e}")
+            return False
+        self.evict()
+        return True
+
+    # ---------------- MAINTENANCE ----------------
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self) -> int:
+        """Remove oldest-accessed entries until total size ≤ max_bytes. Returns count removed."""
+        removed = 0
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "dir": os.path.abspath(self.cache_dir),
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+        }
+
+    def clear(self) -> int:
+        removed = 0
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import mapper
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stats", action="store_true", help="Print cache size and entry count")
+    ap.add_argument("--clear", action="store_true", help="Delete all cached documents")
+    ap.add_argument("--warm", help="PDF file or folder to parse into the cache")
+    args = ap.parse_args()
+
+    cache = mapper._get_parse_cache()
+    if args.clear:
+        print(f"🧹 Removed {cache.clear()} cached document(s)")
+    if args.warm:
+        targets = [args.warm] if os.path.isfile(args.warm) else [
+            os.path.join(args.warm, f) for f in sorted(os.listdir(args.warm)) if f.lower().endswith(".pdf")
+        ]
+        for pdf in targets:
+            t0 = time.time()
+            doc = mapper.load_document(pdf)
+            print(f"📄 {os.path.basename(pdf)} → {len(doc.pages)} pages, {len(doc.headings)} headings "
+                  f"({time.time() - t0:.1f}s)")
+    if args.stats or not (args.clear or args.warm):
+        print(json.dumps(cache.stats(), indent=2))
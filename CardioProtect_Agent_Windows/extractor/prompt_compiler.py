@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+prompt_compiler.py — Token-budgeted prompt assembly
+---------------------------------------------------
+- estimate_tokens(): local, dependency-free estimate of Llama-3 BPE token counts
+- fit_to_tokens(): longest prefix of a text that fits a token budget (unchanged if it already fits)
+- PromptCompiler: memoizes the static per-sheet part of a prompt and sizes the dynamic
+  context so  wrapper + static + context + reserved output  ==  num_ctx
+- OutputStats: measured answer size per sheet (EWMA, persisted as JSON) for batch packing
+"""
+
+import os, re, json, math, tempfile, threading
+
+# Pieces a BPE tokenizer roughly maps to whole tokens:
+# letter runs (with one leading space), digit groups of ≤ 3, rules like "=====",
+# symbol pairs ('":', '",'), newline runs
+_PIECE_RE = re.compile(
+    r" ?[A-Za-z]+| ?\d{1,3}| ?([^\sA-Za-z\d])\1{3,}| ?[^\sA-Za-z\d]{1,2}|\s*\n\s*|\s+"
+)
+
+
+def _piece_tokens(piece: str) -> int:
+    word = piece.strip()
+    if word.isalpha():
+        # common short words are one token; longer (often biomedical) words split every ~4 chars
+        return 1 if len(word) <= 6 else 1 + math.ceil((len(word) - 6) / 4)
+    if not word:  # whitespace run: a lone space merges into the next token
+        return 0 if piece == " " else 1
+    if len(word) > 2 and len(set(word)) == 1:  # repeated-symbol rule, merged in ~16-char tokens
+        return math.ceil(len(word) / 16)
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate Llama-3 token count (tends to over-count slightly, which is the safe side)."""
+    if not text:
+        return 0
+    return sum(_piece_tokens(m.group(0)) for m in _PIECE_RE.finditer(text))
+
+
+def fit_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text whose estimate is ≤ max_tokens (one linear pass)."""
+    if not text or max_tokens <= 0:
+        return ""
+    used = 0
+    for m in _PIECE_RE.finditer(text):
+        used += _piece_tokens(m.group(0))
+        if used > max_tokens:
+            return text[:m.start()]
+    return text
+
+
+def shrink_to_tokens(text: str, max_tokens: int, spans) -> str:
+    """
+    Cut text to about max_tokens by trimming the (start, end) spans from their ends, in the order given
+    (study-context blocks: lowest-ranked passages go first). Text outside the spans — preamble,
+    instructions, JSON template — is always kept whole, so the result may stay above max_tokens.
+    """
+    excess = estimate_tokens(text) - max_tokens
+    if excess <= 0:
+        return text
+    kept = {}
+    for start, end in spans:
+        if excess <= 0:
+            break
+        have = estimate_tokens(text[start:end])
+        kept[(start, end)] = fit_to_tokens(text[start:end], max(0, have - excess))
+        excess -= have - estimate_tokens(kept[(start, end)])
+    parts, pos = [], 0
+    for (start, end), keep in sorted(kept.items()):
+        parts += [text[pos:start], keep]
+        pos = end
+    return "".join(parts) + text[pos:]
+
+
+class PromptCompiler:
+    """
+    Token budget for one model context window.
+    ✅ window(): tokens left for the prompt body once the wrapper and output reserve are taken
+    🔹 static(): memoized static prompt parts; callers put file mtimes in the key so edits invalidate
+    """
+
+    def __init__(self, num_ctx: int = 8192, output_tokens: int = 1536, wrapper_tokens: int = 0,
+                 safety: float = 0.97):
+        self.num_ctx = num_ctx
+        self.output_tokens = output_tokens
+        self.wrapper_tokens = wrapper_tokens
+        self.safety = safety  # headroom for estimate error
+        self._static = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def window(self) -> int:
+        return max(0, int((self.num_ctx - self.output_tokens) * self.safety) - self.wrapper_tokens)
+
+    def context_budget(self, static_tokens: int) -> int:
+        """Tokens available for dynamic context after a static part of static_tokens."""
+        return max(0, self.window() - static_tokens)
+
+    def static(self, key, build) -> dict:
+        """
+        Memoized static part. build() → dict with at least "text"; "tokens" is added here.
+        Key must be hashable and include everything the text depends on.
+        """
+        with self._lock:
+            part = self._static.get(key)
+            if part is not None:
+                self.hits += 1
+                return part
+        part = dict(build())
+        part["tokens"] = estimate_tokens(part["text"])
+        with self._lock:
+            self.misses += 1
+            self._static[key] = part
+        return part
+
+    def clear(self):
+        with self._lock:
+            self._static.clear()
+
+    def stats(self) -> dict:
+        return {"num_ctx": self.num_ctx, "output_tokens": self.output_tokens, "window": self.window(),
+                "static_entries": len(self._static), "hits": self.hits, "misses": self.misses}
+
+
+class OutputStats:
+    """
+    Running answer size (tokens) per sheet, persisted so packing improves across runs.
+    ✅ expected(): EWMA of measured sizes, else a column-count estimate
+    🔹 Atomic JSON writes; concurrent processes may drop a sample, never corrupt the file
+    """
+
+    def __init__(self, path: str = "output_stats.json", alpha: float = 0.3, default_rows: int = 2):
+        self.path = path
+        self.alpha = alpha
+        self.default_rows = default_rows
+        self._lock = threading.Lock()
+        self._stats = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._stats = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def expected(self, sheet: str, columns: list[str]) -> int:
+        with self._lock:
+            entry = self._stats.get(sheet)
+        if entry:
+            return int(math.ceil(entry["ewma"]))
+        row = sum(estimate_tokens(json.dumps(col)) + 4 for col in columns) + 4
+        return row * self.default_rows + 8
+
+    def record(self, sheet: str, tokens: int):
+        with self._lock:
+            entry = self._stats.get(sheet)
+            if entry:
+                entry["ewma"] = round(self.alpha * tokens + (1 - self.alpha) * entry["ewma"], 1)
+                entry["n"] += 1
+                entry["max"] = max(entry["max"], tokens)
+            else:
+                self._stats[sheet] = {"ewma": float(tokens), "n": 1, "max": tokens}
+            snapshot = json.dumps(self._stats, indent=2)
+        self._write(snapshot)
+
+    def _write(self, blob: str):
+        try:
+            parent = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", dir=parent, suffix=".tmp") as tmp:
+                tmp.write(blob)
+            os.replace(tmp.name, self.path)
+        except OSError as e:
+            print(f"⚠️ Failed writing output stats: {e}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+retrieval.py — Lexical passage retrieval over a study's text (BM25, offline)
+----------------------------------------------------------------------------
+- Study text → overlapping line-window chunks tagged with their section heading
+- Okapi BM25 scoring (k1 / b) with a small biomedical synonym expansion
+- select(): top-scoring chunks that fit a character budget, returned in document order
+- Query terms come from a sheet's column names (weighted) + its prompt override text
+"""
+
+import re, math
+from collections import Counter
+
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9\-]*|\d+(?:\.\d+)?")
+_HEADINGS = ("Abstract", "Introduction", "Background", "Materials and Methods", "Patients and Methods",
+             "Methods", "Method", "Study Design", "Results", "Result", "Discussion", "Conclusions",
+             "Conclusion", "References", "Acknowledgments", "Acknowledgements")
+# Two-column PDFs glue headings to body text ("Discussion ies, such as …"), so a heading only has to
+# start the line — but in Title or UPPER case, which keeps "results should be …" from matching.
+_HEADING_RE = re.compile(
+    r"^\s*(?:\d+\.?\s*)?(" + "|".join(h for name in _HEADINGS for h in (re.escape(name), re.escape(name.upper())))
+    + r")(?=$|[:\s])"
+)
+# Evidence weight by section (reference lists match many column words but never hold the data)
+_SECTION_WEIGHT = {"references": 0.2, "acknowledgments": 0.2, "acknowledgements": 0.2}
+
+# Template / instruction boilerplate that carries no evidence signal
+_STOPWORDS = set("""
+a an and are as at be by for from if in into is it its of on or the this that to with without was were
+each per all any not no only other e g eg ie vs using used use than then their there these those
+extract extracted value values pdf nr na json sheet column columns field fields missing fill filled
+output valid return schema template study studies label matching exact exactly reported report
+id name names type types text number
+yes no if available where whether specify specified keep leave when otherwise string strings none
+""".split())
+
+# Abbreviations in column names → words authors actually write
+_SYNONYMS = {
+    "hr": ["hazard", "ratio"],
+    "or": ["odds", "ratio"],
+    "rr": ["relative", "risk"],
+    "ci": ["confidence", "interval"],
+    "sd": ["standard", "deviation"],
+    "se": ["standard", "error"],
+    "iqr": ["interquartile", "range"],
+    "lvef": ["ejection", "fraction", "lvef"],
+    "gls": ["global", "longitudinal", "strain"],
+    "ctrcd": ["cardiotoxicity", "dysfunction"],
+    "hf": ["heart", "failure"],
+    "mace": ["major", "adverse", "cardiac", "events"],
+    "acei": ["ace", "inhibitor", "enalapril", "lisinopril"],
+    "arb": ["angiotensin", "receptor", "blocker", "candesartan", "losartan"],
+    "bb": ["beta", "blocker", "carvedilol", "bisoprolol", "metoprolol", "nebivolol"],
+    "itt": ["intention", "treat"],
+    "pp": ["per", "protocol"],
+    "rob": ["bias", "randomization", "allocation", "blinding"],
+    "n": ["patients", "participants", "enrolled"],
+    "tnt": ["troponin"],
+    "bnp": ["natriuretic", "peptide", "bnp"],
+    "grade": ["certainty", "evidence"],
+    "prisma": ["screened", "excluded", "included"],
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word / number tokens minus boilerplate stopwords."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower())
+            if t.isdigit() or (len(t) > 1 and t not in _STOPWORDS)]
+
+
+def query_terms(columns: list[str], override_text: str = "", sheet: str = "") -> Counter:
+    """
+    Weighted query for one sheet.
+    ✅ Column-name tokens (+ synonym expansion) weigh 2, sheet-name tokens 1
+    🔹 Override text adds each distinct token once (frequency would let boilerplate dominate)
+    """
+    weights = Counter()
+    for col in columns:
+        for raw in re.findall(r"[A-Za-z0-9]+", col):
+            tok = raw.lower()
+            for t in [tok] + _SYNONYMS.get(tok, []):
+                if len(t) > 1 and t not in _STOPWORDS:
+                    weights[t] = max(weights[t], 2)
+    for t in tokenize(sheet.replace("_", " ")):
+        weights[t] = max(weights[t], 1)
+    for t in set(tokenize(override_text)):
+        if not t.isdigit():
+            weights[t] = max(weights[t], 1)
+    return weights
+
+
+class ChunkIndex:
+    """In-memory BM25 index over overlapping chunks of one document."""
+
+    def __init__(self, chunks: list[dict], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks  # [{id, section, start, text}]
+        self.k1, self.b = k1, b
+        self._tfs = [Counter(tokenize(c["text"])) for c in chunks]
+        self._lens = [sum(tf.values()) for tf in self._tfs]
+        self._avg_len = (sum(self._lens) / len(self._lens)) if self._lens else 0.0
+        df = Counter()
+        for tf in self._tfs:
+            df.update(tf.keys())
+        n = len(chunks)
+        self._idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    # ---------------- BUILD ----------------
+    @classmethod
+    def from_text(cls, text: str, chunk_chars: int = 800, overlap_lines: int = 1, **kw) -> "ChunkIndex":
+        """Split on lines into ~chunk_chars windows; section headings start a new chunk."""
+        chunks, buf, size, section, offset = [], [], 0, "front", 0
+
+        def flush():
+            body = "\n".join(line for _, line in buf)
+            if body.strip():
+                chunks.append({"id": len(chunks), "section": section, "start": buf[0][0], "text": body.strip()})
+
+        for line in (text or "").split("\n"):
+            m = _HEADING_RE.match(line)
+            if m:
+                flush()
+                buf, size = [], 0
+                section = m.group(1).lower()
+            buf.append((offset, line))
+            offset += len(line) + 1
+            size += len(line) + 1
+            if size >= chunk_chars:
+                flush()
+                buf = buf[-overlap_lines:] if overlap_lines else []
+                size = sum(len(l) + 1 for _, l in buf)
+        flush()
+        return cls(chunks, **kw)
+
+    # ---------------- QUERY ----------------
+    def score(self, weights: Counter) -> list[float]:
+        scores = []
+        for chunk, tf, dl in zip(self.chunks, self._tfs, self._lens):
+            s = 0.0
+            norm = self.k1 * (1 - self.b + self.b * dl / (self._avg_len or 1))
+            for term, w in weights.items():
+                f = tf.get(term)
+                if f:
+                    s += w * self._idf.get(term, 0.0) * f * (self.k1 + 1) / (f + norm)
+            scores.append(s * _SECTION_WEIGHT.get(chunk["section"], 1.0))
+        return scores
+
+    def select(self, weights: Counter, budget: int, pin_first: bool = True, cost=None, skip=()) -> list[dict]:
+        """
+        Highest-scoring chunks fitting budget, in document order.
+        cost(chunk) prices a chunk in the budget's unit (default: characters incl. a short header).
+        pin_first keeps the opening chunk (title / authors / year → Study_ID) whenever it fits.
+        skip: chunk ids already shown elsewhere in the prompt.
+        """
+        if not self.chunks or budget <= 0:
+            return []
+        cost = cost or (lambda c: len(c["text"]) + 24)
+        scores = self.score(weights)
+        order = sorted((i for i in range(len(self.chunks)) if i not in skip), key=lambda i: (-scores[i], i))
+        pin_first = pin_first and 0 not in skip
+        if pin_first:
+            order.remove(0)
+            order.insert(0, 0)
+
+        picked, used = [], 0
+        for i in order:
+            if scores[i] <= 0 and not (pin_first and i == 0):
+                break
+            price = cost(self.chunks[i])
+            if used + price > budget:
+                continue
+            picked.append(i)
+            used += price
+        return [dict(self.chunks[i], score=round(scores[i], 3)) for i in sorted(picked)]
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+def render_passages(passages: list[dict]) -> str:
+    """[EVIDENCE] block: one header per passage so the model sees where it came from."""
+    if not passages:
+        return ""
+    return "[EVIDENCE]\n" + "".join(
+        f"[{p['section'].upper()} #{p['id']}" + (f" p.{p['page']}" if p.get("page") else "") + f"]\n{p['text']}\n"
+        for p in passages
+    )
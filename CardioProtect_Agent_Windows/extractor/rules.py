@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rules.py — Deterministic fast path for numeric study facts
+----------------------------------------------------------
+Regex rules run over the parsed StudyDocument before any model call:
+- registry ID, DOI, copyright year, total sample size, number of arms, median follow-up,
+  mean age ± SD, baseline LVEF, and a single reported HR (95% CI, p)
+- a rule answers only when every match in its scope agrees — two different values
+  (e.g. per-arm ages) leave the column to the model
+- each fact carries provenance: {value, rule, page, snippet}
+- prefill() → { sheet: { column: fact } } for the template columns the rules cover;
+  callers drop the fixed ones (see fixed()) from prompts / answer schemas and merge the values back with apply()
+"""
+
+import re
+
+RULES_VERSION = "1"
+EMPTY = ("NR", "", None, "NA")
+# Sheets with one row per study by construction: a rule value there is the whole answer
+_SINGLE_ROW_SHEETS = ("1_Study_ID_Design",)
+
+_NUM = r"(\d+(?:\.\d+)?)"
+_PM = r"\s*(?:±|\+/-|\+-|∓)\s*"
+_DASH = r"\s*(?:-|–|—|to|,)\s*"
+_WORDS = {"two": "2", "three": "3", "four": "4", "five": "5", "six": "6"}
+
+
+def _count(raw: str) -> str:
+    return _WORDS.get(raw.lower(), raw.replace(",", ""))
+
+
+def _months(value: str, unit: str) -> str:
+    factor = {"y": 12.0, "w": 12 / 52.0, "d": 12 / 365.0}.get(unit[0].lower())
+    if factor is None:
+        return value
+    months = round(float(value) * factor, 1)
+    return str(int(months)) if months == int(months) else str(months)
+
+
+def _p_value(op: str | None, raw: str | None) -> str:
+    if not raw:
+        return "NR"
+    op = {"≤": "<="}.get(op, op) if op and op != "=" else ""
+    return f"{op}{raw}"
+
+
+# (sheet, columns, rule name, scope, pattern, values(match) → tuple aligned with columns, per_row)
+# scope: "front" = first page (article header), "body" = text before the reference list
+# per_row: study-level facts may fill every row; otherwise only the first row (see apply())
+_RULES = [
+    ("1_Study_ID_Design", ("Registry_ID",), "registry_id", "body",
+     re.compile(r"\b(NCT\d{8}|ISRCTN\d{8}|ACTRN\d{14}|ChiCTR[-\w]{6,20}\d|UMIN\d{9}|"
+                r"CTRI/\d{4}/\d{2,3}/\d{6}|EudraCT\s*(?:No\.?\s*)?\d{4}-\d{6}-\d{2}|DRKS\d{8}|jRCT[s\d]\d{9})"),
+     lambda m: (re.sub(r"\s+", " ", m.group(1)),), True),
+    ("1_Study_ID_Design", ("PMID/DOI",), "doi", "front",
+     re.compile(r"\b(10\.\d{4,9}/[^\s\"<>,;]*[^\s\"<>,;.)\]])"),
+     lambda m: (m.group(1),), True),
+    ("1_Study_ID_Design", ("Publication_Year",), "copyright_year", "front",
+     re.compile(r"(?:©|\(c\)|Copyright)\s*(?:©\s*)?((?:19|20)\d{2})\b", re.I),
+     lambda m: (m.group(1),), True),
+    ("1_Study_ID_Design", ("Sample_Size_Total",), "sample_size", "body",
+     re.compile(r"\b(?:a\s+total\s+of\s+)?(\d{1,3}(?:,\d{3})+|\d{2,5})\s+(?:consecutive\s+|eligible\s+|adult\s+)?"
+                r"(?:patients|participants|subjects|women|men|children|survivors)\s+(?:were|was)\s+"
+                r"(?:randomi[sz]ed|enrolled|included|recruited)", re.I),
+     lambda m: (_count(m.group(1)),), True),
+    ("1_Study_ID_Design", ("Arms (N)",), "arm_count", "body",
+     re.compile(r"\brandomi[sz]ed\s+(?:\S+\s+){0,6}?(?:in)?to\s+(?:one\s+of\s+)?(two|three|four|five|six|[2-6])\s+"
+                r"(?:treatment\s+|study\s+|parallel\s+)?(?:arms|groups)\b", re.I),
+     lambda m: (_count(m.group(1)),), True),
+    ("1_Study_ID_Design", ("Followup_Median (months)",), "median_followup", "body",
+     re.compile(r"\bmedian\s+(?:duration\s+of\s+)?follow[- ]?up(?:\s+(?:period|duration|time))?"
+                r"(?:\s+(?:was|of))?\s*[:=,]?\s*" + _NUM + r"\s*(months?|mo\b|years?|yrs?|weeks?|days?)", re.I),
+     lambda m: (_months(m.group(1), m.group(2)),), True),
+    ("2_Eligibility_Baseline", ("Mean_Age (years)", "Age_SD"), "mean_age_sd", "body",
+     re.compile(r"\bmean\s+(?:\(\s*SD\s*\)\s+)?age(?:\s+(?:at\s+\w+\s+)?(?:was|of))?\s*[:=,]?\s*" + _NUM + _PM + _NUM, re.I),
+     lambda m: (m.group(1), m.group(2)), True),
+    ("2_Eligibility_Baseline", ("Baseline_LVEF (%)",), "baseline_lvef", "body",
+     re.compile(r"\bbaseline\s+(?:LVEF|left\s+ventricular\s+ejection\s+fraction(?:\s+\(LVEF\))?)"
+                r"(?:\s+(?:was|of))?\s*[:=,]?\s*" + _NUM + r"\s*%?", re.I),
+     lambda m: (m.group(1),), True),
+    ("10_TimeToEvent", ("Effect_Size (HR)", "Lower_CI", "Upper_CI", "P_value"), "hazard_ratio", "body",
+     re.compile(r"\b(?:hazard\s+ratio|HR)\b\s*(?:\(HR\)\s*)?(?:was|of)?\s*[:=,]?\s*" + _NUM
+                + r"\s*[;,(\[]?\s*95\s*%\s*(?:CI|confidence\s+interval)\s*[:=,]?\s*" + _NUM + _DASH + _NUM
+                + r"\s*[)\]]?(?:\s*[;,]?\s*[Pp]\s*([=<>≤])\s*(0?\.\d+))?"),
+     lambda m: (m.group(1), m.group(2), m.group(3), _p_value(m.group(4), m.group(5))), False),
+]
+
+
+def _scopes(doc) -> dict:
+    front_end = doc.pages[0]["end"] if doc.pages else len(doc.text)
+    return {"front": (0, front_end), "body": (0, doc.body_end())}
+
+
+def _snippet(text: str, start: int, end: int, pad: int = 60) -> str:
+    return re.sub(r"\s+", " ", text[max(0, start - pad):end + pad]).strip()
+
+
+def extract_facts(doc) -> dict:
+    """
+    Run every rule over the document → { sheet: { column: fact } }.
+    ✅ Values are plain strings in template form (counts without separators, follow-up in months)
+    🔹 A rule whose matches disagree is dropped as a whole (no partial HR / age pairs)
+    """
+    text, scopes, facts = doc.text, _scopes(doc), {}
+    for sheet, columns, name, scope, pattern, values, per_row in _RULES:
+        start, end = scopes[scope]
+        hits = [(m, values(m)) for m in pattern.finditer(text, start, end)]
+        distinct = {v for _, v in hits}
+        if len(distinct) != 1:
+            continue
+        m, vals = hits[0]
+        for col, val in zip(columns, vals):
+            if val in ("", "NR"):
+                continue
+            facts.setdefault(sheet, {})[col] = {
+                "value": val, "rule": name, "page": doc.page_of(m.start()),
+                "snippet": _snippet(text, m.start(), m.end()), "matches": len(hits), "per_row": per_row,
+            }
+    return facts
+
+
+def prefill(doc, schema: dict) -> dict:
+    """Facts for the template's own columns only (memoized on the document)."""
+    facts = doc.memo(("rules", RULES_VERSION), lambda: extract_facts(doc))
+    return {s: {c: f for c, f in cols.items() if c in schema.get(s, ())}
+            for s, cols in facts.items() if s in schema and any(c in schema[s] for c in cols)}
+
+
+def fixed(sheet: str, fact: dict) -> bool:
+    """Does the fact settle its column for every row? (one value per arm, study identifier, one-row sheet)"""
+    return "rows" in fact or fact.get("fixed", False) or sheet in _SINGLE_ROW_SHEETS
+
+
+def ask_schema(schema: dict, facts: dict) -> dict:
+    """{ sheet: columns still to ask the model } in template order (only fixed facts leave the prompt)."""
+    return {s: [c for c in cols if not (c in facts.get(s, {}) and fixed(s, facts[s][c]))]
+            for s, cols in schema.items()}
+
+
+def apply(data: dict, batch: list[str], facts: dict) -> dict:
+    """
+    Merge locally answered facts into a batch answer { sheet: rows }.
+    ✅ Fixed facts (see fixed()) are written as they are; facts with "rows" (one value per arm) fill row i
+       with rows[i], adding rows up to that count
+    ✅ Other facts only fill cells the model left NR: study-level ones (age, LVEF) any row, per-outcome ones
+       (HR / CI / p) the first row — every other outcome row keeps the model's own values
+    🔹 A sheet the model was not asked about (all columns answered locally) gets a single row
+    """
+    out = dict(data) if isinstance(data, dict) else {}
+    for s in batch:
+        ruled = facts.get(s)
+        if not ruled:
+            continue
+        rows = out.get(s)
+        rows = [dict(r) for r in rows if isinstance(r, dict)] if isinstance(rows, list) else []
+        want = max([len(f["rows"]) for f in ruled.values() if "rows" in f] + [len(rows), 1])
+        rows += [{} for _ in range(want - len(rows))]
+        for i, row in enumerate(rows):
+            for col, fact in ruled.items():
+                if "rows" in fact:
+                    if i < len(fact["rows"]):
+                        row[col] = fact["rows"][i]
+                elif (fact["per_row"] or i == 0) and (fixed(s, fact) or row.get(col) in EMPTY):
+                    row[col] = fact["value"]
+        out[s] = rows
+    return out
+
+
+def provenance(facts: dict) -> dict:
+    """Sidecar view: { sheet: { column: {value, rule, page, snippet} } }."""
+    return {s: {c: {k: f[k] for k in ("value", "rule", "page", "snippet", "matches")} for c, f in cols.items()}
+            for s, cols in facts.items()}
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+study_design.py — Cheap study-design gate for the per-PDF sheet plan
+---------------------------------------------------------------------
+- classify(): design (RCT / Observational / Case report / Review / Unclear) and the data types the
+  study reports (survival analysis, subgroup analysis), from keyword signals in the parsed text
+- same term lists and precedence as the scraper's detect_study_design (RCT before observational),
+  but read from the title / abstract + Methods only (a structured abstract's Background left out), so
+  earlier trials cited in the background, the introduction or the reference list cannot flip the label
+- survival data needs survival wording or an HR reported with its CI (a bare "HR" is often heart rate)
+- inapplicable_sheets(): { sheet: reason } for template sheets that cannot apply to this study;
+  callers NR-fill them without a model call. Unclear designs keep every sheet.
+"""
+
+import re
+
+STUDY_DESIGN_VERSION = "2"
+
+_REVIEW_TERMS = (
+    "systematic review", "meta-analysis", "meta analysis", "network meta-analysis", "network meta analysis",
+    "scoping review", "narrative review", "literature review", "overview of reviews", "umbrella review",
+    "cochrane review",
+)
+_CASE_TERMS = ("case report", "case presentation", "we report a case", "we present a case", "we describe a case")
+_RCT_TERMS = (
+    "randomized", "randomised", "placebo", "double blind", "double-blind", "single blind", "single-blind",
+    "randomly assigned", "intervention arm", "controlled trial", "parallel-group",
+)
+_OBS_TERMS = (
+    "cohort", "prospective", "retrospective", "registry", "case-control", "case control", "observational",
+    "follow-up study", "follow up study", "real-world", "real world", "population-based", "population based",
+)
+# Title / abstract end where the article body starts (an Introduction / Background heading on its own line)
+_BODY_START_RE = re.compile(r"^[ \t]*(?:\d+\.?[ \t]*)?(?:introduction|background)[ \t]*$", re.I | re.M)
+# A structured abstract's Background part describes earlier studies, not this one
+_ABSTRACT_BACKGROUND_RE = re.compile(
+    r"\b(?:background|introduction|context)\s*[:.]\s.*?(?=\b(?:objectives?|aims?|purpose|methods?|design|results?)"
+    r"\s*[:.]|\Z)", re.I | re.S)
+_SURVIVAL_RE = re.compile(
+    r"hazard ratio|(?-i:\bHRs?\b)\s*[,=:]?\s*(?:\d+(?:\.\d+)?\s*)?[;,(\[]?\s*(?:95\s*%\s*)?CI\b|kaplan|\bcox\b|log-?rank|time[- ]to[- ]event|survival (?:analysis|curve)|"
+    r"(?:progression|event|disease)[- ]free survival|overall survival|cumulative incidence", re.I)
+_SUBGROUP_RE = re.compile(r"subgroup|sub-group|interaction|effect modif|stratified (?:by|analysis)", re.I)
+
+# (sheet, applies(info) → bool, reason when it does not)
+_SHEET_GATES = (
+    ("13_RiskOfBias_RoB2_RCTs", lambda d: d["design"] not in ("Observational", "Case report"), "RoB 2 is for RCTs"),
+    ("14_RiskOfBias_ROBINSI_NRS", lambda d: d["design"] != "RCT", "ROBINS-I is for non-randomized studies"),
+    ("10_TimeToEvent", lambda d: d["survival"], "no time-to-event / survival analysis"),
+    ("12_Subgroups_EffectModifiers", lambda d: d["subgroups"], "no subgroup / interaction analysis"),
+)
+
+
+def classify(doc) -> dict:
+    """
+    {design, survival, subgroups, signals} for one StudyDocument (memoized on it).
+    ✅ Design terms: title / abstract (first page, up to the Introduction) + Methods section
+    ✅ Data-type terms: whole text before the reference list
+    """
+    def build():
+        front = abstract(doc).lower()
+        low = front + "\n" + doc.sections.get("methods", "").lower()
+        signals = {
+            "review": [t for t in _REVIEW_TERMS if t in front],
+            "case": [t for t in _CASE_TERMS if t in front],
+            "rct": [t for t in _RCT_TERMS if t in low],
+            "obs": [t for t in _OBS_TERMS if t in low],
+        }
+        if signals["review"]:
+            design = "Review"
+        elif signals["case"]:
+            design = "Case report"
+        elif signals["rct"]:
+            design = "RCT"
+        elif signals["obs"]:
+            design = "Observational"
+        else:
+            design = "Unclear"
+        body = doc.text[:doc.body_end()]
+        return {"design": design, "survival": bool(_SURVIVAL_RE.search(body)),
+                "subgroups": bool(_SUBGROUP_RE.search(body)), "signals": signals}
+
+    return doc.memo(("study_design", STUDY_DESIGN_VERSION), build)
+
+
+def abstract(doc) -> str:
+    """Title + abstract: the first page up to the Introduction heading, minus a structured Background part."""
+    front = doc.text[:doc.pages[0]["end"]] if doc.pages else doc.text[:4000]
+    m = _BODY_START_RE.search(front)
+    return _ABSTRACT_BACKGROUND_RE.sub(" ", front[:m.start()] if m else front)
+
+
+def inapplicable_sheets(info: dict, sheet_names) -> dict:
+    """{ sheet: reason } for the template sheets the gate rules out (only sheets the template has)."""
+    names = set(sheet_names)
+    return {sheet: reason for sheet, applies, reason in _SHEET_GATES if sheet in names and not applies(info)}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+study_facts.py — Stage 1: one small "study facts" record shared by every sheet
+------------------------------------------------------------------------------
+- facts_schema() / instructions(): the stage-1 call (Study_ID, design, arms with N, timepoints)
+- normalize(): any parsed answer → {Study_ID, Study_Design, Arms: [{Arm_Name, N}], Timepoints}
+- render(): the [STUDY FACTS] block injected into every later sheet prompt (stable text, so
+  it never breaks the shared prompt prefix)
+- column_facts(): the template columns the record answers locally, in the same
+  { sheet: { column: fact } } form as extractor/rules.py (Study_ID everywhere, design + arm count
+  on sheet 1, Arm_Name / N_in_Arm row by row on the one-row-per-arm sheets)
+"""
+
+NR = "NR"
+STUDY_FACTS_VERSION = "1"
+
+_STUDY_ID_COLUMNS = ("Study_ID", "Study_ID (FirstAuthor_Year)")
+_DESIGN_COLUMN = ("1_Study_ID_Design",
+                  "Study_Design (RCT/Cluster-RCT/Crossover/Prospective Cohort/Retrospective Cohort/Case-Control)")
+_ARM_COUNT_COLUMN = ("1_Study_ID_Design", "Arms (N)")
+# Sheets with exactly one row per arm: { sheet: (arm name column, arm N column or None) }
+_ARM_SHEETS = {
+    "3_Intervention_Cardioprotectors": ("Arm_Name", "N_in_Arm"),
+    "4_Cancer_Therapy_Exposure": ("Arm_Name", None),
+}
+DESIGNS = ("RCT", "Cluster-RCT", "Crossover", "Prospective Cohort", "Retrospective Cohort", "Case-Control",
+           "Case Report", "Systematic Review", "Other")
+
+
+def facts_schema() -> dict:
+    """JSON Schema for the stage-1 answer (sent as the payload's "format")."""
+    arm = {"type": "object", "properties": {"Arm_Name": {"type": "string"}, "N": {"type": "string"}},
+           "required": ["Arm_Name", "N"], "additionalProperties": False}
+    return {
+        "type": "object",
+        "properties": {
+            "Study_ID": {"type": "string"},
+            "Study_Design": {"type": "string", "enum": list(DESIGNS)},
+            "Arms": {"type": "array", "items": arm},
+            "Timepoints": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["Study_ID", "Study_Design", "Arms", "Timepoints"],
+        "additionalProperties": False,
+    }
+
+
+def instructions() -> str:
+    return (
+        "[TASK: STUDY FACTS]\n"
+        "Extract only these study-level facts from the study context above; they are reused by every sheet.\n"
+        "- Study_ID: first author's surname + '_' + publication year (e.g. Smith_2020)\n"
+        f"- Study_Design: one of {', '.join(DESIGNS)}\n"
+        "- Arms: every study arm / group in the order the paper reports them, with its number of patients "
+        "(N, digits only; 'NR' if not reported). A single-group study has one arm.\n"
+        "- Timepoints: the assessment timepoints reported (e.g. baseline, end of chemotherapy, 6 months, 12 months)\n"
+        "Return only valid JSON, no markdown or commentary:\n"
+        '{ "Study_ID": "...", "Study_Design": "...", "Arms": [ { "Arm_Name": "...", "N": "..." } ], '
+        '"Timepoints": [ "..." ] }\n'
+    )
+
+
+def _text(value) -> str:
+    if value is None:
+        return NR
+    text = str(value).strip()
+    return text if text and text.lower() not in ("none", "null", "nan", "n/a") else NR
+
+
+def normalize(data) -> dict:
+    """Parsed answer → facts record ({} when it has no usable Study_ID or arms)."""
+    if not isinstance(data, dict):
+        return {}
+    arms = []
+    for arm in data.get("Arms") or []:
+        if isinstance(arm, dict) and _text(arm.get("Arm_Name")) != NR:
+            n = "".join(ch for ch in _text(arm.get("N")) if ch.isdigit())
+            arms.append({"Arm_Name": _text(arm.get("Arm_Name")), "N": n or NR})
+        elif isinstance(arm, str) and _text(arm) != NR:
+            arms.append({"Arm_Name": _text(arm), "N": NR})
+    timepoints = [_text(t) for t in data.get("Timepoints") or [] if _text(t) != NR]
+    facts = {"Study_ID": _text(data.get("Study_ID")), "Study_Design": _text(data.get("Study_Design")),
+             "Arms": arms, "Timepoints": timepoints}
+    return facts if facts["Study_ID"] != NR or arms else {}
+
+
+def render(facts: dict) -> str:
+    """[STUDY FACTS] block for sheet prompts ("" when there are no facts)."""
+    if not facts:
+        return ""
+    lines = ["[STUDY FACTS] (established once for this study — reuse them exactly, do not re-derive)",
+             f"Study_ID: {facts['Study_ID']}", f"Study_Design: {facts['Study_Design']}"]
+    if facts["Arms"]:
+        lines.append("Arms (use these Arm_Name values exactly; " + ", ".join(_ARM_SHEETS)
+                     + " get one row per arm, in this order):")
+        lines += [f"  {i}. {arm['Arm_Name']} (N={arm['N']})" for i, arm in enumerate(facts["Arms"], start=1)]
+    if facts["Timepoints"]:
+        lines.append("Timepoints: " + "; ".join(facts["Timepoints"]))
+    return "\n".join(lines) + "\n\n"
+
+
+def _fact(value: str, per_row: bool = True, rows: list | None = None, fixed: bool = False) -> dict:
+    fact = {"value": value, "rule": "study_facts", "page": None, "snippet": "", "matches": 1, "per_row": per_row,
+            "fixed": fixed}
+    if rows is not None:
+        fact["rows"] = rows
+    return fact
+
+
+def column_facts(facts: dict, schema: dict) -> dict:
+    """{ sheet: { column: fact } } answered by the record (NR facts answer nothing)."""
+    out = {}
+    if not facts:
+        return out
+    for sheet, columns in schema.items():
+        for col in columns:
+            if col in _STUDY_ID_COLUMNS and facts["Study_ID"] != NR:
+                out.setdefault(sheet, {})[col] = _fact(facts["Study_ID"], fixed=True)
+    sheet, col = _DESIGN_COLUMN
+    if col in schema.get(sheet, ()) and facts["Study_Design"] in DESIGNS[:6]:
+        out.setdefault(sheet, {})[col] = _fact(facts["Study_Design"])
+    arms = facts["Arms"]
+    sheet, col = _ARM_COUNT_COLUMN
+    if arms and col in schema.get(sheet, ()):
+        out.setdefault(sheet, {})[col] = _fact(str(len(arms)))
+    for sheet, (name_col, n_col) in _ARM_SHEETS.items():
+        if not arms or name_col not in schema.get(sheet, ()):
+            continue
+        out.setdefault(sheet, {})[name_col] = _fact(arms[0]["Arm_Name"], rows=[a["Arm_Name"] for a in arms])
+        if n_col and n_col in schema[sheet] and any(a["N"] != NR for a in arms):
+            out[sheet][n_col] = _fact(arms[0]["N"], rows=[a["N"] for a in arms])
+    return out
+
+
+def merge(local: dict, rule_facts: dict) -> dict:
+    """Study facts + rule facts per sheet (deterministic rule values win on overlap)."""
+    out = {s: dict(cols) for s, cols in local.items()}
+    for s, cols in rule_facts.items():
+        out.setdefault(s, {}).update(cols)
+    return out
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+tables.py — Structured study tables routed to the outcome / biomarker sheets
+---------------------------------------------------------------------------
+- grid(): raw pdfplumber rows → {header, rows} (cells cleaned, empty columns dropped, up to three
+  leading header rows detected and stacked into one label per column)
+- classify(): which sheets a table feeds, from its cell shapes, row / column labels and caption:
+    9_Outcome_Continuous    mean ± SD / median [IQR] cells, under a timepoint / outcome column label or caption
+    8_Outcome_Binary        n (%) or n/N cells, same condition
+    6_Biomarkers_Monitoring troponin / (NT-pro)BNP / CRP / ST2 / galectin / QTc ... rows or columns
+  Baseline / demographic tables (label column or caption, or several age / sex / BMI ... rows) feed none
+- structured(): every routed table of a StudyDocument, with its "Table N" caption (memoized);
+  render() → compact CSV block for prompts
+- map_rows(): deterministic rows for the common "outcome rows × arm / timepoint columns" layout;
+  merge() adds the ones a model answer did not report
+"""
+
+import csv
+import io
+import re
+
+TABLES_VERSION = "2"
+SHEETS = ("9_Outcome_Continuous", "8_Outcome_Binary", "6_Biomarkers_Monitoring")
+EMPTY = ("NR", "", None, "NA")
+
+_CONTINUOUS_CELL = re.compile(
+    r"-?\d+(?:\.\d+)?\s*(?:±|\+/-|\+-)\s*\d+(?:\.\d+)?"
+    r"|^-?\d+(?:\.\d+)?\s*[\[(]\s*-?\d+(?:\.\d+)?\s*[;,–—-]\s*-?\d+(?:\.\d+)?\s*[\])]")
+_MEAN_SD = re.compile(r"(-?\d+(?:\.\d+)?)\s*(?:±|\+/-|\+-)\s*(\d+(?:\.\d+)?)")
+_COUNT_PCT = re.compile(r"^(\d+)\s*\(\s*\d+(?:\.\d+)?\s*(%?)\s*\)")
+_COUNT_OF = re.compile(r"^(\d+)\s*/\s*(\d+)\b")
+_GROUP_N = re.compile(r"\(?\b[nN]\s*=\s*(\d+)\)?")
+_PERCENT_HINT = re.compile(r"%|\bn\s*\(|\bevents?\b|\bincidence\b", re.I)
+_BIOMARKER = re.compile(
+    r"troponin|\bhs-?cTn|\bcTn[IT]?\b|\bTn[IT]\b|\bBNP\b|NT-?pro-?BNP|\bCRP\b|\bST2\b|galectin|\bGal-3\b|"
+    r"\bQTc\b|\bECG\b|holter|blood pressure", re.I)
+_TIMEPOINT = re.compile(
+    r"\bbaseline\b|\bpre\b|\bpre-|\bpost\b|\bpost-|\bmonths?\b|\bweeks?\b|\bdays?\b|\byears?\b|\bcycles?\b|\bcourses?\b|"
+    r"\bfollow-?up\b|\bend of\b|\b\d+\s*(?:m|mo|w|wk|y)\b|\bT\d\b|\bvisit\b|\b(?:time|control|check|cut-?off)\s*-?points?\b",
+    re.I)
+_OUTCOME_LABEL = re.compile(
+    r"outcome|end-?points?\b|\bevents?\b|\bchange|Δ|\bdelta\b|difference|efficacy|safety|toxicit|adverse|"
+    r"\bresults?\b|incidence|decline|reduction|response", re.I)
+_BASELINE_LABEL = re.compile(
+    r"characteristic|demographic|\bbaseline (?:data|values|features|variables|parameters)\b|patients?'? profile", re.I)
+_DEMOGRAPHIC_ROW = re.compile(
+    r"^(?:age|sex|gender|male|female|men|women|race|ethnicity|white|black|asian|bmi|body mass|weight|height|bsa|"
+    r"body surface|smok|hypertension|diabetes|dyslipid|ecog|performance status|nyha|comorbidit|history of)\b", re.I)
+_CAPTION = re.compile(r"^\s*table\s+\d+\b.*$", re.I | re.M)
+_UNIT_LABEL = re.compile(r"\bn\s*\(\s*%\s*\)|\(\s*%\s*\)|\bn\s*/\s*N\b|\bmean\s*(?:±|\(|,)\s*SD\)?|\bmedian\s*[\[(]IQR[\])]", re.I)
+_P_COLUMN = re.compile(r"^p(?:[\s-]*value)?$|^p\s*[<=]", re.I)
+_ID_COLUMNS = {"outcome": r"^Outcome_Name\b", "timepoint": r"^Timepoint\b", "arm": r"^Arm_Name\b"}
+
+
+def _clean(cell) -> str:
+    return re.sub(r"\s+", " ", str(cell)).strip() if cell is not None else ""
+
+
+def _is_number(cell: str) -> bool:
+    return bool(re.search(r"\d", cell)) and len(re.sub(r"[^A-Za-z]", "", cell)) <= 2
+
+
+def grid(rows: list) -> dict:
+    """{header: [column labels], rows: [[cells]]} for one raw table."""
+    cells = [[_clean(c) for c in row] for row in rows or [] if isinstance(row, (list, tuple))]
+    width = max((len(r) for r in cells), default=0)
+    cells = [r + [""] * (width - len(r)) for r in cells]
+    keep = [j for j in range(width) if any(r[j] for r in cells)]
+    cells = [[r[j] for j in keep] for r in cells if any(r[j] for j in keep)]
+    n = 0
+    while n < min(3, len(cells) - 1) and not any(_is_number(c) for c in cells[n][1:]):
+        n += 1
+    header = []
+    for j in range(len(keep)):
+        parts = []
+        for hi, row in enumerate(cells[:n]):
+            value = row[j]
+            if not value and hi < n - 1 and j > 0:  # spanned group label over several columns
+                value = next((row[k] for k in range(j - 1, 0, -1) if row[k]), "")
+            if value and value not in parts:
+                parts.append(value)
+        header.append(" ".join(parts))
+    return {"header": header, "rows": cells[n:]}
+
+
+def _labels(table: dict) -> str:
+    return " ".join(table["header"] + [r[0] for r in table["rows"] if r])
+
+
+def baseline(table: dict, caption: str = "") -> bool:
+    """Baseline / demographic table: label column header or caption says so, or two or more age / sex / BMI ... rows."""
+    if _BASELINE_LABEL.search(f"{table['header'][0] if table['header'] else ''} {caption}"):
+        return True
+    return sum(bool(r and _DEMOGRAPHIC_ROW.match(r[0])) for r in table["rows"]) >= 2
+
+
+def classify(table: dict, caption: str = "") -> list[str]:
+    """
+    Sheets (in SHEETS order) a grid feeds; [] for frames, text boxes and single-column layouts.
+    🔹 Baseline tables feed none; 8 / 9 also need a timepoint or outcome label in the columns or caption
+    """
+    rows = table["rows"]
+    if len(table["header"]) < 2 or len(rows) < 2 or baseline(table, caption):
+        return []
+    data = [c for r in rows for c in r[1:] if c]
+    numeric = sum(_is_number(c) for c in data)
+    if numeric < 2:
+        return []
+    labels = _labels(table)
+    continuous = sum(bool(_CONTINUOUS_CELL.search(c)) for c in data)
+    counts = [m for m in (_COUNT_PCT.match(c) for c in data) if m]
+    binary = sum(bool(_COUNT_OF.match(c)) for c in data) + (
+        len(counts) if any(m.group(2) for m in counts) or _PERCENT_HINT.search(" ".join(table["header"])) else 0)
+    outcome = any(_TIMEPOINT.search(c) or _OUTCOME_LABEL.search(c) for c in table["header"] + [caption])
+    sheets = []
+    if continuous >= 2 and outcome:
+        sheets.append("9_Outcome_Continuous")
+    if binary >= 2 and outcome:
+        sheets.append("8_Outcome_Binary")
+    if _BIOMARKER.search(labels):
+        sheets.append("6_Biomarkers_Monitoring")
+    return sheets
+
+
+def captions(doc) -> list[str]:
+    """Caption for each of doc.tables: the page's "Table N ..." lines in order, when there is one per table."""
+    per_page = {}
+    for table in doc.tables:
+        per_page[table["page"]] = per_page.get(table["page"], 0) + 1
+    lines = {p: _CAPTION.findall(doc.pages_text([p])) for p in per_page}
+    seen, out = {}, []
+    for table in doc.tables:
+        p = table["page"]
+        i = seen[p] = seen.get(p, -1) + 1
+        out.append(lines[p][i].strip() if len(lines[p]) == per_page[p] else "")
+    return out
+
+
+def structured(doc) -> list[dict]:
+    """[{id, page, caption, header, rows, sheets}] for the document's routed tables (memoized on it)."""
+    def build():
+        out = []
+        for table, caption in zip(doc.tables, captions(doc)):
+            g = grid(table["rows"])
+            sheets = classify(g, caption)
+            if sheets:
+                out.append({"id": f"T{len(out) + 1}", "page": table["page"], "caption": caption, **g, "sheets": sheets})
+        return out
+
+    return doc.memo(("tables", TABLES_VERSION), build)
+
+
+def to_csv(table: dict) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if any(table["header"]):
+        writer.writerow(table["header"])
+    writer.writerows(table["rows"])
+    return buf.getvalue()
+
+
+def render(tables: list[dict], budget: int, cost) -> str:
+    """[TABLES] block with whole tables, in document order, while cost(text) stays ≤ budget ("" when none fit)."""
+    head = ("[TABLES] (parsed from the PDF as CSV, header row first — report every row / group "
+            "they hold for the sheets below)\n")
+    text = head
+    for table in tables:
+        caption = f" {table['caption']}" if table.get("caption") else ""
+        block = f"{table['id']} (page {table['page']}){caption}:\n{to_csv(table)}"
+        if cost(text + block) > budget:
+            continue
+        text += block
+    return text + "\n" if text != head else ""
+
+
+def _column(columns: list[str], pattern: str) -> str | None:
+    return next((c for c in columns if re.match(pattern, c)), None)
+
+
+def map_rows(table: dict, sheet: str, columns: list[str]) -> list[dict]:
+    """
+    Template rows for "outcome rows × group columns" tables (sheets 8 and 9 only, as routed; [] otherwise,
+    and always [] for baseline tables).
+    ✅ Row label → Outcome_Name; column label → Timepoint when it reads like one, else Arm_Name
+    ✅ 9: mean ± SD cells → Mean / SD (N from an "n = …" column label); 8: n (%) or n/N cells → Events / Total
+    🔹 p-value columns and cells of any other shape are skipped
+    """
+    if sheet not in ("8_Outcome_Binary", "9_Outcome_Continuous") or sheet not in table.get("sheets", ()):
+        return []
+    if baseline(table, table.get("caption", "")):
+        return []
+    col = {k: _column(columns, p) for k, p in _ID_COLUMNS.items()}
+    values = {k: _column(columns, rf"^{k}\b") for k in ("Mean", "SD", "N", "Events", "Total")}
+    if not col["outcome"]:
+        return []
+    out = []
+    for row in table["rows"]:
+        if not row or not row[0]:
+            continue
+        for j, cell in enumerate(row[1:], start=1):
+            label = table["header"][j] if j < len(table["header"]) else ""
+            if not cell or _P_COLUMN.match(label):
+                continue
+            group_n = _GROUP_N.search(label)
+            group = _UNIT_LABEL.sub("", _GROUP_N.sub("", label)).strip(" ,;()")
+            rec = {c: "NR" for c in columns}
+            if sheet == "9_Outcome_Continuous":
+                m = _MEAN_SD.search(cell)
+                if not m:
+                    continue
+                rec[values["Mean"] or "Mean"], rec[values["SD"] or "SD"] = m.group(1), m.group(2)
+                if group_n and values["N"]:
+                    rec[values["N"]] = group_n.group(1)
+            else:
+                m, of = _COUNT_PCT.match(cell), _COUNT_OF.match(cell)
+                if not (m or of):
+                    continue
+                rec[values["Events"] or "Events"] = (m or of).group(1)
+                total = of.group(2) if of else group_n.group(1) if group_n else None
+                if total and values["Total"]:
+                    rec[values["Total"]] = total
+            rec[col["outcome"]] = row[0]
+            key = "timepoint" if _TIMEPOINT.search(group) else "arm"
+            if group and col[key]:
+                rec[col[key]] = group
+            out.append({c: rec[c] for c in columns})
+    return out
+
+
+def _norm(value) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(value).lower())
+
+
+def _same(a: dict, b: dict, keys: list[str]) -> bool:
+    """Rows describe the same outcome / group (labels equal or one contains the other; blanks match)."""
+    for k in keys:
+        va, vb = _norm(a.get(k)) if a.get(k) not in EMPTY else "", _norm(b.get(k)) if b.get(k) not in EMPTY else ""
+        if va and vb and va not in vb and vb not in va:
+            return False
+    return True
+
+
+def merge(data: dict, batch: list[str], table_rows: dict, schema: dict) -> dict:
+    """
+    Add table-mapped rows to a batch answer { sheet: rows }.
+    ✅ Model rows come first and win; a table row is added only when no model row matches its outcome / group
+    ✅ A sheet the model left empty (or all NR) takes the table rows as they are
+    """
+    out = dict(data) if isinstance(data, dict) else {}
+    for s in batch:
+        extra = table_rows.get(s)
+        if not extra:
+            continue
+        rows = out.get(s)
+        rows = [r for r in rows if isinstance(r, dict)] if isinstance(rows, list) else []
+        real = [r for r in rows if any(v not in EMPTY for v in r.values())]
+        keys = [c for c in schema[s] if any(re.match(p, c) for p in _ID_COLUMNS.values())]
+        added = [r for r in extra if not any(_same(r, m, keys) for m in real)]
+        out[s] = (real + added) if real else list(extra)
+    return out
@@ -5,9 +5,19 @@ mapper.py — Llama3-based PDF → Excel Field Extractor
 ----------------------------------------------------
 ✨ Full-Featured Version (Safe + Resume + JSON Repair)
 - Reads text, tables, and image pages from study + criteria PDFs
+- Caches parsed pages by content hash (parse_cache/) so re-reads skip parsing
+- Caches model answers in SQLite keyed by the final payload (llm_cache.sqlite)
 - Uses local Ollama Llama3 to infer structured JSON data
-- Processes template in 3 batches (1–6, 7–12, 13–18)
-- Automatically retries malformed JSON (via repair pass)
+- Packs template sheets into as few calls as fit the token window (split on parse failure)
+- Runs up to SHEET_CONCURRENCY sheet batches in parallel (cache saved per batch)
+- Parses each PDF once into a StudyDocument (pages, headings, section spans, tables), cached on disk
+- Strips running headers / footers, the reference list and line-break hyphens before any prompt is built
+- Fills each sheet prompt with BM25-ranked study passages for that sheet's columns
+- Sizes prompts in tokens to fill OLLAMA_NUM_CTX (static per-sheet parts memoized)
+- Puts one shared study-context prefix first so Ollama reuses it across a PDF's calls (PROMPT_LAYOUT)
+- Async twins (extract_fields_async, resume_incomplete_fields_async, …) for the FastAPI event loop
+- Constrains answers with a per-call JSON Schema (Ollama "format"); near-misses are conformed locally
+- Recovers truncated / noisy JSON with a one-pass local parser (no repair round trip to the model)
 - Auto-retries failed batches (max 2 times)
 - Supports resume mode (only reprocesses failed/missing batches)
 - Returns dict: { sheet_name: [ {col: value}, ... ] }
@@ -17,10 +27,21 @@ mapper.py — Llama3-based PDF → Excel Field Extractor
 import warnings
 warnings.filterwarnings("ignore")
 
-import os, re, json, pdfplumber, pandas as pd, requests, json5, fitz
-from PIL import Image
+import os, re, json, threading, asyncio, weakref, tempfile, multiprocessing, contextvars, functools, inspect
+import pandas as pd, requests
 import pytesseract
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from extractor.parse_cache import ParseCache
+from extractor.llm_cache import ResponseCache, payload_key
+from extractor.json_stream import JsonStreamScanner, COMPLETE, BROKEN
+from extractor.ollama_client import OllamaClient, AsyncOllamaClient, OllamaUnavailableError
+from extractor.retrieval import ChunkIndex, query_terms, render_passages
+from extractor.document import StudyDocument, DOCUMENT_MODEL_VERSION, split_sections
+from extractor.prompt_compiler import PromptCompiler, OutputStats, estimate_tokens, fit_to_tokens, shrink_to_tokens
+from extractor.output_schema import sheet_schema, validate, conform
+from extractor.json_repair import JsonRepairError, loads as loads_tolerant, truncated
+from extractor import rules, study_design, study_facts, map_reduce, page_engine, ocr, tables, cleaner
 
 # ---------------- CONFIG ----------------
 MODEL_NAME = "llama3:8b"
@@ -30,23 +51,108 @@ RAW_LOG_PATH = "llama_raw_log.txt"
 PARTIAL_CACHE_DIR = "partial_caches"
 os.makedirs(PARTIAL_CACHE_DIR, exist_ok=True)
   # ⏸️ resume cache
+# Resume preview written when the caller passes no preview_path (outside the source tree; env: RESUME_PREVIEW_PATH)
+RESUME_PREVIEW_PATH = os.getenv("RESUME_PREVIEW_PATH",
+                                os.path.join(tempfile.gettempdir(), "cardioprotect", "resume_preview.xlsx"))
 MAX_RETRIES_PER_BATCH = 2
 MAX_RESUME_PASSES = 1  # extra resume attempts in multi-PDF to reach threshold
-PROMPT_BUDGET_CHARS = 12000  # cap per-sheet prompt size to avoid truncation
+# Token budget: prompt + reserved answer tokens fill exactly num_ctx (env: OLLAMA_NUM_CTX, PROMPT_OUTPUT_TOKENS)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192") or 8192)
+PROMPT_OUTPUT_TOKENS = int(os.getenv("PROMPT_OUTPUT_TOKENS", "1536") or 1536)
+# Sheet packing: up to BATCH_MAX_SHEETS sheets per call while static parts leave BATCH_MIN_CONTEXT_TOKENS
+# of study context and the expected answers fit PROMPT_OUTPUT_TOKENS (BATCH_MAX_SHEETS=1 → one call per sheet)
+BATCH_MAX_SHEETS = int(os.getenv("BATCH_MAX_SHEETS", "4") or 1)
+BATCH_MIN_CONTEXT_TOKENS = int(os.getenv("BATCH_MIN_CONTEXT_TOKENS", "2500") or 2500)
+OUTPUT_STATS_PATH = os.getenv("OUTPUT_STATS_PATH", "output_stats.json")  # measured answer sizes per sheet
+OUTPUT_TOKEN_MARGIN = 1.25  # headroom over the measured average answer size
 PROMPTS_DIR = "prompts"
+# Prompt layout (env: PROMPT_LAYOUT): "prefix" = study context first, identical for every call on a PDF so
+# Ollama reuses the evaluated prefix, then per-sheet overrides + template + evidence ranked per sheet for the
+# rest of the window; "sheet" = overrides first and evidence ranked per sheet. PREFIX_CONTEXT_TOKENS sizes the
+# shared context block.
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "prefix").strip().lower()
+PREFIX_CONTEXT_TOKENS = int(os.getenv("PREFIX_CONTEXT_TOKENS", str(BATCH_MIN_CONTEXT_TOKENS)) or BATCH_MIN_CONTEXT_TOKENS)
+# Keep the model — and its prompt cache — loaded between calls (env: OLLAMA_KEEP_ALIVE)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Retrieval: fill the prompt budget with the study passages that best match each sheet (env: RETRIEVAL_ENABLED)
+RETRIEVAL_ENABLED = str(os.getenv("RETRIEVAL_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "800") or 800)
 # Toggle criteria inclusion (env: INCLUDE_CRITERIA=true/false)
 INCLUDE_CRITERIA = str(os.getenv("INCLUDE_CRITERIA", "false")).strip().lower() in ("1", "true", "yes", "on")
+# Max sheet batches in flight per PDF (env: SHEET_CONCURRENCY, falls back to OLLAMA_NUM_PARALLEL)
+SHEET_CONCURRENCY = int(os.getenv("SHEET_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", "1")) or 1)
+# Worker processes for multi-PDF runs, each owning one PDF end-to-end (env: PDF_WORKERS)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1") or 1)
+# Process pool used by the asyncio engine for CPU-bound PDF parsing (env: PDF_PARSE_WORKERS)
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 2)) or 2)
+# Parsed-page cache (content-addressed; bump PDF_EXTRACTOR_VERSION when parsing changes)
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "parse_cache")
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "512") or 512)
+PDF_EXTRACTOR_VERSION = "2"
+# Page engine: "hybrid" = PyMuPDF text + pdfplumber tables on ruled pages only, "pdfplumber" = legacy full pass
+PDF_ENGINE = os.getenv("PDF_ENGINE", "hybrid").strip().lower()
+# OCR for text-less pages: grayscale render DPI, tesseract language, worker processes (capped to a parse
+# worker's share of the CPUs when OCR runs inside the PDF_PARSE_WORKERS / PDF_WORKERS pools), page-hash cache
+OCR_DPI = int(os.getenv("OCR_DPI", "300") or 300)
+OCR_LANG = os.getenv("OCR_LANG", "eng").strip() or "eng"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)) or 2)
+OCR_CACHE_ENABLED = str(os.getenv("OCR_CACHE_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+# LLM response cache (SQLite; identical payloads are answered locally)
+LLM_CACHE_ENABLED = str(os.getenv("LLM_CACHE_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168") or 168)
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64") or 64)  # bytes of stored responses, LRU-evicted
+# Stream completions (NDJSON) and stop as soon as the JSON object closes (env: OLLAMA_STREAM)
+OLLAMA_STREAM = str(os.getenv("OLLAMA_STREAM", "true")).strip().lower() in ("1", "true", "yes", "on")
+STREAM_PROGRESS_EVERY = 16  # report per-sheet token counts every N streamed chunks
+# Structured outputs: send each call's JSON Schema as "format" (needs Ollama ≥ 0.5; false → plain JSON mode)
+OLLAMA_SCHEMA_FORMAT = str(os.getenv("OLLAMA_SCHEMA_FORMAT", "true")).strip().lower() in ("1", "true", "yes", "on")
+# Regex fast path: numeric study facts answered locally (one-row sheets leave the prompt; elsewhere they only
+# fill cells the model left NR) (env: RULES_ENABLED)
+RULES_ENABLED = str(os.getenv("RULES_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+# Study-design gate: sheets that cannot apply (RoB 2 for non-RCTs, ROBINS-I for RCTs, time-to-event without
+# survival analysis, subgroups without subgroup analysis) are NR-filled without a model call (env: DESIGN_GATE_ENABLED)
+DESIGN_GATE_ENABLED = str(os.getenv("DESIGN_GATE_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+# Two-stage extraction: one small study-facts call (Study_ID, design, arms + N, timepoints), injected into every
+# sheet prompt and used to fill those columns locally (env: STUDY_FACTS_ENABLED)
+STUDY_FACTS_ENABLED = str(os.getenv("STUDY_FACTS_ENABLED", "true")).strip().lower() in ("1", "true", "yes", "on")
+# Map-reduce for long studies (env: MAP_REDUCE=auto/on/off): every batch runs over consecutive passage windows that
+# cover the whole body and the partial rows merge with MAP_REDUCE_POLICY (first / majority / evidence).
+# "auto" switches it on once the body exceeds MAP_REDUCE_MIN_TOKENS; MAP_REDUCE_MAX_WINDOWS caps the calls per batch
+MAP_REDUCE = os.getenv("MAP_REDUCE", "auto").strip().lower()
+MAP_REDUCE_POLICY = os.getenv("MAP_REDUCE_POLICY", "evidence").strip().lower()
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "16000") or 16000)
+MAP_REDUCE_MAX_WINDOWS = int(os.getenv("MAP_REDUCE_MAX_WINDOWS", "8") or 8)
+# Structured tables: outcome / biomarker tables also go, as compact CSV (at most TABLE_MAX_TOKENS), to the sheets
+# they feed (the shared study text keeps every table); common layouts map straight to rows (env: TABLE_ROUTING)
+TABLE_ROUTING = str(os.getenv("TABLE_ROUTING", "true")).strip().lower() in ("1", "true", "yes", "on")
+TABLE_MAX_TOKENS = int(os.getenv("TABLE_MAX_TOKENS", "1500") or 1500)
+# Text cleaning before the StudyDocument is built and cached: running headers / footers, the reference list,
+# line-break hyphenation and ligatures never reach a prompt (env: TEXT_CLEANING)
+TEXT_CLEANING = str(os.getenv("TEXT_CLEANING", "true")).strip().lower() in ("1", "true", "yes", "on")
+# Shared Ollama client: pooled connections, cached liveness, circuit breaker
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16") or 16)
+OLLAMA_ALIVE_TTL = float(os.getenv("OLLAMA_ALIVE_TTL", "10") or 10)
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "3") or 3)
+OLLAMA_BREAKER_RESET = float(os.getenv("OLLAMA_BREAKER_RESET", "30") or 30)
 
 # Windows default tesseract path
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-_update_progress = None  # dynamically injected by app.py
+_update_progress = None  # dynamically injected by app.py: (status, step, percent, session_id)
+_SESSION = contextvars.ContextVar("mapper_session", default=None)  # session whose progress _p() reports
+_criteria_provider = None  # optional: path → criteria text, injected by app.py (shared registry)
+_update_sheet_progress = None  # optional: (session_id, sheet, tokens, done), injected by app.py
+_LOG_LOCK = threading.Lock()  # serializes raw-log appends from concurrent sheet workers
 
-def _load_prompt_override(sheet_name: str, columns: list[str]) -> str:
+_OVERRIDE_CONSTRAINTS = "Output only valid JSON. Keep all schema columns. Leave 'NR' when not reported."
+
+
+def _load_prompt_override(sheet_name: str, columns: list[str], include_global: bool = True) -> str:
     """Load or auto-generate a per-sheet prompt override with column-level guidance.
     - Always generate a column-by-column guidance block from provided columns
     - If prompts/<sheet>.txt exists, append its contents below the guidance block
-    - Append prompts/__global__.txt if present
+    - Append prompts/__global__.txt if present (include_global; packed prompts add it once)
     - End with firm constraints to ensure JSON-only output and schema completeness
     Returns combined override text (may be empty).
     """
@@ -81,6 +187,9 @@ def _load_prompt_override(sheet_name: str, columns: list[str]) -> str:
                 if content.strip():
                     text_parts.append(content)
 
+        if not include_global:
+            return "\n\n".join(tp for tp in text_parts if tp.strip()) + "\n"
+
         # Append global overrides if present
         if os.path.exists(global_file):
             with open(global_file, "r", encoding="utf-8") as f:
@@ -89,33 +198,38 @@ def _load_prompt_override(sheet_name: str, columns: list[str]) -> str:
                     text_parts.append(f"[GLOBAL OVERRIDES]\n{g}")
 
         # End with firm constraints
-        text_parts.append("Output only valid JSON. Keep all schema columns. Leave 'NR' when not reported.")
+        text_parts.append(_OVERRIDE_CONSTRAINTS)
 
         return "\n\n".join(tp for tp in text_parts if tp.strip()) + "\n"
     except Exception:
         return ""
 
 
-def _build_sheet_prompt(sheet: str,
-                        columns: list[str],
-                        override_text: str,
-                        sections: dict,
-                        criteria_text: str,
-                        reference_label: str = "") -> str:
-    """Build a single-sheet prompt within PROMPT_BUDGET_CHARS.
-    Priority order:
-      1) Overrides (column-by-column guidance + constraints)
-      2) JSON output instructions + template for this sheet
-      3) Context snippets (criteria + study sections) trimmed to remaining budget
-    """
-    overrides = (override_text or "").strip()
-    schema_obj = {sheet: [{col: "NR" for col in columns}]}
-    preamble = (
+def _prompt_file_stamp(*sheets: str) -> tuple:
+    """mtimes of the prompt files the sheets' static part is read from (0 when absent)."""
+    stamp = []
+    for name in [f"{sheet}.txt" for sheet in sheets] + ["__global__.txt"]:
+        try:
+            stamp.append(os.stat(os.path.join(PROMPTS_DIR, name)).st_mtime_ns)
+        except OSError:
+            stamp.append(0)
+    return tuple(stamp)
+
+
+def _prompt_preamble(reference_label: str) -> str:
+    return (
         "You are a biomedical data extraction specialist. "
         "First, read the per-sheet instructions below. "
         "Then, using the criteria PDF, fill the data template. "
         f"Reference PDF is {reference_label}.\n"
     )
+
+
+def _compose_static_part(sheet: str, columns: list[str], reference_label: str, extra_override: str) -> dict:
+    """Preamble + overrides + JSON template for one sheet (everything that does not depend on the study)."""
+    overrides = ((_load_prompt_override(sheet, columns) or "") + (extra_override or "")).strip()
+    schema_obj = {sheet: [{col: "NR" for col in columns}]}
+    preamble = _prompt_preamble(reference_label)
     core = (
         preamble
         + ("[OVERRIDES]\n" + overrides + "\n\n" if overrides else "")
@@ -125,8 +239,162 @@ def _build_sheet_prompt(sheet: str,
         + "JSON TEMPLATE (fill NR values only where confident):\n"
         + json.dumps(schema_obj, indent=2) + "\n"
     )
+    return {"text": core, "preamble": preamble, "overrides": overrides}
+
+
+def _compose_packed_static_part(batch: list[str], schema: dict, reference_label: str) -> dict:
+    """Static part for several sheets answered in one call: per-sheet overrides, global rules once."""
+    blocks, overrides = [], []
+    for sheet in batch:
+        text = (_load_prompt_override(sheet, schema[sheet], include_global=False) or "").strip()
+        overrides.append(text)
+        blocks.append(f"[OVERRIDES: {sheet}]\n{text}\n\n" if text else "")
+    global_file = os.path.join(PROMPTS_DIR, "__global__.txt")
+    if os.path.exists(global_file):
+        with open(global_file, "r", encoding="utf-8") as f:
+            g = f.read().strip()
+        if g:
+            blocks.append(f"[GLOBAL OVERRIDES]\n{g}\n\n")
+    schema_obj = {sheet: [{col: "NR" for col in schema[sheet]}] for sheet in batch}
+    keys = ", ".join(f'"{sheet}": [ ... ]' for sheet in batch)
+    preamble = _prompt_preamble(reference_label)
+    core = (
+        preamble
+        + "".join(blocks)
+        + f"Answer ALL {len(batch)} sheets in ONE JSON object with one key per sheet and include all columns.\n"
+        + f"{{ {keys} }}\n"
+        + "Rules: preserve existing filled values; fill only missing; use 'NR' if not reported; no markdown or commentary.\n"
+        + _OVERRIDE_CONSTRAINTS + "\n"
+        + "JSON TEMPLATE (fill NR values only where confident):\n"
+        + json.dumps(schema_obj, indent=2) + "\n"
+    )
+    return {"text": core, "preamble": preamble, "overrides": "\n".join(overrides)}
+
+
+def _sheet_static_part(sheet: str, columns: list[str], reference_label: str = "", extra_override: str = "") -> dict:
+    """Memoized static part ({text, tokens, overrides}); editing prompts/*.txt invalidates it."""
+    key = (sheet, tuple(columns), reference_label, extra_override, _prompt_file_stamp(sheet))
+    return _get_prompt_compiler().static(
+        key, lambda: _compose_static_part(sheet, columns, reference_label, extra_override))
+
+
+def _batch_static_part(batch: list[str], schema: dict, reference_label: str = "") -> dict:
+    """Memoized static part for a batch (single sheets use the per-sheet layout unchanged)."""
+    if len(batch) == 1:
+        return _sheet_static_part(batch[0], schema[batch[0]], reference_label)
+    key = (tuple(batch), tuple(tuple(schema[s]) for s in batch), reference_label, _prompt_file_stamp(*batch))
+    return _get_prompt_compiler().static(key, lambda: _compose_packed_static_part(batch, schema, reference_label))
+
+
+def _build_sheet_prompt(sheet: str,
+                        columns: list[str],
+                        doc: StudyDocument,
+                        criteria_text: str,
+                        reference_label: str = "",
+                        query_columns: list[str] | None = None,
+                        extra_override: str = "",
+                        schema: dict | None = None,
+                        facts_text: str = "") -> str:
+    """Build a single-sheet prompt that fills the model's token window.
+    Priority order ("sheet" layout):
+      1) Overrides (column-by-column guidance + constraints)   ┐ static part,
+      2) JSON output instructions + template for this sheet     ┘ memoized per sheet
+      3) Context: criteria (optional) + study evidence sized to the tokens left —
+         BM25-ranked passages for this sheet's columns (RETRIEVAL_ENABLED),
+         otherwise study sections in fixed order, head-truncated
+    "prefix" layout moves a study context shared by the whole template (schema) in front of 1) + 2).
+    facts_text ([STUDY FACTS] from stage 1) goes right after the study context / static part.
+    """
+    static = _sheet_static_part(sheet, columns, reference_label, extra_override)
+    weights = query_terms(query_columns or columns, static["overrides"], sheet)
+    return _assemble_prompt(static, weights, doc, criteria_text, schema or {sheet: columns}, reference_label,
+                            facts_text)
+
+
+def _build_packed_prompt(batch: list[str], schema: dict, doc: StudyDocument, criteria_text: str,
+                         reference_label: str = "", template: dict | None = None, facts_text: str = "") -> str:
+    """Several sheets, one prompt: shared evidence ranked for the union of their columns."""
+    static = _batch_static_part(batch, schema, reference_label)
+    columns = [col for sheet in batch for col in schema[sheet]]
+    weights = query_terms(columns, static["overrides"], " ".join(batch))
+    return _assemble_prompt(static, weights, doc, criteria_text, template or schema, reference_label, facts_text)
+
+
+def _assemble_prompt(static: dict, weights, doc: StudyDocument, criteria_text: str,
+                     schema: dict | None = None, reference_label: str = "", facts_text: str = "") -> str:
+    """
+    Static part + study context sized to the tokens it leaves in the window.
+    ✅ "prefix" layout: shared study prefix + study facts + static body, then evidence ranked for these sheets
+       (passages the prefix already holds skipped) up to the rest of the window; falls back when they do not fit
+    🔹 "sheet" layout: static part + study facts + evidence ranked for these sheets
+    """
+    compiler = _get_prompt_compiler()
+    facts_tokens = estimate_tokens(facts_text) if facts_text else 0
+    if PROMPT_LAYOUT == "prefix" and schema:
+        prefix = _shared_prefix(doc, schema, criteria_text, reference_label)
+        head_tokens = prefix["tokens"] + facts_tokens + static["tokens"]
+        if head_tokens <= compiler.window():
+            extra = _study_context(weights, doc, "", compiler.context_budget(head_tokens), skip=prefix["ids"])
+            return prefix["text"] + facts_text + static["text"][len(static["preamble"]):] + extra
+
+    budget = compiler.context_budget(static["tokens"] + facts_tokens)
+    return static["text"] + facts_text + _study_context(weights, doc, criteria_text, budget)
+
+
+def _prefix_preamble(reference_label: str) -> str:
+    return (
+        "You are a biomedical data extraction specialist. "
+        "The study context comes first; the per-sheet instructions and JSON template follow it. "
+        f"Reference PDF is {reference_label}.\n"
+    )
+
+
+def _shared_prefix(doc: StudyDocument, schema: dict, criteria_text: str, reference_label: str) -> dict:
+    """
+    Study-context prefix shared by every call on one PDF ({text, tokens, ids}, memoized on the document).
+    ✅ Evidence ranked for the union of all template columns, so it never depends on the sheet
+    🔹 Byte-identical across calls → Ollama re-evaluates only the sheet-specific tail
+    """
+    criteria = criteria_text if INCLUDE_CRITERIA else ""
+    key = ("prefix", reference_label, tuple((s, tuple(cols)) for s, cols in schema.items()),
+           hash(criteria), PREFIX_CONTEXT_TOKENS, RETRIEVAL_ENABLED, RETRIEVAL_CHUNK_CHARS)
+
+    def build():
+        columns = [col for cols in schema.values() for col in cols]
+        weights = query_terms(columns, "", " ".join(schema))
+        head, tail = "[STUDY CONTEXT]\n", "[END STUDY CONTEXT]\n\n"
+        preamble = _prefix_preamble(reference_label)
+        budget = PREFIX_CONTEXT_TOKENS - estimate_tokens(preamble + head + tail)
+        ids = []
+        text = preamble + head + _study_context(weights, doc, criteria, budget, picked=ids) + tail
+        return {"text": text, "tokens": estimate_tokens(text), "ids": frozenset(ids)}
+
+    return doc.memo(key, build)
+
 
-    static_part = core
+def _study_context(weights, doc: StudyDocument, criteria_text: str, budget: int,
+                   skip=None, picked: list | None = None) -> str:
+    """
+    Criteria (optional) + study evidence fitting budget tokens.
+    skip: passage ids already in the prompt (extra evidence after a shared prefix; the
+    section-order fallback then adds nothing). picked collects the chosen passage ids.
+    """
+    sections = doc.sections
+    index = _doc_index(doc)
+
+    criteria_block = ""
+    if INCLUDE_CRITERIA and (criteria_text or "").strip():
+        criteria_block = "[CRITERIA]\n" + (criteria_text or '') + "\n"
+
+    if index is not None and len(index):
+        criteria_block = fit_to_tokens(criteria_block, budget // 3)
+        budget -= estimate_tokens(criteria_block) + estimate_tokens("[EVIDENCE]\n")
+        passages = index.select(weights, budget, cost=_passage_tokens, skip=skip or ())
+        if picked is not None:
+            picked.extend(p["id"] for p in passages)
+        return criteria_block + render_passages(passages)
+    if skip is not None:
+        return criteria_block
 
     # Context to be trimmed by remaining budget
     methods = sections.get('methods', '') or ''
@@ -135,39 +403,58 @@ def _build_sheet_prompt(sheet: str,
     intro = sections.get('introduction', '') or ''
 
     # Build context with optional criteria block first
-    context_parts = []
-    if INCLUDE_CRITERIA and (criteria_text or "").strip():
-        context_parts.append("[CRITERIA]\n" + (criteria_text or '') + "\n")
+    context_parts = [criteria_block] if criteria_block else []
     context_parts.append("[METHODS]\n" + methods + "\n")
     context_parts.append("[RESULTS]\n" + results + "\n")
     context_parts.append("[CONCLUSION]\n" + conclusion + "\n")
     context_parts.append("[INTRODUCTION]\n" + intro + "\n")
     context_blob = "".join(context_parts)
 
-    remaining = max(0, PROMPT_BUDGET_CHARS - len(static_part))
-    context_trimmed = context_blob[:remaining]
+    return fit_to_tokens(context_blob, budget)
+
+
+def _passage_tokens(chunk: dict) -> int:
+    """Token cost of one rendered passage (estimate memoized on the chunk)."""
+    if "tokens" not in chunk:
+        chunk["tokens"] = estimate_tokens(render_passages([chunk])) - estimate_tokens("[EVIDENCE]\n")
+    return chunk["tokens"]
+
 
-    return static_part + context_trimmed
+_CONTEXT_BLOCK_RE = re.compile(r"\[STUDY CONTEXT[^\]\n]*\]\n")
+_CONTEXT_TAIL_RE = re.compile(r"\[(?:CRITERIA|EVIDENCE|METHODS)\]\n")
 
 
-# Lightweight section splitter (used by resume)
+def _context_spans(prompt: str) -> list[tuple[int, int]]:
+    """
+    Study-context spans of an assembled prompt, cheapest to lose first: evidence after the
+    instructions ("sheet" layout, resume extras), then the [STUDY CONTEXT] blocks.
+    """
+    blocks = []
+    for m in _CONTEXT_BLOCK_RE.finditer(prompt):
+        end = prompt.find("[END STUDY CONTEXT]", m.end())
+        blocks.append((m.end(), end if end >= 0 else len(prompt)))
+    tail = _CONTEXT_TAIL_RE.search(prompt, blocks[-1][1] if blocks else 0)
+    return ([(tail.start(), len(prompt))] if tail else []) + blocks[::-1]
+
+
+def _fit_prompt(prompt: str, token_limit: int) -> str:
+    """Prompt within token_limit: study context shrinks, instructions and JSON template are never cut."""
+    return shrink_to_tokens(prompt, token_limit, _context_spans(prompt))
+
+
+# Lightweight section splitter (plain text; StudyDocument keeps the same spans with offsets)
 def _split_sections_global(text: str) -> dict:
-    sections = {}
     try:
-        for sec in ("Introduction", "Methods", "Results", "Discussion", "Conclusion"):
-            m = re.search(rf"{sec}[:\s\n]+", text or "", re.I)
-            if m:
-                start = m.start()
-                nxt = len(text)
-                for sec2 in ("Introduction", "Methods", "Results", "Discussion", "Conclusion"):
-                    if sec2 != sec:
-                        m2 = re.search(rf"{sec2}[:\s\n]+", (text or "")[start+1:], re.I)
-                        if m2:
-                            nxt = min(nxt, start + 1 + m2.start())
-                sections[sec.lower()] = text[start:nxt]
+        return split_sections(text)
     except Exception:
-        pass
-    return sections
+        return {}
+
+
+def _doc_index(doc: StudyDocument) -> ChunkIndex | None:
+    """Passage index for retrieval-based prompts (None when RETRIEVAL_ENABLED is off)."""
+    if not RETRIEVAL_ENABLED:
+        return None
+    return doc.chunk_index(RETRIEVAL_CHUNK_CHARS)
 
 
 # ---------------- UTIL ----------------
@@ -178,7 +465,7 @@ def _p(pct, msg):
     """Progress-safe print and callback."""
     if callable(_update_progress):
         try:
-            _update_progress("running", msg, pct)
+            _update_progress("running", msg, pct, _SESSION.get())
         except Exception:
             pass
 
@@ -318,64 +605,253 @@ def check_completeness(data_dict):
 
 
 # ---------------- PDF READER ----------------
-def read_pdf_text(pdf_path: str) -> str:
-    """Extract text + tables + OCR from PDFs."""
-    text = []
-    _p(10, f"Reading PDF: {os.path.basename(pdf_path)}")
+_PARSE_CACHE = None
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def _get_parse_cache() -> ParseCache:
+    """Shared content-addressed parse cache (lazy, one per process)."""
+    global _PARSE_CACHE
+    with _PARSE_CACHE_LOCK:
+        if _PARSE_CACHE is None:
+            _PARSE_CACHE = ParseCache(PARSE_CACHE_DIR, PARSE_CACHE_MAX_MB * 1024 * 1024)
+        return _PARSE_CACHE
+
+
+def _parse_settings() -> dict:
+    """Settings that change parse output; part of the parse-cache key."""
+    engine = "pdfplumber" if PDF_ENGINE == "pdfplumber" else f"hybrid{page_engine.PAGE_ENGINE_VERSION}"
+    return {"tables": True, "ocr": {"dpi": OCR_DPI, "lang": OCR_LANG, "version": ocr.OCR_VERSION}, "engine": engine}
+
+
+def _ocr_workers() -> int:
+    """OCR_WORKERS, or this process's share of the CPUs inside a worker pool (1 → OCR inline, no nested pool)."""
+    if multiprocessing.parent_process() is None:
+        return max(1, OCR_WORKERS)
+    share = (os.cpu_count() or 1) // max(1, PDF_PARSE_WORKERS, PDF_WORKERS)
+    return max(1, min(OCR_WORKERS, share))
+
+
+def _ocr_pages(doc, page_numbers: list[int]) -> dict:
+    """OCR for text-less pages: grayscale renders at OCR_DPI, page-hash cache, _ocr_workers() processes."""
+    workers = _ocr_workers()
+    print(f"🔎 OCR: {len(page_numbers)} text-less page(s) at {OCR_DPI} dpi, {workers} worker(s)")
+    cache = _get_parse_cache() if OCR_CACHE_ENABLED else None
+    return ocr.run(doc, page_numbers, dpi=OCR_DPI, lang=OCR_LANG, workers=workers, cache=cache,
+                   tesseract_cmd=pytesseract.pytesseract.tesseract_cmd)
+
+
+def _iter_pdf_pages(pdf_path: str):
+    """Parse pages one at a time into {page, text, tables, ocr} (no caching)."""
+    if PDF_ENGINE == "pdfplumber":
+        return page_engine.iter_pages_full(pdf_path, ocr=_ocr_pages)
+    return page_engine.iter_pages(pdf_path, ocr=_ocr_pages)
+
+
+def _parse_pdf_pages(pdf_path: str) -> list[dict]:
+    """Parse every page into {page, text, tables, ocr} (no caching)."""
+    return list(_iter_pdf_pages(pdf_path))
+
+
+def _page_text(rec: dict) -> str:
+    """Assemble one page record into text: body, then table rows, then OCR."""
+    page_text = rec.get("text") or ""
+    for table in rec.get("tables") or []:
+        for row in table:
+            if any(row):
+                page_text += "\n" + " | ".join([str(c).strip() for c in row if c])
+    if rec.get("ocr"):
+        page_text += "\n" + rec["ocr"]
+    return page_text
 
+
+def _clean_pages(texts: list[str]) -> list[str]:
+    """Boilerplate / reference-list stripping over a document's page texts (logged)."""
+    cleaned, stats = cleaner.clean_pages(texts)
+    saved = stats["chars_before"] - stats["chars_after"]
+    if saved:
+        print(f"🧹 Cleaned text: -{saved} chars ({100 * saved / max(1, stats['chars_before']):.0f}%) — "
+              f"{stats['boilerplate_lines']} header/footer line(s), {stats['reference_lines']} reference line(s), "
+              f"{stats['hyphen_joins']} hyphen join(s)")
+    return cleaned
+
+
+def iter_pdf_pages(pdf_path: str, use_cache: bool = True):
+    """
+    Per-page records for a PDF, yielded as each page is parsed (or replayed from the parse cache).
+    Cache key = file SHA-256 + PDF_EXTRACTOR_VERSION + parse settings; the entry is written once
+    the last page is through, unless a page failed OCR.
+    """
+    cache = _get_parse_cache() if use_cache else None
+    key = None
+    if cache is not None:
+        try:
+            key = cache.key_for(pdf_path, PDF_EXTRACTOR_VERSION, _parse_settings())
+            pages = cache.get(key)
+            if pages is not None:
+                print(f"⚡ Parse cache hit: {os.path.basename(pdf_path)}")
+                yield from pages
+                return
+        except Exception as e:
+            print(f"⚠️ Parse cache lookup failed for {pdf_path}: {e}")
+
+    pages = []
+    for rec in _iter_pdf_pages(pdf_path):
+        pages.append(rec)
+        yield rec
+    if cache is not None and key and not any(p.get("ocr_error") for p in pages):
+        cache.put(key, pages)
+
+
+def read_pdf_pages(pdf_path: str, use_cache: bool = True) -> list[dict]:
+    """All page records for a PDF (see iter_pdf_pages)."""
+    return list(iter_pdf_pages(pdf_path, use_cache=use_cache))
+
+
+def load_document(pdf_path: str, use_cache: bool = True) -> StudyDocument:
+    """
+    Structured document (text, page spans, headings, sections, tables) for a PDF.
+    Assembled from the page records of iter_pdf_pages — the parse cache's single entry per
+    (file SHA-256, PDF_EXTRACTOR_VERSION, parse settings) — and cleaned of headers / footers and the
+    reference list (TEXT_CLEANING), so resume passes and later runs skip parsing; cleaning and section
+    detection always follow the current code.
+    """
+    _p(10, f"Reading PDF: {os.path.basename(pdf_path)}")
+    source = os.path.basename(pdf_path)
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages, start=1):
-                page_text = page.extract_text() or ""
-                # Add tables
-                for table in page.extract_tables() or []:
-                    for row in table:
-                        if any(row):
-                            page_text += "\n" + " | ".join([str(c).strip() for c in row if c])
-                # OCR fallback
-                if not page_text.strip():
-                    with fitz.open(pdf_path) as doc:
-                        pix = doc[i - 1].get_pixmap()
-                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                        ocr_text = pytesseract.image_to_string(img)
-                        if ocr_text.strip():
-                            page_text += "\n" + ocr_text.strip()
-                if page_text.strip():
-                    text.append(page_text.strip())
+        return StudyDocument.from_pages(iter_pdf_pages(pdf_path, use_cache=use_cache), _page_text, source,
+                                        clean=_clean_pages if TEXT_CLEANING else None)
     except Exception as e:
-        text.append(f"[ERROR reading {pdf_path}: {e}]")
+        return StudyDocument.from_pages([{"page": 1, "text": f"[ERROR reading {pdf_path}: {e}]"}], _page_text, source)
+
 
-    return "\n".join(text)
+def read_pdf_text(pdf_path: str) -> str:
+    """Extract text + tables + OCR from PDFs (cached by content hash)."""
+    return load_document(pdf_path).text
+
+
+def load_criteria_text(criteria_pdf: str) -> str:
+    """Criteria PDF text via the injected shared registry, else a (cached) direct read."""
+    if callable(_criteria_provider):
+        try:
+            return _criteria_provider(criteria_pdf)
+        except Exception as e:
+            print(f"⚠️ Criteria registry unavailable ({e}) — reading {criteria_pdf} directly")
+    return read_pdf_text(criteria_pdf)
 
 
 # ---------------- LLM CALL ----------------
-def query_llama(prompt: str, model: str = MODEL_NAME) -> str:
-    """
-    Send prompt to local Ollama model with enforced JSON-only output.
-    ✅ Schema-anchored and repair-safe
-    ✅ Supports system message + JSON template injection
-    ✅ Works for Llama3 and Meditron-Instruct models
-    """
+_LLM_CACHE = None
+_LLM_CACHE_LOCK = threading.Lock()
+
+
+def _get_llm_cache() -> ResponseCache | None:
+    """Shared SQLite response cache (lazy; None when LLM_CACHE_ENABLED is off)."""
+    global _LLM_CACHE
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _LLM_CACHE_LOCK:
+        if _LLM_CACHE is None:
+            _LLM_CACHE = ResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_HOURS * 3600, int(LLM_CACHE_MAX_MB * 1024 * 1024))
+        return _LLM_CACHE
+
+
+_OLLAMA_CLIENT = None
+_OLLAMA_CLIENT_LOCK = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Process-wide Ollama client (rebuilt after fork so pooled sockets are never shared)."""
+    global _OLLAMA_CLIENT
+    with _OLLAMA_CLIENT_LOCK:
+        if _OLLAMA_CLIENT is None or _OLLAMA_CLIENT[0] != os.getpid():
+            _OLLAMA_CLIENT = (os.getpid(), OllamaClient(
+                OLLAMA_API, pool_size=OLLAMA_POOL_SIZE, alive_ttl=OLLAMA_ALIVE_TTL,
+                failure_threshold=OLLAMA_BREAKER_FAILURES, reset_timeout=OLLAMA_BREAKER_RESET,
+            ))
+        return _OLLAMA_CLIENT[1]
+
+
+_PROMPT_COMPILER = None
+_PROMPT_COMPILER_LOCK = threading.Lock()
+
+
+def _get_prompt_compiler() -> PromptCompiler:
+    """Process-wide token budget + static-part memo (wrapper/system tokens measured once)."""
+    global _PROMPT_COMPILER
+    with _PROMPT_COMPILER_LOCK:
+        if _PROMPT_COMPILER is None:
+            wrapper = _make_payload("", MODEL_NAME)
+            _PROMPT_COMPILER = PromptCompiler(
+                OLLAMA_NUM_CTX, PROMPT_OUTPUT_TOKENS,
+                wrapper_tokens=estimate_tokens(wrapper["prompt"]) + estimate_tokens(wrapper["system"]),
+            )
+        return _PROMPT_COMPILER
+
+
+_OUTPUT_STATS = None
+_OUTPUT_STATS_LOCK = threading.Lock()
+
+
+def _get_output_stats() -> OutputStats:
+    """Measured per-sheet answer sizes (persisted at OUTPUT_STATS_PATH)."""
+    global _OUTPUT_STATS
+    with _OUTPUT_STATS_LOCK:
+        if _OUTPUT_STATS is None:
+            _OUTPUT_STATS = OutputStats(OUTPUT_STATS_PATH)
+        return _OUTPUT_STATS
 
-    import requests, time, re
 
-    # --- health check ---
-    def _ollama_alive():
+def _report_sheet_tokens(session_id: str | None, sheet: str | None, tokens: int, done: bool = False):
+    """Forward streamed token counts to the app (no-op outside the API)."""
+    if callable(_update_sheet_progress) and session_id and sheet:
         try:
-            r = requests.get("http://localhost:11434/api/tags", timeout=5)
-            return r.status_code == 200
+            _update_sheet_progress(session_id, sheet, tokens, done)
         except Exception:
-            return False
+            pass
 
-    if not _ollama_alive():
-        print("🛑 Ollama not responding — skipping query to protect run.")
-        return "{}"
 
-    _p(50, f"Querying {model} via Ollama (safe mode)…")
+def _stream_step(line, scanner: JsonStreamScanner, pieces: list, session_id, sheet) -> bool:
+    """Handle one NDJSON line; returns True when reading should stop."""
+    if not line:
+        return False
+    chunk = json.loads(line)
+    if chunk.get("error"):
+        raise RuntimeError(chunk["error"])
+    piece = chunk.get("response", "")
+    pieces.append(piece)
+    state = scanner.feed(piece)
+    if len(pieces) % STREAM_PROGRESS_EVERY == 0:
+        _report_sheet_tokens(session_id, sheet, len(pieces))
+    if state == BROKEN:
+        print(f"🟠 Stream stopped early for {sheet or 'prompt'}: {scanner.reason}")
+    return state in (COMPLETE, BROKEN) or bool(chunk.get("done"))
+
+
+def _stream_result(scanner: JsonStreamScanner, pieces: list, session_id, sheet) -> str:
+    _report_sheet_tokens(session_id, sheet, len(pieces), done=True)
+    return scanner.text if scanner.state == COMPLETE else "".join(pieces).strip()
+
+
+def _read_stream(resp, session_id: str | None = None, sheet: str | None = None) -> str:
+    """
+    Consume Ollama NDJSON chunks through an incremental JSON scanner.
+    Stops (and closes the connection, which aborts generation) once the top-level
+    object closes or the output can no longer become valid JSON.
+    """
+    scanner, pieces = JsonStreamScanner(), []
+    try:
+        for line in resp.iter_lines():
+            if _stream_step(line, scanner, pieces, session_id, sheet):
+                break
+    finally:
+        resp.close()
+    return _stream_result(scanner, pieces, session_id, sheet)
 
-    # --- wrap prompt ---
-    def make_payload(prompt_text: str):
-        safe_prompt = f"""
+
+def _make_payload(prompt_text: str, model: str = MODEL_NAME, json_schema: dict | None = None) -> dict:
+    """Final Ollama payload: wrapped prompt + global schema anchor + options (+ output JSON Schema)."""
+    safe_prompt = f"""
 You are a biomedical data extraction and harmonization specialist for the
 CardioProtect meta-analysis project.
 
@@ -388,66 +864,120 @@ PROMPT START
 PROMPT END
 """
 
-        return {
-            "model": model,
-            # 🔹 global schema anchor for all runs
-            "system": (
-                "You are an expert biomedical data extractor. "
-                "Always output valid JSON with exactly the same keys as the schema shown. "
-                "Replace 'NR' values where confident, otherwise leave them. "
-                "Never add or rename keys."
-            ),
-            "prompt": safe_prompt,
-            "format": "json",            # enforce JSON mode
-            "stream": False,
-            "options": {
-                "num_ctx": 8192,         # keeps context from truncating
-                "temperature": 0,
-                "num_gpu": 0,
-                "stop": ["```", "Answer:", "As an AI", "Result:", "Output:"]
-            }
+    return {
+        "model": model,
+        # 🔹 global schema anchor for all runs
+        "system": (
+            "You are an expert biomedical data extractor. "
+            "Always output valid JSON with exactly the same keys as the schema shown. "
+            "Replace 'NR' values where confident, otherwise leave them. "
+            "Never add or rename keys."
+        ),
+        "prompt": safe_prompt,
+        # grammar-constrained to the sheet schema when given, else plain JSON mode
+        "format": json_schema if (json_schema and OLLAMA_SCHEMA_FORMAT) else "json",
+        "stream": OLLAMA_STREAM,
+        "keep_alive": OLLAMA_KEEP_ALIVE,  # keep weights + prompt cache warm between sheets
+        "options": {
+            "num_ctx": OLLAMA_NUM_CTX,  # prompts are compiled to fit this window
+            "temperature": 0,
+            "num_gpu": 0,
+            "stop": ["```", "Answer:", "As an AI", "Result:", "Output:"]
         }
+    }
+
+
+def _clean_response(raw: str) -> str:
+    """Strip code fences and text before the JSON object (the parser drops anything after it)."""
+    raw = re.sub(r"^```(json)?", "", raw, flags=re.I).strip()
+    raw = re.sub(r"```$", "", raw).strip()
+    start = raw.find("{")
+    if start > 0:
+        raw = raw[start:]
+    return raw
+
+
+def _record_response(prompt: str, raw: str, attempt: int, cache, payload: dict, model: str):
+    """Append to the raw log and store parseable answers in the response cache."""
+    # --- log success ---
+    with _LOG_LOCK, open(RAW_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(
+            "\n" + "=" * 80 +
+            f"\n✅ SUCCESS (Attempt {attempt})\nPrompt (first 600 chars):\n{prompt[:600]}\n\n" +
+            f"Response (first 1200 chars):\n{raw[:1200]}\n" +
+            "=" * 80 + "\n"
+        )
+
+    # only complete answers are cached, so a retry never replays a bad, cut-off or mis-bracketed one
+    if cache is not None and raw and raw != "{}":
+        repairs = []
+        try:
+            loads_tolerant(raw, repairs)
+        except JsonRepairError:
+            return
+        if not truncated(repairs):
+            cache.put(payload_key(payload), raw, model)
+
+
+def query_llama(prompt: str, model: str = MODEL_NAME, use_cache: bool = True,
+                session_id: str | None = None, sheet: str | None = None,
+                json_schema: dict | None = None) -> str:
+    """
+    Send prompt to local Ollama model with enforced JSON-only output.
+    ✅ Schema-anchored and repair-safe
+    ✅ Supports system message + JSON template injection
+    ✅ Works for Llama3 and Meditron-Instruct models
+    ✅ Answers identical payloads from the SQLite response cache (use_cache=False bypasses)
+    ✅ Streams by default (OLLAMA_STREAM) and stops once the JSON object closes;
+       session_id/sheet route token progress to the app
+    ✅ json_schema (sheet_schema of the requested sheets) constrains decoding to the expected sheets/columns
+    Raises OllamaUnavailableError when no answer came back (server down, circuit open, 5xx, retries used up).
+    """
+
+    import requests, time
+
+    client = get_ollama_client()
 
     # --- retry loop ---
     max_retries = 3
-    context_limit = 24000
+    token_limit = _get_prompt_compiler().window()  # compiled prompts already fit → first try sends them whole
     base_delay = 8
     last_error = None
 
+    # --- response cache (checked before the health probe: hits need no server) ---
+    cache = _get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(payload_key(_make_payload(_fit_prompt(prompt, token_limit), model, json_schema)))
+        if cached is not None:
+            _p(50, f"⚡ LLM cache hit ({model})")
+            return cached
+
+    if not client.alive():
+        raise OllamaUnavailableError("Ollama not responding")
+
+    _p(50, f"Querying {model} via Ollama (safe mode)…")
+
     for attempt in range(1, max_retries + 1):
         try:
-            payload = make_payload(prompt[:context_limit])
-            resp = requests.post(OLLAMA_API, json=payload, timeout=600)
+            payload = _make_payload(_fit_prompt(prompt, token_limit), model, json_schema)
+            resp = client.generate(payload, timeout=600, stream=OLLAMA_STREAM)
 
             if resp.status_code >= 500:
-                print(f"⚠️ Ollama internal error (HTTP {resp.status_code}) — skipping this query.")
-                return "{}"
-
-            data = resp.json()
-            raw = data.get("response", "").strip()
-
-            # --- sanitize ---
-            raw = re.sub(r"^```(json)?", "", raw, flags=re.I).strip()
-            raw = re.sub(r"```$", "", raw).strip()
-            if not raw.startswith("{"):
-                m = re.search(r"\{[\s\S]*\}", raw)
-                if m:
-                    raw = m.group(0)
-            if not raw.endswith("}"):
-                m = re.search(r".*\}", raw, re.S)
-                if m:
-                    raw = m.group(0)
-
-            # --- log success ---
-            with open(RAW_LOG_PATH, "a", encoding="utf-8") as f:
-                f.write(
-                    "\n" + "=" * 80 +
-                    f"\n✅ SUCCESS (Attempt {attempt})\nPrompt (first 600 chars):\n{prompt[:600]}\n\n" +
-                    f"Response (first 1200 chars):\n{raw[:1200]}\n" +
-                    "=" * 80 + "\n"
-                )
+                resp.close()
+                raise OllamaUnavailableError(f"Ollama internal error (HTTP {resp.status_code})")
+
+            if OLLAMA_STREAM:
+                raw = _read_stream(resp, session_id, sheet)
+            else:
+                data = resp.json()
+                raw = data.get("response", "").strip()
+
+            raw = _clean_response(raw)
+            _record_response(prompt, raw, attempt, cache, payload, model)
             return raw
 
+        except OllamaUnavailableError:
+            raise
         except requests.exceptions.Timeout:
             last_error = "timeout"
             print(f"⏱️ [Attempt {attempt}] Timeout, waiting {base_delay}s...")
@@ -459,63 +989,33 @@ PROMPT END
             print(f"⚠️ [Attempt {attempt}] Unexpected error: {e}")
 
         # back-off
-        context_limit = max(1000, int(context_limit * 0.6))
+        token_limit = max(300, int(token_limit * 0.6))
         base_delay = min(30, base_delay * 1.5)
-        print(f"⚠️ Retrying with reduced context ({context_limit}) in {int(base_delay)}s...")
+        print(f"⚠️ Retrying with reduced context ({token_limit} tokens) in {int(base_delay)}s...")
         time.sleep(base_delay)
 
-    print(f"❌ {model} failed after {max_retries} attempts — skipping this query safely.")
-    return "{}"
-
-
+    raise OllamaUnavailableError(f"{model} failed after {max_retries} attempts ({last_error})")
 
 
 
 # ---------------- JSON REPAIR ----------------
 def safe_json_parse(response_text: str):
     """
-    Robust JSON repair and parsing. Cleans markdown, commentary, and dangling braces.
-    """
-    # Extract JSON-like portion
-    match = re.search(r"\{[\s\S]*\}", response_text)
-    json_str = match.group(0) if match else response_text
-
-    # Clean typical noise from Ollama / Llama3
-    fixed = (
-        json_str.replace("**", "")
-        .replace("*", "")
-        .replace("```json", "")
-        .replace("```", "")
-        .replace("True", "true")
-        .replace("False", "false")
-        .replace("None", "null")
-        .replace("…", "")
-    )
-
-    # Repair typical dangling commas / malformed tokens
-    fixed = re.sub(r",\s*([\}\]])", r"\1", fixed)
-    fixed = re.sub(r"[\x00-\x1F]+", " ", fixed)
-    fixed = re.sub(r"NR(?=[,\}\]])", '"NR"', fixed)
-    fixed = re.sub(r"NA(?=[,\}\]])", '"NA"', fixed)
-
-    # Try multiple parsing attempts
+    Parse model output locally (extractor/json_repair.py, one linear pass).
+    ✅ Closes truncated strings / arrays / objects, quotes bare NR/NA, drops prose and trailing garbage
+    ✅ True/False/None are only converted as bare tokens, never inside string values
+    Raises ValueError when the text holds no JSON at all.
+    """
+    repairs = []
     try:
-        return json.loads(fixed)
-    except Exception:
-        try:
-            return json5.loads(fixed)
-        except Exception as e:
-            # Try balancing braces if truncated
-            open_braces = fixed.count("{") - fixed.count("}")
-            if open_braces > 0:
-                fixed += "}" * open_braces
-            try:
-                return json5.loads(fixed)
-            except Exception as e2:
-                with open("llama_bad_json.txt", "w", encoding="utf-8") as f:
-                    f.write(response_text)
-                raise ValueError(f"🟠 Model output could not be repaired: {e2}")
-
+        data = loads_tolerant(response_text or "", repairs)
+    except JsonRepairError as e:
+        with _LOG_LOCK, open(RAW_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write("\n" + "=" * 80 + f"\n❌ UNPARSEABLE ({e})\n{response_text or ''}\n" + "=" * 80 + "\n")
+        raise ValueError(f"🟠 Model output could not be repaired: {e}")
+    if repairs:
+        print(f"🩹 Repaired model JSON locally ({len(repairs)} fix(es): {'; '.join(repairs[:3])})")
+    return data
 
 
 def _validate_sheet_records(records: list[dict], sheet_name: str, schema_cols: list[str]) -> list[dict]:
@@ -540,7 +1040,7 @@ def _validate_sheet_records(records: list[dict], sheet_name: str, schema_cols: l
     # numeric normalization for key metrics
     numeric_like = ["age", "sample", "arm", "followup", "dose", "duration"]
     for col in df.columns:
-        if any(key in col.lower() for key in numeric_like):
+        if any(key in col.lower() for key in numeric_like) and "name" not in col.lower():  # not Arm_Name
             df[col] = (
                 df[col].astype(str)
                 .str.extract(r"(\d+\.?\d*)")[0]
@@ -568,196 +1068,311 @@ def _validate_sheet_records(records: list[dict], sheet_name: str, schema_cols: l
 
 
 
-# ---------------- EXTRACTION CORE ----------------
-def extract_fields(study_pdf: str, criteria_pdf: str, template_xlsx: str, session_id: str | None = None):
+# ---------------- BATCH WORKERS ----------------
+def _nr_batch(batch: list[str], schema: dict) -> dict:
+    return {s: [{col: "NR" for col in schema[s]}] for s in batch}
+
+
+def _parse_answer(response: str, sheets: dict, answer_schema: dict, label: str) -> dict:
     """
-    Extract fields, retry failed batches, and resume from per-PDF partial caches.
-    🧠 High-Accuracy Version:
-    - Section-based prompt slicing
-    - Confidence-based extraction rules
-    - Validation after each batch
-    - Auto-preserves filled data
+    Parse a model answer and map it onto the requested sheets — locally, never via another model call.
+    Raises ValueError only when the text is not JSON at all (caller retries).
     """
-    _p(15, f"Loading PDFs and schema for {os.path.basename(study_pdf)}...")
-    study_text = read_pdf_text(study_pdf)
-    criteria_text = read_pdf_text(criteria_pdf)
-
-    # helper to split sections for higher accuracy
-    def _split_sections(text: str):
-        sections = {}
-        for sec in ("Introduction", "Methods", "Results", "Discussion", "Conclusion"):
-            m = re.search(rf"{sec}[:\s\n]+", text, re.I)
-            if m:
-                start = m.start()
-                nxt = len(text)
-                for sec2 in ("Introduction", "Methods", "Results", "Discussion", "Conclusion"):
-                    if sec2 != sec:
-                        m2 = re.search(rf"{sec2}[:\s\n]+", text[start+1:], re.I)
-                        if m2:
-                            nxt = min(nxt, start + 1 + m2.start())
-                sections[sec.lower()] = text[start:nxt]
-        return sections
-
-    sections = _split_sections(study_text)
+    data = safe_json_parse(response)
+    errors = validate(data, answer_schema)
+    if errors and data != {}:
+        _p(60, f"🩹 {label}: {len(errors)} schema issue(s) conformed locally ({errors[0]})")
+    return conform(data, sheets)
 
-    xl = pd.ExcelFile(template_xlsx)
-    sheet_names = xl.sheet_names
-    schema = {s: list(xl.parse(s, nrows=1).columns) for s in sheet_names}
 
-    # Per-sheet prompting to control prompt size and increase accuracy
-    batches = [sheet_names[i:i + 1] for i in range(0, len(sheet_names), 1)]
-    filled, cache = {}, _load_partial(study_pdf, session_id)
+def _batch_prompt(batch: list[str], schema: dict, doc: StudyDocument, criteria_text: str,
+                  reference_label: str, template: dict | None = None, facts_text: str = "") -> str:
+    """
+    Build a budgeted prompt that starts with your per-sheet instructions (packed when len(batch) > 1).
+    schema = columns to ask for; template = full template columns (the shared prefix is ranked for them).
+    """
+    if len(batch) > 1:
+        return _build_packed_prompt(batch, schema, doc, criteria_text, reference_label, template, facts_text)
+    s0 = batch[0]
+    return _build_sheet_prompt(s0, schema[s0], doc, criteria_text, reference_label, schema=template or schema,
+                               facts_text=facts_text)
+
+
+def _full_batch_prompt(batch: list[str], schema: dict, doc: StudyDocument, criteria_text: str,
+                       reference_label: str, template: dict | None, facts_text: str, window: list | None) -> str:
+    """Prompt for one batch: a map-reduce window, or the whole study (facts + routed tables up front)."""
+    known_text = facts_text + _tables_text(doc, batch, window)
+    if window is not None:
+        return _window_prompt(batch, schema, window, known_text, reference_label)
+    return _batch_prompt(batch, schema, doc, criteria_text, reference_label, template, known_text)
+
+
+def _extract_batch(bi: int, total: int, batch: list[str], schema: dict, doc: StudyDocument,
+                   criteria_text: str, reference_label: str, use_llm_cache: bool = True,
+                   session_id: str | None = None, template: dict | None = None, facts_text: str = "",
+                   window: list | None = None) -> dict:
+    """
+    Run one sheet batch end-to-end: build prompt → schema-constrained query → parse + conform (retries).
+    Thread-safe: touches no shared state, so several batches can run concurrently.
+    Packed batches get one attempt, then unanswered sheets are split in halves and re-run.
+    schema holds the columns still to ask (locally answered ones removed); template the full columns;
+    facts_text is the stage-1 [STUDY FACTS] block; window (map-reduce) replaces the evidence with one passage window.
+    Returns { sheet: rows } (NR-filled when every attempt fails; {} when rules answered everything).
+    Raises OllamaUnavailableError when the model gave no answer at all (the batch is failed, not NR-filled).
+    """
+    if not any(schema[s] for s in batch):
+        _p(55, f"⚡ Batch {bi}/{total} answered by rules — no model call")
+        return {}
+    attempt, success, data = 0, False, {}
+    label = ", ".join(batch)
+    sheets = {s: schema[s] for s in batch}
+    answer_schema = sheet_schema(sheets)
+    max_retries = MAX_RETRIES_PER_BATCH if len(batch) == 1 else 0
+    while attempt <= max_retries and not success:
+        _p(40, f"Batch {bi}/{total} Attempt {attempt + 1}")
+        full_prompt = _full_batch_prompt(batch, schema, doc, criteria_text, reference_label, template,
+                                         facts_text, window)
+
+        # --------------- MODEL CALL ----------------
+        _p(45, f"Querying model for batch {bi}/{total}...")
+        try:
+            response = query_llama(full_prompt, use_cache=use_llm_cache, session_id=session_id, sheet=label,
+                                   json_schema=answer_schema)
+        except OllamaUnavailableError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Llama call failed: {e} — retrying with shorter prompt...")
+            try:
+                # Reduce context if model fails due to memory/context overflow
+                response = query_llama(full_prompt[:3000], use_cache=use_llm_cache,
+                                       session_id=session_id, sheet=label, json_schema=answer_schema)
+            except OllamaUnavailableError:
+                raise
+            except Exception as e2:
+                print(f"❌ Fallback query also failed: {e2}")
+                response = "{}"  # return empty JSON to prevent crash
 
-    for bi, batch in enumerate(batches, start=1):
-        if all(sheet in cache for sheet in batch):
-            _p(25 + bi * 10, f"Skipping batch {bi}/{len(batches)} (already cached ✅)")
-            filled.update({s: cache[s] for s in batch})
-            continue
+        try:
+            data = _parse_answer(response, sheets, answer_schema, f"batch {bi}")
+            success = True
+            _p(55, f"✅ Batch {bi}/{total} parsed successfully")
+        except Exception as e:
+            attempt += 1
+            _p(70, f"Retry {attempt} failed for batch {bi} ({e})")
+
+    if success:
+        _record_output_sizes(batch, data)
+    if len(batch) > 1:
+        answered, missing = _split_packed_answer(bi, batch, data if success else {})
+        for part in missing:
+            answered.update(_extract_batch(bi, total, part, schema, doc, criteria_text, reference_label,
+                                           use_llm_cache, session_id, template, facts_text, window))
+        return answered
+    if not success:
+        _p(80, f"❌ Batch {bi} failed after {MAX_RETRIES_PER_BATCH} retries")
+        data = _nr_batch(batch, schema)
+    return data
+
+
+def _split_packed_answer(bi: int, batch: list[str], data) -> tuple[dict, list]:
+    """Sheets a packed answer covered, plus the uncovered ones as two halves to re-run."""
+    answered = {s: data[s] for s in batch if isinstance(data, dict) and s in data}
+    missing = [s for s in batch if s not in answered]
+    if not missing:
+        return answered, []
+    _p(70, f"✂️ Packed batch {bi}: {len(missing)}/{len(batch)} sheet(s) unanswered — splitting")
+    mid = (len(missing) + 1) // 2
+    return answered, [part for part in (missing[:mid], missing[mid:]) if part]
+
+
+def _record_output_sizes(batch: list[str], data):
+    """Feed measured answer sizes back into the packer's stats."""
+    if not isinstance(data, dict):
+        return
+    stats = _get_output_stats()
+    for s in batch:
+        if s in data:
+            stats.record(s, estimate_tokens(json.dumps({s: data[s]}, ensure_ascii=False)))
+
+
+def _commit_batch(batch: list[str], data: dict, schema: dict, filled: dict, cache: dict):
+    """Validate a finished batch and merge it into filled/cache (preserving real cached data)."""
+    for s in batch:
+        val = data.get(s, [{col: "NR" for col in schema[s]}]) if isinstance(data, dict) else None
+        if isinstance(val, dict):
+            val = [val]
+        elif not isinstance(val, list):
+            val = [{col: "NR" for col in schema[s]}]
+
+        # skip overwrite if previous cache has meaningful data
+        if s in cache and cache[s]:
+            if any(any(v not in ("NR", "", None, "NA") for v in r.values()) for r in cache[s]):
+                print(f"🛑 Preserving existing data for {s}, skipping overwrite.")
+                filled[s] = cache[s]
+                continue
+
+        # ✅ Apply post-validation cleanup
+        cleaned = _validate_sheet_records(val, s, schema[s])
+        filled[s], cache[s] = cleaned, cleaned
+
+
+def _on_batch_done(bi: int, batch: list[str], data: dict, schema: dict, filled: dict, cache: dict,
+                   study_pdf: str, session_id: str | None, done_count: int, dispatched: int, total: int,
+                   facts: dict | None = None, table_rows: dict | None = None):
+    """
+    Commit one finished batch (table-mapped rows and rule facts merged in), report completeness,
+    and persist the partial cache.
+    """
+    if table_rows:
+        data = tables.merge(data, batch, table_rows, schema)
+    if facts:
+        data = rules.apply(data, batch, facts)
+    _commit_batch(batch, data, schema, filled, cache)
+
+    # Batch-level completeness feedback
+    batch_data = {s: filled[s] for s in batch}
+    overall, _, _ = check_completeness(batch_data)
+    if overall < 70:
+        _p(85, f"🟠 Low completeness ({overall}%) for batch {bi}")
 
-        attempt, success = 0, False
-        while attempt <= MAX_RETRIES_PER_BATCH and not success:
-            _p(30 + bi * 10, f"Batch {bi}/{len(batches)} Attempt {attempt + 1}")
-            partial_schema = {s: schema[s] for s in batch}
-
-            # --------------- BUILD PROMPT ----------------
-            schema_text = ""
-            for sheet, columns in partial_schema.items():
-                schema_text += f"\n### Sheet: {sheet}\n"
-                schema_text += "\n".join([f"- {col}" for col in columns]) + "\n"
-
-            system_prompt = f"""
-You are a biomedical data extraction and harmonization specialist working on the
-CardioProtect meta-analysis project. You extract structured data from oncology
-cardioprotection studies using the exact Excel schema below.
-
-==============================
-GLOBAL OUTPUT REQUIREMENTS
-==============================
-1. Output only valid JSON starting with '{{' and ending with '}}'.
-2. Fill values **only when clearly supported by text**.
-3. Do NOT guess or infer if ambiguous — leave "NR".
-4. Each sheet = list of dicts (rows), each column = key.
-5. Include all sheets and columns exactly as in schema.
-6. No markdown, commentary, or text outside JSON.
-==============================
-COMPLETENESS TARGET
-==============================
-- ≥95% accuracy; fill only verified values.
-- Never omit columns or sheets.
-==============================
-EXCEL SCHEMA
-==============================
-{schema_text}
-"""
+    _save_partial(cache, study_pdf, session_id or "default")
+    _p(30 + int(65 * done_count / max(1, dispatched)),
+       f"Batch {bi}/{total} done ({done_count}/{dispatched} dispatched)")
 
-            user_prompt = f"""
-[CRITERIA CONTENT]
-{criteria_text[:8000]}
 
-[STUDY CONTENT — Key Sections]
-[Methods]
-{sections.get('methods', '')[:2000]}
+def _load_schema(template_xlsx: str) -> tuple[list[str], dict]:
+    """Template sheet order and { sheet: [columns] }."""
+    xl = pd.ExcelFile(template_xlsx)
+    sheet_names = xl.sheet_names
+    return sheet_names, {s: list(xl.parse(s, nrows=1).columns) for s in sheet_names}
 
-[Results]
-{sections.get('results', '')[:2000]}
 
-[Conclusion]
-{sections.get('conclusion', '')[:1000]}
+def _expected_output_tokens(sheet: str, schema: dict) -> int:
+    return int(_get_output_stats().expected(sheet, schema[sheet]) * OUTPUT_TOKEN_MARGIN)
 
-[SCHEMA BATCH {bi}/{len(batches)}]
-{json.dumps(partial_schema, indent=2)}
-"""
 
-            # Build a budgeted, per-sheet prompt that starts with your per-sheet instructions
-            s0 = batch[0] if isinstance(batch, list) and batch else list(batch)[0]
-            override0 = _load_prompt_override(s0, schema[s0])
-            full_prompt = _build_sheet_prompt(s0, schema[s0], override0, sections, criteria_text, os.path.basename(study_pdf))
-            # 🧠 Inject per-batch JSON template to improve schema adherence
-            json_template = {}
-            for s in batch:
-                json_template[s] = [{col: "NR" for col in schema[s]}]
-
-            template_snippet = ""
-            full_prompt += ""
-
-            # Append per-sheet overrides with column-by-column guidance
-            for s in []:  # overrides already included by _build_sheet_prompt
-                try:
-                    override = _load_prompt_override(s, schema[s])
-                    if override.strip():
-                        full_prompt += f"\n\n[OVERRIDES for {s}]\n{override}\n"
-                except Exception:
-                    pass
-
-            # --------------- MODEL CALL ----------------
-            _p(45, f"Querying model for batch {bi}/{len(batches)}...")
+def _pack_batches(sheets: list[str], schema: dict, reference_label: str = "") -> list[list[str]]:
+    """
+    Greedy, template-order packing of sheets into as few LLM calls as fit.
+    A sheet joins the current batch while:
+      ✅ the batch stays ≤ BATCH_MAX_SHEETS
+      ✅ the packed static part still leaves ≥ BATCH_MIN_CONTEXT_TOKENS for study evidence
+         (≥ PREFIX_CONTEXT_TOKENS in the "prefix" layout, so the shared prefix always fits)
+      ✅ the expected answers (measured EWMA × margin) fit PROMPT_OUTPUT_TOKENS
+    """
+    compiler = _get_prompt_compiler()
+    min_context = max(BATCH_MIN_CONTEXT_TOKENS, PREFIX_CONTEXT_TOKENS) if PROMPT_LAYOUT == "prefix" \
+        else BATCH_MIN_CONTEXT_TOKENS
+    batches, current, out_tokens = [], [], 0
+    for sheet in sheets:
+        need = _expected_output_tokens(sheet, schema)
+        if current:
+            candidate = current + [sheet]
+            if (len(candidate) <= BATCH_MAX_SHEETS
+                    and out_tokens + need <= PROMPT_OUTPUT_TOKENS
+                    and compiler.context_budget(_batch_static_part(candidate, schema, reference_label)["tokens"])
+                    >= min_context):
+                current, out_tokens = candidate, out_tokens + need
+                continue
+            batches.append(current)
+        current, out_tokens = [sheet], need
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _plan_batches(sheet_names: list[str], cache: dict, filled: dict, schema: dict,
+                  reference_label: str = "") -> tuple[list, list]:
+    """
+    Pack uncached sheets into batches; cached sheets go straight into filled. Returns (batches, pending).
+    Sheets with no columns left to ask (all answered by rules) form one last batch that needs no model call.
+    """
+    todo, ruled = [], []
+    for sheet in sheet_names:
+        if sheet in cache:
+            _p(25, f"Skipping {sheet} (already cached ✅)")
+            filled[sheet] = cache[sheet]
+        elif not schema[sheet]:
+            ruled.append(sheet)
+        else:
+            todo.append(sheet)
+    batches = _pack_batches(todo, schema, reference_label) if todo else []
+    if batches:
+        _p(28, f"📦 Packed {len(todo)} sheet(s) into {len(batches)} call(s)")
+    if ruled:
+        _p(28, f"⚡ {len(ruled)} sheet(s) fully answered by rules")
+        batches.append(ruled)
+    return batches, list(enumerate(batches, start=1))
+
+
+def _inapplicable_sheets(doc: StudyDocument, sheet_names: list[str]) -> dict:
+    """{ sheet: reason } ruled out by the study-design gate ({} when DESIGN_GATE_ENABLED is off)."""
+    if not DESIGN_GATE_ENABLED:
+        return {}
+    info = study_design.classify(doc)
+    skip = study_design.inapplicable_sheets(info, sheet_names)
+    _p(22, f"🧭 Study design: {info['design']} (survival data: {'yes' if info['survival'] else 'no'}) "
+           f"→ {len(skip)} sheet(s) not applicable")
+    return skip
+
+
+def _gate_sheets(doc: StudyDocument, sheet_names: list[str], schema: dict, cache: dict, filled: dict) -> list[str]:
+    """
+    Per-PDF sheet plan: inapplicable sheets that are not cached yet are NR-filled (no model call).
+    Returns the sheets left for _plan_batches, in template order.
+    """
+    gated = set()
+    for sheet, reason in _inapplicable_sheets(doc, sheet_names).items():
+        if sheet not in cache:
+            _p(25, f"⏭️ Skipping {sheet} ({reason}) → NR")
+            filled[sheet] = cache[sheet] = [{col: "NR" for col in schema[sheet]}]
+            gated.add(sheet)
+    return [s for s in sheet_names if s not in gated]
+
 
-            try:
-                response = query_llama(full_prompt)
-            except Exception as e:
-                print(f"⚠️ Llama call failed: {e} — retrying with shorter prompt...")
-                try:
-                # Reduce context if model fails due to memory/context overflow
-                    short_prompt = full_prompt[:3000]
-                    response = query_llama(short_prompt)
-                except Exception as e2:
-                    print(f"❌ Fallback query also failed: {e2}")
-                    response = "{}"  # return empty JSON to prevent crash
+def _get_provenance_path(pdf_path: str, session_id: str | None = None):
+    """Sidecar next to the partial cache: where each rule-answered value came from."""
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(PARTIAL_CACHE_DIR, f"{base}_{session_id or 'default'}_provenance.json")
 
 
-            try:
-                data = safe_json_parse(response)
-                success = True
-                _p(55, f"✅ Batch {bi}/{len(batches)} parsed successfully")
-            except Exception:
-                _p(60, f"Repairing invalid JSON from batch {bi}")
-                try:
-                    repair_prompt = f"Repair this JSON and return only valid JSON:\n{response}"
-                    repair_resp = query_llama(repair_prompt)
-                    data = safe_json_parse(repair_resp)
-                    success = True
-                    _p(65, f"🟢 Batch {bi}/{len(batches)} repaired successfully")
-                except Exception as e2:
-                    attempt += 1
-                    _p(70, f"Retry {attempt} failed for batch {bi} ({e2})")
-
-        if not success:
-            _p(80, f"❌ Batch {bi} failed after {MAX_RETRIES_PER_BATCH} retries")
-            data = {s: [{col: "NR" for col in schema[s]}] for s in batch}
-
-        # ✅ Save validated per-sheet data
-        for s in batch:
-            val = data.get(s, [{col: "NR" for col in schema[s]}])
-            if isinstance(val, dict):
-                val = [val]
-            elif not isinstance(val, list):
-                val = [{col: "NR" for col in schema[s]}]
-
-            # skip overwrite if previous cache has meaningful data
-            if s in cache and cache[s]:
-                if any(any(v not in ("NR", "", None, "NA") for v in r.values()) for r in cache[s]):
-                    print(f"🛑 Preserving existing data for {s}, skipping overwrite.")
-                    filled[s] = cache[s]
-                    continue
+def _rule_facts(doc: StudyDocument, schema: dict, study_pdf: str, session_id: str | None = None) -> dict:
+    """
+    Deterministic pre-extraction (extractor/rules.py) → { sheet: { column: fact } }.
+    ✅ Writes the provenance sidecar (value, rule, page, snippet per field)
+    🔹 {} when RULES_ENABLED is off
+    """
+    if not RULES_ENABLED:
+        return {}
+    facts = rules.prefill(doc, schema)
+    if not facts:
+        return {}
+    n = sum(len(cols) for cols in facts.values())
+    _p(20, f"⚡ Rules answered {n} field(s) locally in {len(facts)} sheet(s)")
+    path = _get_provenance_path(study_pdf, session_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rules.provenance(facts), f, indent=2, ensure_ascii=False)
+    except OSError as e:
+        print(f"⚠️ Failed writing rule provenance {path}: {e}")
+    return facts
 
-            # ✅ Apply post-validation cleanup
-            cleaned = _validate_sheet_records(val, s, schema[s])
-            filled[s], cache[s] = cleaned, cleaned
-
-        # Batch-level completeness feedback
-        batch_data = {s: filled[s] for s in batch}
-        overall, _, _ = check_completeness(batch_data)
-        if overall < 70:
-            _p(85, f"🟠 Low completeness ({overall}%) — re-extracting batch {bi}")
-            attempt = 0
-            success = False
-            continue
 
+def _finish_extraction(study_pdf: str, schema: dict, filled: dict, cache: dict, session_id: str | None,
+                       failed=()):
+    """
+    NR-fill missing sheets, save the cache, print the summary.
+    🔹 failed sheets (model unavailable) are NR in this output only — left out of the cache so they are asked again
+    """
     # fill missing sheets
     for s in schema:
         if s not in filled:
-            print(f"⚠️ Missing sheet {s} → auto-filling NR")
             filled[s] = [{col: "NR" for col in schema[s]}]
+            if s in failed:
+                print(f"⚠️ {s} not extracted (model unavailable) → NR here, not cached")
+                continue
+            print(f"⚠️ Missing sheet {s} → auto-filling NR")
             cache[s] = filled[s]
 
     _save_partial(cache, study_pdf, session_id or "default")
@@ -770,11 +1385,448 @@ EXCEL SCHEMA
     return filled
 
 
+# ---------------- TABLES ----------------
+def _tables_text(doc: StudyDocument, batch: list[str], window: list | None = None) -> str:
+    """
+    [TABLES] block (compact CSV) of the tables routed to these sheets ("" when none / TABLE_ROUTING off).
+    🔹 Map-reduce windows only carry the tables printed on their own pages
+    """
+    if not TABLE_ROUTING:
+        return ""
+    pages = {c.get("page") for c in window} if window is not None else None
+    picked = [t for t in tables.structured(doc)
+              if any(s in t["sheets"] for s in batch) and (pages is None or t["page"] in pages)]
+    return tables.render(picked, TABLE_MAX_TOKENS, estimate_tokens) if picked else ""
+
+
+def _table_rows(doc: StudyDocument, schema: dict) -> dict:
+    """{ sheet: rows } mapped deterministically from routed tables (merged into answers in _on_batch_done)."""
+    if not TABLE_ROUTING:
+        return {}
+    routed = tables.structured(doc)
+    out = {}
+    for table in routed:
+        for s in table["sheets"]:
+            if s in schema:
+                out.setdefault(s, []).extend(tables.map_rows(table, s, schema[s]))
+    out = {s: rows for s, rows in out.items() if rows}
+    if routed:
+        _p(20, f"📊 {len(routed)} table(s) routed to " + ", ".join(sorted({s for t in routed for s in t["sheets"]}))
+           + (f"; {sum(map(len, out.values()))} row(s) mapped directly" if out else ""))
+    return out
+
+
+# ---------------- MAP-REDUCE ----------------
+def _window_head(pages: list) -> str:
+    label = f"pages {pages[0]}–{pages[-1]}" if pages else "excerpt"
+    return f"[STUDY CONTEXT: {label}]\n"
+
+
+def _map_windows(doc: StudyDocument, facts_text: str = "") -> list[list[dict]]:
+    """
+    Passage windows covering the study body for map-reduce ([] → single-pass extraction).
+    Each window fits the evidence budget every packed batch is guaranteed to leave, so it is sent whole.
+    """
+    if MAP_REDUCE not in ("auto", "on"):
+        return []
+    body_end = doc.body_end()
+    if MAP_REDUCE == "auto" and estimate_tokens(doc.text[:body_end]) <= MAP_REDUCE_MIN_TOKENS:
+        return []
+    min_context = max(BATCH_MIN_CONTEXT_TOKENS, PREFIX_CONTEXT_TOKENS) if PROMPT_LAYOUT == "prefix" \
+        else BATCH_MIN_CONTEXT_TOKENS
+    overhead = estimate_tokens(_prefix_preamble("") + _window_head([0, 0]) + "[END STUDY CONTEXT]\n\n[EVIDENCE]\n")
+    budget = max(500, min_context - overhead - estimate_tokens(facts_text + _tables_text(doc, tables.SHEETS)))
+    wins = map_reduce.windows(doc.chunk_index(RETRIEVAL_CHUNK_CHARS), budget, _passage_tokens, body_end)
+    return wins if len(wins) > 1 else []
+
+
+def _window_prompt(batch: list[str], schema: dict, window: list[dict], facts_text: str, reference_label: str) -> str:
+    """Map step prompt: the batch's static part + study facts + one passage window (nothing else)."""
+    static = _batch_static_part(batch, schema, reference_label)
+    pages = sorted({c["page"] for c in window if c.get("page")})
+    context = _window_head(pages) + render_passages(window) + "[END STUDY CONTEXT]\n\n"
+    if PROMPT_LAYOUT == "prefix":  # window first: identical across batches → Ollama reuses it
+        return _prefix_preamble(reference_label) + context + facts_text + static["text"][len(static["preamble"]):]
+    return static["text"] + facts_text + context
+
+
+def _window_plan(batch: list[str], schema: dict, doc: StudyDocument, wins: list) -> dict:
+    """
+    Windows one batch is mapped over + each sheet's evidence score per window.
+    ✅ Beyond MAP_REDUCE_MAX_WINDOWS only the windows most relevant to the batch are kept (document order)
+    🔹 A batch answered entirely by rules needs a single (no-call) pass
+    """
+    if not any(schema[s] for s in batch):
+        return {"windows": [0], "evidence": {s: [0.0] * len(wins) for s in batch}}
+    index = doc.chunk_index(RETRIEVAL_CHUNK_CHARS)
+    scores = {s: map_reduce.evidence(index, wins, query_terms(schema[s], "", s)) for s in batch}
+    order = list(range(len(wins)))
+    if len(order) > MAP_REDUCE_MAX_WINDOWS:
+        total = [sum(scores[s][wi] for s in batch) for wi in order]
+        order = sorted(sorted(order, key=lambda wi: (-total[wi], wi))[:MAP_REDUCE_MAX_WINDOWS])
+    return {"windows": order, "evidence": scores}
+
+
+def _reduce_batch(batch: list[str], schema: dict, partials: dict, plan: dict) -> dict:
+    """Merge the per-window answers of one batch ({ window: { sheet: rows } }) with MAP_REDUCE_POLICY."""
+    policy = MAP_REDUCE_POLICY if MAP_REDUCE_POLICY in map_reduce.POLICIES else "evidence"
+    out = {}
+    for s in batch:
+        parts = [(wi, plan["evidence"][s][wi], data.get(s)) for wi, data in partials.items()
+                 if isinstance(data, dict) and s in data]
+        if parts:
+            out[s] = map_reduce.reduce_rows(parts, schema[s], policy) or [{col: "NR" for col in schema[s]}]
+    return out
+
+
+def _extract_map_reduce(pending: list, total: int, ask: dict, schema: dict, doc: StudyDocument, criteria_text: str,
+                        study_pdf: str, use_llm_cache: bool, session_id: str | None, facts_text: str,
+                        wins: list, filled: dict, cache: dict, facts: dict, table_rows: dict | None = None,
+                        failed: set | None = None):
+    """
+    Map every pending batch over the passage windows (one flat pool, SHEET_CONCURRENCY calls in flight),
+    then reduce and commit each batch as soon as its last window answers.
+    A batch none of whose windows got a model answer is added to failed instead of being committed.
+    """
+    plans = {bi: _window_plan(batch, ask, doc, wins) for bi, batch in pending}
+    tasks = [(bi, batch, wi) for bi, batch in pending for wi in plans[bi]["windows"]]
+    _p(30, f"🗺️ Map-reduce: {len(wins)} window(s) → {len(tasks)} call(s) for {len(pending)} batch(es) "
+           f"(policy: {MAP_REDUCE_POLICY})")
+    partials, unanswered, done_count = {bi: {} for bi, _ in pending}, {bi: 0 for bi, _ in pending}, 0
+    with ThreadPoolExecutor(max_workers=max(1, min(SHEET_CONCURRENCY, len(tasks)))) as pool:
+        futures = {
+            pool.submit(_extract_batch, bi, total, batch, ask, doc, criteria_text, os.path.basename(study_pdf),
+                        use_llm_cache, session_id, schema, facts_text, wins[wi]): (bi, batch, wi)
+            for bi, batch, wi in tasks
+        }
+        for fut in as_completed(futures):
+            bi, batch, wi = futures[fut]
+            try:
+                partials[bi][wi] = fut.result()
+            except OllamaUnavailableError as e:
+                print(f"❌ Batch {bi} window {wi} failed: {e}")
+                partials[bi][wi], unanswered[bi] = {}, unanswered[bi] + 1
+            except Exception as e:
+                print(f"❌ Batch {bi} window {wi} crashed: {e}")
+                partials[bi][wi] = {}
+            if len(partials[bi]) == len(plans[bi]["windows"]):
+                done_count += 1
+                if unanswered[bi] == len(plans[bi]["windows"]):
+                    _p(80, f"❌ Batch {bi} failed: no window got a model answer")
+                    if failed is not None:
+                        failed.update(batch)
+                    continue
+                data = _reduce_batch(batch, ask, partials[bi], plans[bi])
+                _on_batch_done(bi, batch, data, schema, filled, cache, study_pdf, session_id,
+                               done_count, len(pending), total, facts, table_rows)
+
+
+# ---------------- STUDY FACTS (STAGE 1) ----------------
+def _get_facts_path(pdf_path: str, session_id: str | None = None):
+    """Stage-1 study facts, cached next to the partial cache (reused by resume)."""
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(PARTIAL_CACHE_DIR, f"{base}_{session_id or 'default'}_facts.json")
+
+
+def _load_study_facts(pdf_path: str, session_id: str | None = None) -> dict:
+    path = _get_facts_path(pdf_path, session_id)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data.get("facts") or {} if data.get("version") == study_facts.STUDY_FACTS_VERSION else {}
+
+
+def _save_study_facts(facts: dict, pdf_path: str, session_id: str | None = None):
+    path = _get_facts_path(pdf_path, session_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"version": study_facts.STUDY_FACTS_VERSION, "facts": facts}, f, indent=2, ensure_ascii=False)
+    except OSError as e:
+        print(f"⚠️ Failed saving study facts {path}: {e}")
+
+
+def _build_facts_prompt(doc: StudyDocument, schema: dict, criteria_text: str, reference_label: str) -> str:
+    """Stage-1 prompt: the shared study prefix (same bytes as every sheet call) + the facts task."""
+    body = study_facts.instructions()
+    compiler = _get_prompt_compiler()
+    if PROMPT_LAYOUT == "prefix":
+        prefix = _shared_prefix(doc, schema, criteria_text, reference_label)
+        if prefix["tokens"] + estimate_tokens(body) <= compiler.window():
+            return prefix["text"] + body
+    head = _prompt_preamble(reference_label) + body
+    weights = query_terms(["Study_ID", "Arm_Name", "N_in_Arm", "Study_Design", "Timepoint"], body, "study facts")
+    return head + _study_context(weights, doc, criteria_text, compiler.context_budget(estimate_tokens(head)))
+
+
+def _finish_study_facts(response: str, study_pdf: str, session_id: str | None) -> dict:
+    try:
+        known = study_facts.normalize(safe_json_parse(response))
+    except ValueError as e:
+        print(f"⚠️ Study facts answer unusable ({e}) — sheets will derive them")
+        return {}
+    if known:
+        _save_study_facts(known, study_pdf, session_id)
+        _p(27, f"🧾 Study facts: {known['Study_ID']} · {known['Study_Design']} · {len(known['Arms'])} arm(s)")
+    return known
+
+
+def _study_facts(doc: StudyDocument, schema: dict, criteria_text: str, study_pdf: str,
+                 session_id: str | None = None, use_llm_cache: bool = True) -> dict:
+    """
+    Stage 1: Study_ID, design, arms (+ N) and timepoints in one small call, cached per PDF/session.
+    ✅ Injected into every sheet prompt as [STUDY FACTS]; the columns it answers are not asked again
+    🔹 {} when STUDY_FACTS_ENABLED is off or the call fails (sheets then derive them as before)
+    """
+    if not STUDY_FACTS_ENABLED:
+        return {}
+    known = _load_study_facts(study_pdf, session_id)
+    if known:
+        return known
+    _p(26, "🧾 Extracting shared study facts (stage 1)...")
+    prompt = _build_facts_prompt(doc, schema, criteria_text, os.path.basename(study_pdf))
+    try:
+        response = query_llama(prompt, use_cache=use_llm_cache, session_id=session_id, sheet="study facts",
+                               json_schema=study_facts.facts_schema())
+    except Exception as e:
+        print(f"⚠️ Study facts call failed: {e}")
+        return {}
+    return _finish_study_facts(response, study_pdf, session_id)
+
+
+# ---------------- EXTRACTION CORE ----------------
+def extract_fields(study_pdf: str, criteria_pdf: str, template_xlsx: str, session_id: str | None = None,
+                   use_llm_cache: bool = True):
+    """
+    Extract fields, retry failed batches, and resume from per-PDF partial caches.
+    🧠 High-Accuracy Version:
+    - Section-based prompt slicing
+    - Confidence-based extraction rules
+    - Validation after each batch
+    - Auto-preserves filled data
+    """
+    _p(15, f"Loading PDFs and schema for {os.path.basename(study_pdf)}...")
+    doc = load_document(study_pdf)
+    criteria_text = load_criteria_text(criteria_pdf)
+    _doc_index(doc)  # build once, before sheet workers share it
+
+    sheet_names, schema = _load_schema(template_xlsx)
+    filled, cache = {}, _load_partial(study_pdf, session_id)
+    sheets = _gate_sheets(doc, sheet_names, schema, cache, filled)
+    known = _study_facts(doc, schema, criteria_text, study_pdf, session_id, use_llm_cache) \
+        if any(s not in cache for s in sheets) else {}
+    facts = study_facts.merge(study_facts.column_facts(known, schema), _rule_facts(doc, schema, study_pdf, session_id))
+    ask, facts_text = rules.ask_schema(schema, facts), study_facts.render(known)
+    table_rows = _table_rows(doc, schema)
+    batches, pending = _plan_batches(sheets, cache, filled, ask, os.path.basename(study_pdf))
+
+    wins = _map_windows(doc, facts_text)
+    failed = set()
+    if wins and pending:
+        _extract_map_reduce(pending, len(batches), ask, schema, doc, criteria_text, study_pdf, use_llm_cache,
+                            session_id, facts_text, wins, filled, cache, facts, table_rows, failed)
+        return _finish_extraction(study_pdf, schema, filled, cache, session_id, failed)
+
+    # 🚀 Dispatch up to SHEET_CONCURRENCY batches at once; results are committed
+    # to the partial cache in completion order so a crash loses only in-flight sheets.
+    workers = max(1, min(SHEET_CONCURRENCY, len(pending) or 1))
+    _p(30, f"Dispatching {len(pending)} batch(es) with {workers} in flight")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_extract_batch, bi, len(batches), batch, ask, doc,
+                        criteria_text, os.path.basename(study_pdf), use_llm_cache,
+                        session_id, schema, facts_text): (bi, batch)
+            for bi, batch in pending
+        }
+        for done_count, fut in enumerate(as_completed(futures), start=1):
+            bi, batch = futures[fut]
+            try:
+                data = fut.result()
+            except OllamaUnavailableError as e:
+                _p(80, f"❌ Batch {bi} failed: {e}")
+                failed.update(batch)
+                continue
+            except Exception as e:
+                print(f"❌ Batch {bi} crashed: {e}")
+                data = _nr_batch(batch, schema)
+            _on_batch_done(bi, batch, data, schema, filled, cache, study_pdf, session_id,
+                           done_count, len(futures), len(batches), facts, table_rows)
+
+    return _finish_extraction(study_pdf, schema, filled, cache, session_id, failed)
+
+
+
+
+# ---------------- RESUME HELPERS ----------------
+def _write_preview(cache: dict, out_path: str):
+    """Recreate a preview workbook from scratch (one sheet per cached sheet)."""
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with pd.ExcelWriter(out_path, engine="openpyxl", mode="w") as writer:
+        for sheet, records in cache.items():
+            df = pd.DataFrame(records)
+            df.to_excel(writer, sheet_name=sheet[:31], index=False)
+
+
+_EMPTY_CELLS = ("NR", "", None, "NA")
+
+
+def _find_incomplete_sheets(cache: dict, schema: dict | None = None) -> dict:
+    """
+    Sheets with NR/empty (only truly missing columns across rows) → sorted missing columns.
+    🔹 Template sheets absent from the cache (their batch failed) are missing every column
+    """
+    incomplete_sheets = {}
+    for sheet, records in cache.items():
+        if not isinstance(records, list):
+            continue
+        missing_cols = set()
+        for row in records:
+            for k, v in row.items():
+                if v in _EMPTY_CELLS:
+                    missing_cols.add(k)
+        if missing_cols:
+            incomplete_sheets[sheet] = sorted(missing_cols)
+    for sheet, columns in (schema or {}).items():
+        if sheet not in cache:
+            incomplete_sheets[sheet] = list(columns)
+    return incomplete_sheets
+
+
+def _column_notes(sheet: str, columns: list[str]) -> str:
+    """Lines of prompts/<sheet>.txt that mention one of the columns (their descriptions / rules)."""
+    try:
+        with open(os.path.join(PROMPTS_DIR, f"{sheet}.txt"), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return ""
+    return "\n".join(line.strip() for line in lines if any(col in line for col in columns))
+
+
+def _compose_resume_static_part(sheet: str, columns: list[str], reference_label: str) -> dict:
+    """Static part of a resume prompt: guidance + template for the missing columns only."""
+    guidance = "\n".join(f"- {col}: Extract the value for '{col}' from the PDF. If missing, use 'NR'."
+                         for col in columns)
+    parts = [f"Sheet: {sheet}\nMissing columns to fill:\n{guidance}", _column_notes(sheet, columns)]
+    global_file = os.path.join(PROMPTS_DIR, "__global__.txt")
+    if os.path.exists(global_file):
+        with open(global_file, "r", encoding="utf-8") as f:
+            g = f.read().strip()
+        if g:
+            parts.append(f"[GLOBAL OVERRIDES]\n{g}")
+    overrides = "\n\n".join(part for part in parts if part)
+    preamble = _prompt_preamble(reference_label)
+    core = (
+        preamble
+        + "[OVERRIDES]\n" + overrides + "\n\n"
+        + "Return only valid JSON with ONLY the missing columns below: one object per row listed under "
+        + "[EXISTING ROWS], in the same order.\n"
+        + f"{{ \"{sheet}\": [ {{ col1: value, col2: value, ... }} ] }}\n"
+        + "Rules: use 'NR' if not reported; no markdown or commentary.\n"
+        + "JSON TEMPLATE (fill NR values only where confident):\n"
+        + json.dumps({sheet: [{col: "NR" for col in columns}]}, indent=2) + "\n"
+    )
+    return {"text": core, "preamble": preamble, "overrides": overrides}
+
+
+def _resume_static_part(sheet: str, columns: list[str], reference_label: str = "") -> dict:
+    key = ("resume", sheet, tuple(columns), reference_label, _prompt_file_stamp(sheet))
+    return _get_prompt_compiler().static(key, lambda: _compose_resume_static_part(sheet, columns, reference_label))
+
+
+def _resume_row_anchor(rows: list[dict], columns: list[str], max_fields: int = 6, max_chars: int = 80) -> str:
+    """[EXISTING ROWS]: a few known values per cached row so answers line up with them."""
+    skip = set(columns)
+    lines = []
+    for i, row in enumerate(rows or [{}], start=1):
+        known = [(k, str(v)[:max_chars]) for k, v in row.items() if k not in skip and v not in _EMPTY_CELLS]
+        lines.append(f"{i}. " + json.dumps(dict(known[:max_fields]), ensure_ascii=False))
+    return "[EXISTING ROWS]\n" + "\n".join(lines) + "\n"
+
+
+def _build_resume_prompt(sheet: str, columns: list[str], rows: list[dict], doc: StudyDocument,
+                         criteria_text: str, reference_label: str = "", schema: dict | None = None,
+                         facts_text: str = "") -> str:
+    """
+    Resume prompt that asks only for the missing columns.
+    ✅ Static part + JSON template cover just those columns (answers cost a fraction of a sheet)
+    ✅ [STUDY FACTS] (stage 1) + [EXISTING ROWS] anchor the answer rows to the cached ones
+    ✅ [TABLES]: the structured tables routed to this sheet
+    ✅ Evidence ranked for the missing columns fills the rest of the window
+       ("prefix" layout: after the shared prefix, skipping passages it already holds)
+    """
+    facts_text += _tables_text(doc, [sheet])
+    static = _resume_static_part(sheet, columns, reference_label)
+    anchor = _resume_row_anchor(rows, columns)
+    weights = query_terms(columns, static["overrides"], sheet)
+    compiler = _get_prompt_compiler()
+    head, head_tokens, skip = static["text"] + facts_text, static["tokens"] + estimate_tokens(facts_text), None
+    if PROMPT_LAYOUT == "prefix" and schema:
+        prefix = _shared_prefix(doc, schema, criteria_text, reference_label)
+        if prefix["tokens"] + head_tokens + estimate_tokens(anchor) <= compiler.window():
+            head = prefix["text"] + facts_text + static["text"][len(static["preamble"]):]
+            head_tokens, skip, criteria_text = prefix["tokens"] + head_tokens, prefix["ids"], ""
+    budget = compiler.window() - head_tokens - estimate_tokens(anchor)
+    return head + anchor + _study_context(weights, doc, criteria_text, max(0, budget), skip=skip)
+
+
+def _resume_columns(base_cols: list[str], missing_cols) -> list[str]:
+    """Missing columns in template order (columns the template does not have are not asked for)."""
+    missing = set(missing_cols)
+    return [col for col in base_cols if col in missing]
+
+
+def _merge_resumed_sheet(cache: dict, sheet: str, new_data, incomplete_sheets: dict) -> bool:
+    """Fill only NR/empty cells of cache[sheet] from new_data, row by row. Returns True when merged."""
+    if not (isinstance(new_data, dict) and sheet in new_data and isinstance(new_data[sheet], list)):
+        _p(60, f"⚠️ No new data found for {sheet}")
+        return False
+    if sheet not in cache:  # never answered before (failed batch): take the rows as they are
+        cache[sheet] = [dict(row) for row in new_data[sheet]]
+        _p(60, f"✅ Added {sheet} ({len(cache[sheet])} row(s))")
+        return True
+
+    # ⚡️ Protect already filled sheets (skip overwrite if sheet mostly complete)
+    has_real_data = any(
+        any(v not in _EMPTY_CELLS for v in row.values())
+        for row in cache.get(sheet, [])
+    )
+    if has_real_data and sheet not in incomplete_sheets:
+        print(f"🛑 Preserving existing data for {sheet}, skipping overwrite.")
+        return False
+
+    filled = 0
+    for old, new in zip(cache.get(sheet) or [], new_data[sheet]):
+        for col, value in new.items():
+            if col in old and old[col] in _EMPTY_CELLS and value not in _EMPTY_CELLS:
+                old[col] = value
+                filled += 1
+
+    _p(60, f"✅ Updated {filled} missing field(s) for {sheet}")
+    return True
+
+
+def _resume_sheet(sheet: str, missing_cols, cache: dict, schema: dict, doc: StudyDocument, criteria_text: str,
+                  reference_label: str, incomplete_sheets: dict, use_llm_cache: bool = True,
+                  session_id: str | None = None, facts_text: str = ""):
+    """Query only the missing columns of one sheet and merge the answer into cache."""
+    columns = _resume_columns(schema.get(sheet) or list(missing_cols), missing_cols)
+    if not columns:
+        return
+    _p(30, f"Re-extracting {len(columns)} missing field(s) for: {sheet}")
+    prompt = _build_resume_prompt(sheet, columns, cache.get(sheet), doc, criteria_text, reference_label, schema,
+                                  facts_text)
+    sheets = {sheet: columns}
+    answer_schema = sheet_schema(sheets)
+    response = query_llama(prompt, use_cache=use_llm_cache, session_id=session_id, sheet=sheet,
+                           json_schema=answer_schema)
+    _merge_resumed_sheet(cache, sheet, _parse_answer(response, sheets, answer_schema, sheet), incomplete_sheets)
 
 
 def resume_incomplete_fields(study_pdf: str, criteria_pdf: str, template_xlsx: str,
                              preview_path: str = None, session_id: str | None = None,
-                             target_completeness: float | None = None):
+                             target_completeness: float | None = None, use_llm_cache: bool = True):
     """
     Resume extraction only for missing fields using the cache for this specific PDF.
     Each PDF has its own cache under partial_caches/<pdf>_<session>.json
@@ -783,20 +1835,18 @@ def resume_incomplete_fields(study_pdf: str, criteria_pdf: str, template_xlsx: s
     cache = _load_partial(study_pdf, session_id)
     if not cache:
         raise ValueError(f"No cache found for {study_pdf}. Run extract_fields() first.")
+    _, schema = _load_schema(template_xlsx)
             # ✅ QUICK COMPLETENESS CHECK BEFORE ANY RE-QUERY
     overall, details, logical_validity = check_completeness(cache)
     threshold = target_completeness if target_completeness is not None else 90
-    if overall >= threshold:
+    if overall >= threshold and all(s in cache for s in schema):
         print(f"✅ Cache already {overall}% complete — skipping Llama3 resume to prevent overwrite.")
         _save_partial(cache, study_pdf, session_id)  # ensure it's preserved
         _p(20, f"Cache completeness {overall}% — skipping re-extraction.")
         # Ensure preview file even when skipping
         try:
-            out_path = preview_path or "resume_preview.xlsx"
-            with pd.ExcelWriter(out_path, engine="openpyxl", mode="w") as writer:
-                for sheet, records in cache.items():
-                    df = pd.DataFrame(records)
-                    df.to_excel(writer, sheet_name=sheet[:31], index=False)
+            out_path = preview_path or RESUME_PREVIEW_PATH
+            _write_preview(cache, out_path)
             _p(95, f"�o. Resume (skip) wrote preview �+' {out_path}")
         except Exception as e:
             print(f"�s��,? Resume skip: preview generation failed: {e}")
@@ -807,147 +1857,22 @@ def resume_incomplete_fields(study_pdf: str, criteria_pdf: str, template_xlsx: s
         return cache
 
     # Identify sheets with NR/empty (only truly missing columns across rows)
-    incomplete_sheets = {}
-    for sheet, records in cache.items():
-        if not isinstance(records, list):
-            continue
-        missing_cols = set()
-        for row in records:
-            for k, v in row.items():
-                if v in ("NR", "", None, "NA"):
-                    missing_cols.add(k)
-        if missing_cols:
-            incomplete_sheets[sheet] = sorted(missing_cols)
+    incomplete_sheets = _find_incomplete_sheets(cache, schema)
 
     if not incomplete_sheets:
         _p(20, "✅ All fields complete, nothing to resume.")
         return cache
 
-    study_text = read_pdf_text(study_pdf)
-    criteria_text = read_pdf_text(criteria_pdf)
-    xl = pd.ExcelFile(template_xlsx)
+    doc = load_document(study_pdf)
+    criteria_text = load_criteria_text(criteria_pdf)
+    for sheet in _inapplicable_sheets(doc, list(schema)):
+        incomplete_sheets.pop(sheet, None)  # NR by design, not missing
+    facts_text = study_facts.render(_load_study_facts(study_pdf, session_id))
 
     for sheet, missing_cols in incomplete_sheets.items():
-        _p(30, f"Re-extracting missing fields for: {sheet}")
-
-        base_cols = list(xl.parse(sheet, nrows=1).columns)
-        schema_subset = {sheet: base_cols}
-
-        prompt = f"""
-You are a biomedical data extraction and harmonization specialist working on the
-CardioProtect meta-analysis project. Your task is to CORRECT incomplete data from
-a previously extracted oncology cardioprotection study.
-
-==============================
-TASK OBJECTIVE
-==============================
-- Return only valid JSON (no text outside braces).
-- Output structure must be identical to the schema provided below.
-- Preserve all existing non-empty values.
-- Replace only "NR" or empty fields with correct values.
-- Do NOT remove or rename any column or sheet key.
-
-==============================
-TARGET SHEET
-==============================
-{sheet}
-
-==============================
-MISSING COLUMNS (to refill)
-==============================
-{', '.join(missing_cols)}
-
-==============================
-FULL SCHEMA (for structure reference)
-==============================
-{json.dumps(schema_subset, indent=2)}
-
-==============================
-STUDY & CRITERIA CONTENT
-==============================
-[STUDY PDF EXCERPT]
-{study_text[:1200]}
-
-[CRITERIA PDF EXCERPT]
-{criteria_text[:600]}
-
-==============================
-GLOBAL OUTPUT RULES
-==============================
-1. Return a single valid JSON object in this exact format:
-   {{ "{sheet}": [ {{ col1: value, col2: value, ... }} ] }}
-2. Include *all columns* from the schema, not only missing ones.
-3. Use "NR" for missing values, but never omit any column key.
-4. Keep all data types as strings.
-5. No markdown, commentary, or explanations.
-6. JSON must be syntactically valid and parsable.
-7. Column names must match the schema exactly — case, spacing, and punctuation included.
-
-
-==============================
-INFERENCE RULES
-==============================
-- Infer obvious values from text (e.g., "158 per arm" → Arms (N)=2).
-- When unsure, leave "NR" but preserve structure.
-- Never add extra fields or notes.
-"""
-        # 🧠 Inject JSON template for the target sheet (to enforce schema)
-        json_template = {sheet: [{col: "NR" for col in base_cols}]}
-        prompt += f"\n\nJSON TEMPLATE (fill NR values only where confident):\n{json.dumps(json_template, indent=2)}\n"
-        # Append per-sheet overrides (auto-generated or user-edited) for this sheet
-        try:
-            override = _load_prompt_override(sheet, base_cols)
-            if override.strip():
-                prompt += f"\n\n[OVERRIDES for {sheet}]\n{override}\n"
-        except Exception:
-            pass
-
-        # Rebuild prompt to budgeted, per-sheet form with overrides first
-        try:
-            override_base = _load_prompt_override(sheet, base_cols)
-        except Exception:
-            override_base = ""
-        missing_block = "\n[MISSING COLUMNS]\n" + ", ".join(missing_cols) + "\n" if missing_cols else ""
-        override_full = (override_base or "") + missing_block
-        sections_resume = _split_sections_global(study_text)
-        prompt = _build_sheet_prompt(
-            sheet=sheet,
-            columns=base_cols,
-            override_text=override_full,
-            sections=sections_resume,
-            criteria_text=criteria_text,
-            reference_label=os.path.basename(study_pdf)
-        )
         try:
-            response = query_llama(prompt)
-            new_data = safe_json_parse(response)
-
-            if sheet in new_data and isinstance(new_data[sheet], list):
-                # ⚡️ Protect already filled sheets (skip overwrite if sheet mostly complete)
-                has_real_data = any(
-                    any(v not in ("NR", "", None, "NA") for v in row.values())
-                    for row in cache.get(sheet, [])
-                )
-                if has_real_data and sheet not in incomplete_sheets:
-                    print(f"🛑 Preserving existing data for {sheet}, skipping overwrite.")
-                    continue
-
-                df_old = pd.DataFrame(cache[sheet])
-                df_new = pd.DataFrame(new_data[sheet])
-
-                for col in df_old.columns:
-                    if col in df_new.columns:
-                        df_old[col] = df_old[col].mask(
-                            df_old[col].isin(["NR", "", None]),
-                            df_new[col]
-                        )
-
-                cache[sheet] = df_old.to_dict(orient="records")
-                _p(60, f"✅ Updated missing fields for {sheet}")
-            else:
-                _p(60, f"⚠️ No new data found for {sheet}")
-
-
+            _resume_sheet(sheet, missing_cols, cache, schema, doc, criteria_text, os.path.basename(study_pdf),
+                          incomplete_sheets, use_llm_cache, session_id, facts_text)
         except Exception as e:
             _p(80, f"❌ Resume failed for {sheet}: {e}")
 
@@ -957,11 +1882,8 @@ INFERENCE RULES
 
     # Always recreate preview from scratch
     try:
-        out_path = preview_path or "resume_preview.xlsx"
-        with pd.ExcelWriter(out_path, engine="openpyxl", mode="w") as writer:
-            for sheet, records in cache.items():
-                df = pd.DataFrame(records)
-                df.to_excel(writer, sheet_name=sheet[:31], index=False)
+        out_path = preview_path or RESUME_PREVIEW_PATH
+        _write_preview(cache, out_path)
         _p(95, f"✅ Resume complete → {out_path}")
     except Exception as e:
         print(f"⚠️ Resume succeeded but preview generation failed: {e}")
@@ -975,15 +1897,158 @@ INFERENCE RULES
 
 
 
+def _process_single_pdf(pdf_path: str, criteria_pdf: str, template_xlsx: str, session_id: str,
+                        preview_path: str, completeness_threshold: float, use_llm_cache: bool = True):
+    """
+    Worker unit for multi-PDF runs: extract → resume passes → preview for one PDF.
+    Top-level (picklable) so it can run inside a process pool.
+    Returns (result_dict, resumed_data).
+    """
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    # Core extraction
+    filled = extract_fields(pdf_path, criteria_pdf, template_xlsx, session_id=session_id,
+                            use_llm_cache=use_llm_cache)
+
+    # Try to resume using per-PDF cache
+    try:
+        resumed = resume_incomplete_fields(
+            pdf_path, criteria_pdf, template_xlsx,
+            preview_path=preview_path,
+            session_id=session_id,
+            target_completeness=completeness_threshold,
+            use_llm_cache=use_llm_cache
+        )
+    except ValueError as e:
+        if "No cache found" in str(e):
+            print(f"⚠️ No cache found for {base}, using extract_fields() output directly.")
+            resumed = filled  # Fallback to initial extraction
+        else:
+            raise
+
+    # Iterative resume passes to reach threshold before finalizing
+    try:
+        _overall_tmp, _, _ = check_completeness(resumed)
+    except Exception:
+        _overall_tmp = 0.0
+    if _overall_tmp < completeness_threshold:
+        for _pass in range(max(0, MAX_RESUME_PASSES - 1)):  # total passes incl. first
+            try:
+                resumed = resume_incomplete_fields(
+                    pdf_path, criteria_pdf, template_xlsx,
+                    preview_path=preview_path,
+                    session_id=session_id,
+                    target_completeness=completeness_threshold,
+                    use_llm_cache=use_llm_cache
+                )
+            except Exception:
+                break
+            try:
+                _overall_tmp, _, _ = check_completeness(resumed)
+            except Exception:
+                _overall_tmp = 0.0
+            if _overall_tmp >= completeness_threshold:
+                break
+
+    # ✅ Enhanced completeness check (3 outputs)
+    overall, details, logical_validity = check_completeness(resumed)
+    print(f"✅ {base} → {overall}% complete ({logical_validity}% logical validity)")
+
+    result = {
+        "pdf": base,
+        "preview_path": preview_path,
+        "completeness": overall,
+        "logical_validity": logical_validity,
+        "sheet_wise": details
+    }
+    return result, resumed
+
+
+def _resume_single_pdf(pdf_path: str, criteria_pdf: str, template_xlsx: str, session_id: str,
+                       preview_path: str, use_llm_cache: bool = True):
+    """Worker unit for multi-PDF resume (picklable). Returns (result_dict, resumed_data)."""
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    resumed = resume_incomplete_fields(
+        study_pdf=pdf_path,
+        criteria_pdf=criteria_pdf,
+        template_xlsx=template_xlsx,
+        preview_path=preview_path,
+        session_id=session_id,
+        use_llm_cache=use_llm_cache
+    )
+
+    overall, details, logical_validity = check_completeness(resumed)
+    print(f"✅ {base} → {overall}% complete ({logical_validity}% logically valid)")
+
+    result = {
+        "pdf": base,
+        "preview_path": preview_path,
+        "completeness": overall,
+        "logical_validity": logical_validity,
+        "sheet_wise": details
+    }
+    return result, resumed
+
+
+def _run_pdf_jobs(jobs: list[tuple], worker, workers: int, label: str):
+    """
+    Run per-PDF jobs [(base, args), ...] inline or in a process pool.
+    Yields (index, base, result_dict, data) as each job finishes;
+    failures come back as ({"pdf": base, "error": ...}, None).
+    """
+    workers = max(1, min(workers, len(jobs) or 1))
+    if workers == 1:
+        for idx, (base, args) in enumerate(jobs):
+            print(f"=== [{idx + 1}/{len(jobs)}] {label} {base} ===")
+            try:
+                result, data = worker(*args)
+            except Exception as e:
+                print(f"❌ {base} failed: {e}")
+                result, data = {"pdf": base, "error": str(e)}, None
+            yield idx, base, result, data
+        return
+
+    print(f"🧵 {label} {len(jobs)} PDFs with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(worker, *args): (idx, base) for idx, (base, args) in enumerate(jobs)}
+        for done_count, fut in enumerate(as_completed(futures), start=1):
+            idx, base = futures[fut]
+            try:
+                result, data = fut.result()
+            except Exception as e:
+                print(f"❌ {base} failed: {e}")
+                result, data = {"pdf": base, "error": str(e)}, None
+            _p(5 + int(90 * done_count / len(futures)), f"{label} {done_count}/{len(futures)} PDFs ({base})")
+            yield idx, base, result, data
+
+
+def _write_merged_workbook(out_path: str, template_xlsx: str, merged_data: dict):
+    """Write merged per-sheet rows into a template-shaped workbook (NR-filled gaps)."""
+    xl = pd.ExcelFile(template_xlsx)
+    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+        for sheet in xl.sheet_names:
+            cols = list(xl.parse(sheet, nrows=1).columns)
+            df = pd.DataFrame(merged_data.get(sheet, []))
+            if df.empty:
+                df = pd.DataFrame([{c: "NR" for c in cols}])
+            for c in cols:
+                if c not in df.columns:
+                    df[c] = "NR"
+            df = df.reindex(columns=cols)
+            df.to_excel(writer, sheet_name=sheet[:31], index=False)
+
+
 def process_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
                           session_id: str, preview_dir: str = "multi_previews",
-                          auto_merge: bool = True, completeness_threshold: float = 95.0):
+                          auto_merge: bool = True, completeness_threshold: float = 95.0,
+                          workers: int | None = None, use_llm_cache: bool = True):
     """
     Processes all PDFs in a folder using existing extraction logic.
     Produces one preview Excel per PDF (no shared report file).
+    With workers > 1 (default PDF_WORKERS) each PDF runs end-to-end in its own process;
+    results are merged as workers finish (merged rows keep input-folder order).
     """
     import pandas as pd, os
-    from datetime import datetime
 
     os.makedirs(preview_dir, exist_ok=True)
     pdf_files = [
@@ -996,101 +2061,37 @@ def process_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
 
     print(f"\n📂 Found {len(pdf_files)} PDFs — session {session_id}\n")
 
-    results, merged_data = [], {}
+    results, merged_by_pdf, jobs = [], {}, []
 
-    for i, pdf_path in enumerate(pdf_files, start=1):
+    for pdf_path in pdf_files:
         base = os.path.splitext(os.path.basename(pdf_path))[0]
         preview_name = f"preview_{session_id}_{base}.xlsx"
         preview_path = os.path.join(preview_dir, preview_name)
 
-        print(f"=== [{i}/{len(pdf_files)}] Processing {base} ===")
-
         if os.path.exists(preview_path):
             print(f"⏭️ Skipping {base} (already done)")
             results.append({"pdf": base, "preview_path": preview_path, "completeness": "cached"})
             continue
+        jobs.append((base, (pdf_path, criteria_pdf, template_xlsx, session_id,
+                            preview_path, completeness_threshold, use_llm_cache)))
 
-        try:
-    # Core extraction
-            filled = extract_fields(pdf_path, criteria_pdf, template_xlsx, session_id=session_id)
-
-    # Try to resume using per-PDF cache
-            try:
-                resumed = resume_incomplete_fields(
-                pdf_path, criteria_pdf, template_xlsx,
-                preview_path=preview_path,
-                session_id=session_id,
-                target_completeness=completeness_threshold
-                )
-            except ValueError as e:
-                if "No cache found" in str(e):
-                    print(f"⚠️ No cache found for {base}, using extract_fields() output directly.")
-                    resumed = filled  # Fallback to initial extraction
-                else:
-                    raise
-
-    # ✅ Enhanced completeness check (3 outputs)
-            # Iterative resume passes to reach threshold before finalizing
-            try:
-                _overall_tmp, _, _ = check_completeness(resumed)
-            except Exception:
-                _overall_tmp = 0.0
-            if _overall_tmp < completeness_threshold:
-                for _pass in range(max(0, MAX_RESUME_PASSES - 1)):  # total passes incl. first
-                    try:
-                        resumed = resume_incomplete_fields(
-                            pdf_path, criteria_pdf, template_xlsx,
-                            preview_path=preview_path,
-                            session_id=session_id,
-                            target_completeness=completeness_threshold
-                        )
-                    except Exception:
-                        break
-                    try:
-                        _overall_tmp, _, _ = check_completeness(resumed)
-                    except Exception:
-                        _overall_tmp = 0.0
-                    if _overall_tmp >= completeness_threshold:
-                        break
-
-            overall, details, logical_validity = check_completeness(resumed)
-            print(f"✅ {base} → {overall}% complete ({logical_validity}% logical validity)")
-
-            results.append({
-                "pdf": base,
-                "preview_path": preview_path,
-                "completeness": overall,
-                "logical_validity": logical_validity,
-                "sheet_wise": details
-            })
-
-    # ✅ Auto-merge only if enabled and threshold met
-            if auto_merge and overall >= completeness_threshold:
-                for sheet, records in resumed.items():
-                    merged_data.setdefault(sheet, []).extend(records)
-
-        except Exception as e:
-            print(f"❌ {base} failed: {e}")
-            results.append({"pdf": base, "error": str(e)})
-
+    for idx, base, result, resumed in _run_pdf_jobs(jobs, _process_single_pdf,
+                                                    workers or PDF_WORKERS, "Processing"):
+        results.append(result)
+        # ✅ Auto-merge only if enabled and threshold met
+        if auto_merge and resumed is not None and result.get("completeness", 0) >= completeness_threshold:
+            merged_by_pdf[idx] = resumed
 
+    merged_data = {}
+    for idx in sorted(merged_by_pdf):
+        for sheet, records in merged_by_pdf[idx].items():
+            merged_data.setdefault(sheet, []).extend(records)
 
     # --- Optional auto-merge ---
     final_output = None
     if auto_merge and merged_data:
         final_output = os.path.join(preview_dir, f"CardioProtect_Final_AutoMerged_{session_id}.xlsx")
-        xl = pd.ExcelFile(template_xlsx)
-        with pd.ExcelWriter(final_output, engine="openpyxl") as writer:
-            for sheet in xl.sheet_names:
-                cols = list(xl.parse(sheet, nrows=1).columns)
-                df = pd.DataFrame(merged_data.get(sheet, []))
-                if df.empty:
-                    df = pd.DataFrame([{c: "NR" for c in cols}])
-                for c in cols:
-                    if c not in df.columns:
-                        df[c] = "NR"
-                df = df.reindex(columns=cols)
-                df.to_excel(writer, sheet_name=sheet[:31], index=False)
+        _write_merged_workbook(final_output, template_xlsx, merged_data)
         print(f"\n🎯 Auto-merged Excel → {final_output}")
 
     # Summary in return (no log file)
@@ -1104,7 +2105,8 @@ def process_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
 
 def resume_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
                          session_id: str, preview_dir: str = "multi_previews",
-                         completeness_threshold: float = 95.0):
+                         completeness_threshold: float = 95.0, workers: int | None = None,
+                         use_llm_cache: bool = True):
     """
     Resume extraction for all PDFs in a multi-PDF session.
 
@@ -1112,9 +2114,9 @@ def resume_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
     🔹 Skips PDFs that are already 100% complete
     🔹 Rebuilds preview_<session>_<pdf>.xlsx for each resumed file
     🔹 Optionally auto-merges PDFs ≥ completeness_threshold
+    🔹 Resumes PDFs in parallel worker processes when workers > 1
     """
     import pandas as pd, os
-    from datetime import datetime
 
     # Prepare directories
     os.makedirs(preview_dir, exist_ok=True)
@@ -1129,8 +2131,7 @@ def resume_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
     if not previews and not cache_files:
         raise ValueError(f"No previews or caches found for session {session_id}")
 
-    results, merged_data = {}, {}
-    processed = 0
+    results, merged_by_pdf, jobs = {}, {}, []
 
     print(f"\n🔁 Resuming extraction for session: {session_id}")
     print(f"📂 Input folder: {os.path.abspath(input_dir)}")
@@ -1144,56 +2145,25 @@ def resume_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
         if not os.path.exists(pdf_path):
             print(f"⚠️ Missing source PDF for {base}, skipping.")
             continue
+        jobs.append((base, (pdf_path, criteria_pdf, template_xlsx, session_id, preview_path, use_llm_cache)))
 
-        processed += 1
-        print(f"\n=== [{processed}] Resuming {base} ===")
-
-        try:
-            # Resume using its individual cache
-            resumed = resume_incomplete_fields(
-                study_pdf=pdf_path,
-                criteria_pdf=criteria_pdf,
-                template_xlsx=template_xlsx,
-                preview_path=preview_path,
-                session_id=session_id
-            )
-
-            overall, details, logical_validity = check_completeness(resumed)
-            print(f"✅ {base} → {overall}% complete ({logical_validity}% logically valid)")
-
-            results[base] = {
-                "pdf": base,
-                "preview_path": preview_path,
-                "completeness": overall,
-                "logical_validity": logical_validity,
-                "sheet_wise": details
-            }
-
-            # Auto-merge if meets threshold
-            if overall >= completeness_threshold:
-                for sheet, records in resumed.items():
-                    merged_data.setdefault(sheet, []).extend(records)
+    for idx, base, result, resumed in _run_pdf_jobs(jobs, _resume_single_pdf,
+                                                    workers or PDF_WORKERS, "Resuming"):
+        results[base] = result
+        # Auto-merge if meets threshold
+        if resumed is not None and result.get("completeness", 0) >= completeness_threshold:
+            merged_by_pdf[idx] = resumed
 
-        except Exception as e:
-            print(f"❌ Resume failed for {base}: {e}")
-            results[base] = {"pdf": base, "error": str(e)}
+    merged_data = {}
+    for idx in sorted(merged_by_pdf):
+        for sheet, records in merged_by_pdf[idx].items():
+            merged_data.setdefault(sheet, []).extend(records)
 
     # --- Optional merge for all resumed results ---
     final_output = None
     if merged_data:
         final_output = os.path.join(preview_dir, f"CardioProtect_Final_Resumed_{session_id}.xlsx")
-        xl = pd.ExcelFile(template_xlsx)
-        with pd.ExcelWriter(final_output, engine="openpyxl") as writer:
-            for sheet in xl.sheet_names:
-                cols = list(xl.parse(sheet, nrows=1).columns)
-                df = pd.DataFrame(merged_data.get(sheet, []))
-                if df.empty:
-                    df = pd.DataFrame([{c: "NR" for c in cols}])
-                for c in cols:
-                    if c not in df.columns:
-                        df[c] = "NR"
-                df = df.reindex(columns=cols)
-                df.to_excel(writer, sheet_name=sheet[:31], index=False)
+        _write_merged_workbook(final_output, template_xlsx, merged_data)
         print(f"\n🎯 Resumed & auto-merged Excel created → {final_output}")
 
     # --- Summary ---
@@ -1218,6 +2188,463 @@ def resume_multiple_pdfs(input_dir: str, criteria_pdf: str, template_xlsx: str,
     return {"results": list(results.values()), "final_output": final_output}
 
 
+# ---------------- ASYNC ENGINE ----------------
+# asyncio twins of the blocking pipeline for the FastAPI routes: LLM calls are awaited on a
+# pooled httpx client, PDF parsing runs in a process pool; file/Excel I/O and CPU-bound steps (BM25 index,
+# batch planning, prompt building, answer parsing, completeness checks) in threads.
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()  # event loop → AsyncOllamaClient
+_PDF_EXECUTOR = None
+_PDF_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_async_ollama_client() -> AsyncOllamaClient:
+    """AsyncOllamaClient bound to the running loop; shares the sync client's circuit breaker."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        client = AsyncOllamaClient(OLLAMA_API, pool_size=OLLAMA_POOL_SIZE,
+                                   breaker=get_ollama_client().breaker)
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound PDF parsing/OCR."""
+    global _PDF_EXECUTOR
+    with _PDF_EXECUTOR_LOCK:
+        if _PDF_EXECUTOR is None:
+            _PDF_EXECUTOR = ProcessPoolExecutor(max_workers=max(1, PDF_PARSE_WORKERS))
+        return _PDF_EXECUTOR
+
+
+def _reports_to_session(fn):
+    """Async entry point: _p() inside it (its tasks and to_thread calls too) reports to its session_id only."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _SESSION.set(inspect.signature(fn).bind(*args, **kwargs).arguments.get("session_id"))
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _SESSION.reset(token)
+    return wrapper
+
+
+async def aload_document(pdf_path: str) -> StudyDocument:
+    """load_document in the PDF process pool (parse cache still applies)."""
+    loop = asyncio.get_running_loop()
+    _p(10, f"Reading PDF: {os.path.basename(pdf_path)}")
+    return await loop.run_in_executor(get_pdf_executor(), load_document, pdf_path)
+
+
+async def _aread_stream(resp, session_id: str | None = None, sheet: str | None = None) -> str:
+    """Async _read_stream: leaving the caller's stream context aborts generation."""
+    scanner, pieces = JsonStreamScanner(), []
+    async for line in resp.aiter_lines():
+        if _stream_step(line, scanner, pieces, session_id, sheet):
+            break
+    return _stream_result(scanner, pieces, session_id, sheet)
+
+
+async def aquery_llama(prompt: str, model: str = MODEL_NAME, use_cache: bool = True,
+                       session_id: str | None = None, sheet: str | None = None,
+                       json_schema: dict | None = None) -> str:
+    """asyncio twin of query_llama (same payload, cache, retries and stream handling)."""
+    import httpx
+
+    client = get_async_ollama_client()
+
+    max_retries = 3
+    token_limit = _get_prompt_compiler().window()
+    base_delay = 8
+    last_error = None
+
+    cache = _get_llm_cache() if use_cache else None
+    if cache is not None:
+        key = payload_key(_make_payload(_fit_prompt(prompt, token_limit), model, json_schema))
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            _p(50, f"⚡ LLM cache hit ({model})")
+            return cached
+
+    if not await client.alive():
+        raise OllamaUnavailableError("Ollama not responding")
+
+    _p(50, f"Querying {model} via Ollama (async)…")
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            payload = _make_payload(_fit_prompt(prompt, token_limit), model, json_schema)
+            if OLLAMA_STREAM:
+                async with client.stream(payload, timeout=600) as resp:
+                    if resp.status_code >= 500:
+                        raise OllamaUnavailableError(f"Ollama internal error (HTTP {resp.status_code})")
+                    raw = await _aread_stream(resp, session_id, sheet)
+            else:
+                data = await client.generate(payload, timeout=600)
+                raw = data.get("response", "").strip()
+
+            raw = _clean_response(raw)
+            await asyncio.to_thread(_record_response, prompt, raw, attempt, cache, payload, model)
+            return raw
+
+        except OllamaUnavailableError:
+            raise
+        except httpx.HTTPStatusError as e:
+            raise OllamaUnavailableError(f"Ollama internal error ({e})")
+        except httpx.TimeoutException:
+            last_error = "timeout"
+            print(f"⏱️ [Attempt {attempt}] Timeout, waiting {base_delay}s...")
+        except httpx.TransportError:
+            last_error = "connection"
+            print(f"🌐 [Attempt {attempt}] Connection error — is Ollama running?")
+        except Exception as e:
+            last_error = str(e)
+            print(f"⚠️ [Attempt {attempt}] Unexpected error: {e}")
+
+        # back-off
+        token_limit = max(300, int(token_limit * 0.6))
+        base_delay = min(30, base_delay * 1.5)
+        print(f"⚠️ Retrying with reduced context ({token_limit} tokens) in {int(base_delay)}s...")
+        await asyncio.sleep(base_delay)
+
+    raise OllamaUnavailableError(f"{model} failed after {max_retries} attempts ({last_error})")
+
+
+async def _extract_batch_async(bi: int, total: int, batch: list[str], schema: dict, doc: StudyDocument,
+                               criteria_text: str, reference_label: str, use_llm_cache: bool = True,
+                               session_id: str | None = None, template: dict | None = None,
+                               facts_text: str = "", window: list | None = None) -> dict:
+    """asyncio twin of _extract_batch (same schema / retry / split / rules policy)."""
+    if not any(schema[s] for s in batch):
+        _p(55, f"⚡ Batch {bi}/{total} answered by rules — no model call")
+        return {}
+    attempt, success, data = 0, False, {}
+    label = ", ".join(batch)
+    sheets = {s: schema[s] for s in batch}
+    answer_schema = sheet_schema(sheets)
+    max_retries = MAX_RETRIES_PER_BATCH if len(batch) == 1 else 0
+    while attempt <= max_retries and not success:
+        _p(40, f"Batch {bi}/{total} Attempt {attempt + 1}")
+        full_prompt = await asyncio.to_thread(_full_batch_prompt, batch, schema, doc, criteria_text,
+                                              reference_label, template, facts_text, window)
+
+        _p(45, f"Querying model for batch {bi}/{total}...")
+        try:
+            response = await aquery_llama(full_prompt, use_cache=use_llm_cache, session_id=session_id, sheet=label,
+                                          json_schema=answer_schema)
+        except OllamaUnavailableError:
+            raise
+        except Exception as e:
+            print(f"❌ Llama call failed: {e}")
+            response = "{}"
+
+        try:
+            data = await asyncio.to_thread(_parse_answer, response, sheets, answer_schema, f"batch {bi}")
+            success = True
+            _p(55, f"✅ Batch {bi}/{total} parsed successfully")
+        except Exception as e:
+            attempt += 1
+            _p(70, f"Retry {attempt} failed for batch {bi} ({e})")
+
+    if success:
+        await asyncio.to_thread(_record_output_sizes, batch, data)
+    if len(batch) > 1:
+        answered, missing = _split_packed_answer(bi, batch, data if success else {})
+        for part in missing:
+            answered.update(await _extract_batch_async(bi, total, part, schema, doc, criteria_text,
+                                                       reference_label, use_llm_cache, session_id, template,
+                                                       facts_text, window))
+        return answered
+    if not success:
+        _p(80, f"❌ Batch {bi} failed after {MAX_RETRIES_PER_BATCH} retries")
+        data = _nr_batch(batch, schema)
+    return data
+
+
+async def _study_facts_async(doc: StudyDocument, schema: dict, criteria_text: str, study_pdf: str,
+                             session_id: str | None = None, use_llm_cache: bool = True) -> dict:
+    """asyncio twin of _study_facts."""
+    if not STUDY_FACTS_ENABLED:
+        return {}
+    known = await asyncio.to_thread(_load_study_facts, study_pdf, session_id)
+    if known:
+        return known
+    _p(26, "🧾 Extracting shared study facts (stage 1)...")
+    prompt = await asyncio.to_thread(_build_facts_prompt, doc, schema, criteria_text, os.path.basename(study_pdf))
+    try:
+        response = await aquery_llama(prompt, use_cache=use_llm_cache, session_id=session_id, sheet="study facts",
+                                      json_schema=study_facts.facts_schema())
+    except Exception as e:
+        print(f"⚠️ Study facts call failed: {e}")
+        return {}
+    return await asyncio.to_thread(_finish_study_facts, response, study_pdf, session_id)
+
+
+async def _extract_map_reduce_async(pending: list, total: int, ask: dict, schema: dict, doc: StudyDocument,
+                                    criteria_text: str, study_pdf: str, use_llm_cache: bool,
+                                    session_id: str | None, facts_text: str, wins: list, filled: dict,
+                                    cache: dict, facts: dict, table_rows: dict | None = None,
+                                    failed: set | None = None):
+    """asyncio twin of _extract_map_reduce (same windows, plans, reduce policy and failed batches)."""
+    plans = {bi: await asyncio.to_thread(_window_plan, batch, ask, doc, wins) for bi, batch in pending}
+    tasks = [(bi, batch, wi) for bi, batch in pending for wi in plans[bi]["windows"]]
+    _p(30, f"🗺️ Map-reduce: {len(wins)} window(s) → {len(tasks)} call(s) for {len(pending)} batch(es) "
+           f"(policy: {MAP_REDUCE_POLICY})")
+    sem = asyncio.Semaphore(max(1, SHEET_CONCURRENCY))
+
+    async def run(bi, batch, wi):
+        async with sem:
+            try:
+                data = await _extract_batch_async(bi, total, batch, ask, doc, criteria_text,
+                                                  os.path.basename(study_pdf), use_llm_cache, session_id,
+                                                  schema, facts_text, wins[wi])
+            except OllamaUnavailableError as e:
+                print(f"❌ Batch {bi} window {wi} failed: {e}")
+                return bi, batch, wi, None
+            except Exception as e:
+                print(f"❌ Batch {bi} window {wi} crashed: {e}")
+                data = {}
+            return bi, batch, wi, data
+
+    partials, unanswered, done_count = {bi: {} for bi, _ in pending}, {bi: 0 for bi, _ in pending}, 0
+    for fut in asyncio.as_completed([asyncio.create_task(run(*t)) for t in tasks]):
+        bi, batch, wi, data = await fut
+        partials[bi][wi] = data if data is not None else {}
+        unanswered[bi] += data is None
+        if len(partials[bi]) == len(plans[bi]["windows"]):
+            done_count += 1
+            if unanswered[bi] == len(plans[bi]["windows"]):
+                _p(80, f"❌ Batch {bi} failed: no window got a model answer")
+                if failed is not None:
+                    failed.update(batch)
+                continue
+            data = await asyncio.to_thread(_reduce_batch, batch, ask, partials[bi], plans[bi])
+            await asyncio.to_thread(_on_batch_done, bi, batch, data, schema, filled, cache, study_pdf,
+                                    session_id, done_count, len(pending), total, facts, table_rows)
+
+
+@_reports_to_session
+async def extract_fields_async(study_pdf: str, criteria_pdf: str, template_xlsx: str,
+                               session_id: str | None = None, use_llm_cache: bool = True):
+    """asyncio twin of extract_fields; never blocks the event loop."""
+    _p(15, f"Loading PDFs and schema for {os.path.basename(study_pdf)}...")
+    doc, criteria_text, (sheet_names, schema), cache = await asyncio.gather(
+        aload_document(study_pdf),
+        asyncio.to_thread(load_criteria_text, criteria_pdf),
+        asyncio.to_thread(_load_schema, template_xlsx),
+        asyncio.to_thread(_load_partial, study_pdf, session_id),
+    )
+    await asyncio.to_thread(_doc_index, doc)  # BM25 build, before the batch tasks share it
+
+    filled = {}
+    sheets = await asyncio.to_thread(_gate_sheets, doc, sheet_names, schema, cache, filled)
+    known = await _study_facts_async(doc, schema, criteria_text, study_pdf, session_id, use_llm_cache) \
+        if any(s not in cache for s in sheets) else {}
+    rule_facts = await asyncio.to_thread(_rule_facts, doc, schema, study_pdf, session_id)
+    facts = study_facts.merge(study_facts.column_facts(known, schema), rule_facts)
+    ask, facts_text = rules.ask_schema(schema, facts), study_facts.render(known)
+    table_rows = await asyncio.to_thread(_table_rows, doc, schema)
+    batches, pending = await asyncio.to_thread(_plan_batches, sheets, cache, filled, ask,
+                                               os.path.basename(study_pdf))
+    wins = await asyncio.to_thread(_map_windows, doc, facts_text)
+    failed = set()
+    if wins and pending:
+        await _extract_map_reduce_async(pending, len(batches), ask, schema, doc, criteria_text, study_pdf,
+                                        use_llm_cache, session_id, facts_text, wins, filled, cache, facts,
+                                        table_rows, failed)
+        return await asyncio.to_thread(_finish_extraction, study_pdf, schema, filled, cache, session_id, failed)
+    sem = asyncio.Semaphore(max(1, SHEET_CONCURRENCY))
+
+    async def run(bi, batch):
+        async with sem:
+            try:
+                data = await _extract_batch_async(bi, len(batches), batch, ask, doc, criteria_text,
+                                                  os.path.basename(study_pdf), use_llm_cache, session_id,
+                                                  schema, facts_text)
+            except OllamaUnavailableError as e:
+                _p(80, f"❌ Batch {bi} failed: {e}")
+                return bi, batch, None
+            except Exception as e:
+                print(f"❌ Batch {bi} crashed: {e}")
+                data = _nr_batch(batch, schema)
+            return bi, batch, data
+
+    _p(30, f"Dispatching {len(pending)} batch(es) with {sem._value} in flight")
+    tasks = [asyncio.create_task(run(bi, batch)) for bi, batch in pending]
+    for done_count, fut in enumerate(asyncio.as_completed(tasks), start=1):
+        bi, batch, data = await fut
+        if data is None:
+            failed.update(batch)
+            continue
+        await asyncio.to_thread(_on_batch_done, bi, batch, data, schema, filled, cache, study_pdf,
+                                session_id, done_count, len(tasks), len(batches), facts, table_rows)
+
+    return await asyncio.to_thread(_finish_extraction, study_pdf, schema, filled, cache, session_id, failed)
+
+
+@_reports_to_session
+async def resume_incomplete_fields_async(study_pdf: str, criteria_pdf: str, template_xlsx: str,
+                                         preview_path: str = None, session_id: str | None = None,
+                                         target_completeness: float | None = None,
+                                         use_llm_cache: bool = True):
+    """asyncio twin of resume_incomplete_fields (sheets re-queried concurrently)."""
+    _p(5, "Resuming incomplete fields from cache...")
+    cache = await asyncio.to_thread(_load_partial, study_pdf, session_id)
+    if not cache:
+        raise ValueError(f"No cache found for {study_pdf}. Run extract_fields() first.")
+    out_path = preview_path or RESUME_PREVIEW_PATH
+    _, schema = await asyncio.to_thread(_load_schema, template_xlsx)
+
+    overall, details, logical_validity = await asyncio.to_thread(check_completeness, cache)
+    threshold = target_completeness if target_completeness is not None else 90
+    if overall >= threshold and all(s in cache for s in schema):
+        print(f"✅ Cache already {overall}% complete — skipping Llama3 resume to prevent overwrite.")
+        await asyncio.to_thread(_save_partial, cache, study_pdf, session_id)
+        try:
+            await asyncio.to_thread(_write_preview, cache, out_path)
+        except Exception as e:
+            print(f"⚠️ Resume skip: preview generation failed: {e}")
+        _p(100, f"Resume completed for {os.path.basename(study_pdf)} ✅")
+        return cache
+
+    incomplete_sheets = _find_incomplete_sheets(cache, schema)
+    if not incomplete_sheets:
+        _p(20, "✅ All fields complete, nothing to resume.")
+        return cache
+
+    doc, criteria_text = await asyncio.gather(
+        aload_document(study_pdf),
+        asyncio.to_thread(load_criteria_text, criteria_pdf),
+    )
+    for sheet in await asyncio.to_thread(_inapplicable_sheets, doc, list(schema)):
+        incomplete_sheets.pop(sheet, None)  # NR by design, not missing
+    facts_text = study_facts.render(await asyncio.to_thread(_load_study_facts, study_pdf, session_id))
+    sem = asyncio.Semaphore(max(1, SHEET_CONCURRENCY))
+
+    async def run(sheet, missing_cols):
+        columns = _resume_columns(schema.get(sheet) or list(missing_cols), missing_cols)
+        if not columns:
+            return sheet, columns, None, "{}"
+        async with sem:
+            _p(30, f"Re-extracting {len(columns)} missing field(s) for: {sheet}")
+            prompt = await asyncio.to_thread(_build_resume_prompt, sheet, columns, cache.get(sheet), doc,
+                                             criteria_text, os.path.basename(study_pdf), schema, facts_text)
+            answer_schema = sheet_schema({sheet: columns})
+            try:
+                return sheet, columns, answer_schema, await aquery_llama(
+                    prompt, use_cache=use_llm_cache, session_id=session_id, sheet=sheet, json_schema=answer_schema)
+            except OllamaUnavailableError as e:
+                return sheet, columns, answer_schema, e
+
+    for fut in asyncio.as_completed([asyncio.create_task(run(s, m)) for s, m in incomplete_sheets.items()]):
+        sheet, columns, answer_schema, response = await fut
+        if not columns:
+            continue
+        if isinstance(response, Exception):
+            _p(80, f"❌ Resume failed for {sheet}: {response}")
+            continue
+        try:
+            new_data = await asyncio.to_thread(_parse_answer, response, {sheet: columns}, answer_schema, sheet)
+            _merge_resumed_sheet(cache, sheet, new_data, incomplete_sheets)
+        except Exception as e:
+            _p(80, f"❌ Resume failed for {sheet}: {e}")
+
+    await asyncio.to_thread(_save_partial, cache, study_pdf, session_id)
+    _p(90, "Cache updated successfully ✅")
+    try:
+        await asyncio.to_thread(_write_preview, cache, out_path)
+        _p(95, f"✅ Resume complete → {out_path}")
+    except Exception as e:
+        print(f"⚠️ Resume succeeded but preview generation failed: {e}")
+
+    overall, details, logical_validity = await asyncio.to_thread(check_completeness, cache)
+    print(f"\n📊 Resume completeness: {overall}% | Logical validity: {logical_validity}%")
+    _p(100, f"Resume completed for {os.path.basename(study_pdf)} ✅")
+    return cache
+
+
+async def _process_single_pdf_async(pdf_path: str, criteria_pdf: str, template_xlsx: str, session_id: str,
+                                    preview_path: str, completeness_threshold: float,
+                                    use_llm_cache: bool = True):
+    """asyncio twin of _process_single_pdf."""
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    resumed = await extract_fields_async(pdf_path, criteria_pdf, template_xlsx, session_id, use_llm_cache)
+    for _pass in range(max(1, MAX_RESUME_PASSES)):
+        try:
+            resumed = await resume_incomplete_fields_async(
+                pdf_path, criteria_pdf, template_xlsx, preview_path=preview_path, session_id=session_id,
+                target_completeness=completeness_threshold, use_llm_cache=use_llm_cache)
+        except ValueError as e:
+            if "No cache found" not in str(e):
+                raise
+            print(f"⚠️ No cache found for {base}, using extract_fields() output directly.")
+            break
+        if (await asyncio.to_thread(check_completeness, resumed))[0] >= completeness_threshold:
+            break
+
+    overall, details, logical_validity = await asyncio.to_thread(check_completeness, resumed)
+    print(f"✅ {base} → {overall}% complete ({logical_validity}% logical validity)")
+    return {"pdf": base, "preview_path": preview_path, "completeness": overall,
+            "logical_validity": logical_validity, "sheet_wise": details}, resumed
+
+
+@_reports_to_session
+async def process_multiple_pdfs_async(input_dir: str, criteria_pdf: str, template_xlsx: str,
+                                      session_id: str, preview_dir: str = "multi_previews",
+                                      auto_merge: bool = True, completeness_threshold: float = 95.0,
+                                      workers: int | None = None, use_llm_cache: bool = True):
+    """asyncio twin of process_multiple_pdfs: up to `workers` PDFs in flight on one event loop."""
+    os.makedirs(preview_dir, exist_ok=True)
+    pdf_files = [
+        os.path.join(input_dir, f)
+        for f in sorted(os.listdir(input_dir))
+        if f.lower().endswith(".pdf") and not f.lower().startswith("copy of")
+    ]
+    if not pdf_files:
+        raise ValueError(f"No study PDFs found in: {input_dir}")
+
+    print(f"\n📂 Found {len(pdf_files)} PDFs — session {session_id}\n")
+    results, merged_by_pdf = [], {}
+    sem = asyncio.Semaphore(max(1, workers or PDF_WORKERS))
+
+    async def run(idx, pdf_path):
+        base = os.path.splitext(os.path.basename(pdf_path))[0]
+        preview_path = os.path.join(preview_dir, f"preview_{session_id}_{base}.xlsx")
+        if os.path.exists(preview_path):
+            print(f"⏭️ Skipping {base} (already done)")
+            return idx, {"pdf": base, "preview_path": preview_path, "completeness": "cached"}, None
+        async with sem:
+            try:
+                result, data = await _process_single_pdf_async(
+                    pdf_path, criteria_pdf, template_xlsx, session_id, preview_path,
+                    completeness_threshold, use_llm_cache)
+            except Exception as e:
+                print(f"❌ {base} failed: {e}")
+                result, data = {"pdf": base, "error": str(e)}, None
+            return idx, result, data
+
+    tasks = [asyncio.create_task(run(i, p)) for i, p in enumerate(pdf_files)]
+    for done_count, fut in enumerate(asyncio.as_completed(tasks), start=1):
+        idx, result, data = await fut
+        results.append(result)
+        _p(5 + int(90 * done_count / len(tasks)), f"Processing {done_count}/{len(tasks)} PDFs ({result['pdf']})")
+        if auto_merge and data is not None and result.get("completeness", 0) >= completeness_threshold:
+            merged_by_pdf[idx] = data
+
+    merged_data = {}
+    for idx in sorted(merged_by_pdf):
+        for sheet, records in merged_by_pdf[idx].items():
+            merged_data.setdefault(sheet, []).extend(records)
+
+    final_output = None
+    if auto_merge and merged_data:
+        final_output = os.path.join(preview_dir, f"CardioProtect_Final_AutoMerged_{session_id}.xlsx")
+        await asyncio.to_thread(_write_merged_workbook, final_output, template_xlsx, merged_data)
+        print(f"\n🎯 Auto-merged Excel → {final_output}")
+
+    return {"results": results, "final_output": final_output}
+
+
 # ---------------- FILL EXCEL ----------------
 def fill_template(template_xlsx: str, extracted_json: dict, out_path="CardioProtect_Filled_Llama3.xlsx"):
     """Fill Excel template preserving all columns & order (now with list flattening)."""
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the app's modules the way mapper.py does (from the project folder)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+TEMPLATE_XLSX = os.path.join(PROJECT_DIR, "CardioProtect_MetaAnalysis_DataTemplate.xlsx")
+CRITERIA_PDF = os.path.join(PROJECT_DIR, "Copy of CardioProtect_MetaAnalysis_DataTemplate.pdf")
+
+STUDY_PAGES = [
+    "Enalapril for cardioprotection: a randomized controlled trial\n"
+    "Abstract\nMethods: 135 patients receiving epirubicin were randomized to enalapril (n=69) or placebo (n=66).\n"
+    "Results: LVEF at 12 months was 58.2 ± 5.1 % with enalapril and 55.0 ± 6.2 % with placebo (p=0.01).",
+    "Discussion\nEnalapril prevented the decline in LVEF during anthracycline therapy.\n"
+    "Conclusion\nACE inhibition is cardioprotective.",
+]
+
+
+@pytest.fixture
+def mapper_env(tmp_path, monkeypatch):
+    """mapper with every cache / log redirected into tmp_path and the LLM response cache off."""
+    monkeypatch.chdir(PROJECT_DIR)
+    import mapper
+    monkeypatch.setattr(mapper, "PARTIAL_CACHE_DIR", str(tmp_path / "partial_caches"))
+    monkeypatch.setattr(mapper, "PARSE_CACHE_DIR", str(tmp_path / "parse_cache"))
+    monkeypatch.setattr(mapper, "RAW_LOG_PATH", str(tmp_path / "raw_log.txt"))
+    monkeypatch.setattr(mapper, "OUTPUT_STATS_PATH", str(tmp_path / "output_stats.json"))
+    monkeypatch.setattr(mapper, "RESUME_PREVIEW_PATH", str(tmp_path / "resume_preview.xlsx"))
+    monkeypatch.setattr(mapper, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(mapper, "SHEET_CONCURRENCY", 1)
+    monkeypatch.setattr(mapper, "_PARSE_CACHE", None)
+    monkeypatch.setattr(mapper, "_OUTPUT_STATS", None)
+    monkeypatch.setattr(mapper, "_update_progress", None)
+    monkeypatch.setattr(mapper, "_criteria_provider", None)
+    return mapper
+
+
+@pytest.fixture
+def study_pdf(tmp_path):
+    """Two-page text PDF of a small enalapril RCT."""
+    import fitz
+    doc = fitz.open()
+    for text in STUDY_PAGES:
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=10)
+    path = tmp_path / "Enalapril_2020.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
@@ -0,0 +1,39 @@
+from extractor import cleaner
+
+
+def _clean(*pages):
+    return cleaner.clean_pages(list(pages))[0]
+
+
+def test_broken_word_is_joined():
+    assert _clean("risk of throm-\nboembolism was low") == ["risk of thromboembolism was low"]
+
+
+def test_word_spelled_elsewhere_is_joined():
+    text = "patients with cardio-\ntoxicity and no toxicity\nCardiotoxicity was defined as a drop in LVEF"
+    assert _clean(text)[0].startswith("patients with cardiotoxicity and")
+
+
+def test_hyphenated_compound_keeps_its_hyphen():
+    assert _clean("a dose-\nresponse curve", "the dose-response was linear")[0] == "a dose-response curve"
+
+
+def test_hyphen_before_the_next_columns_word_stays():
+    text = "a female pre-\nand Mesna was given\nwomen and men were enrolled"
+    out = _clean(text)[0]
+    assert "preand" not in out
+    assert "pre-\nand Mesna" in out
+
+
+def test_table_rows_after_the_reference_list_are_kept(mapper_env):
+    from extractor.document import StudyDocument
+    body = "Results\n" + "LVEF fell by 4% in the control arm and stayed stable with enalapril.\n" * 30
+    refs = "References\n" + "\n".join(f"{i}. Smith J, et al. Cardiotoxicity. J Clin Oncol 2019;37:{i}-{i + 9}."
+                                      for i in range(1, 16))
+    pages = [{"page": 1, "text": body},
+             {"page": 2, "text": refs, "tables": [[["Outcome", "Enalapril", "Placebo"], ["LVEF drop", "2", "9"]]]},
+             {"page": 3, "text": "", "ocr": "Supplementary figure: troponin over time"}]
+    doc = StudyDocument.from_pages(pages, mapper_env._page_text, clean=mapper_env._clean_pages)
+    assert "Smith J" not in doc.text
+    assert "References\nOutcome | Enalapril | Placebo\nLVEF drop | 2 | 9" in doc.text
+    assert doc.text.endswith("Supplementary figure: troponin over time")
@@ -0,0 +1,62 @@
+import pytest
+
+from extractor.json_repair import JsonRepairError, loads, truncated
+
+
+def _loads(text):
+    repairs = []
+    return loads(text, repairs), repairs
+
+
+def test_valid_json_needs_no_repair():
+    assert _loads('{"1_Study_ID_Design": [{"Study_ID": "Kaya_2020"}]}') == (
+        {"1_Study_ID_Design": [{"Study_ID": "Kaya_2020"}]}, [])
+
+
+def test_truncated_object_and_array_are_closed_and_flagged():
+    data, repairs = _loads('{"9_Outcome_Continuous": [{"Arm_Name": "Enalapril", "Mean": "58.2"}, {"Arm_Name": "Plac')
+    assert data == {"9_Outcome_Continuous": [{"Arm_Name": "Enalapril", "Mean": "58.2"}, {"Arm_Name": "Plac"}]}
+    assert truncated(repairs)
+
+
+def test_bare_nr_becomes_a_string_and_is_not_truncation():
+    data, repairs = _loads('{"Mean": NR, "SD": NA, "Blinded": True, "Note": "None reported"}')
+    assert data == {"Mean": "NR", "SD": "NA", "Blinded": True, "Note": "None reported"}
+    assert repairs and not truncated(repairs)
+
+
+def test_trailing_garbage_is_dropped():
+    data, repairs = _loads('{"Mean": "58.2"} Let me know if you need anything else. }')
+    assert data == {"Mean": "58.2"}
+    assert any(r.startswith("dropped trailing text") for r in repairs)
+    assert not truncated(repairs)
+
+
+def test_fenced_block_is_unwrapped():
+    data, repairs = _loads('Here is the JSON:\n```json\n{"Mean": "58.2", "SD": "5.1"}\n```\n')
+    assert data == {"Mean": "58.2", "SD": "5.1"}
+    assert not truncated(repairs)
+
+
+@pytest.mark.parametrize("text", ['{"rows": [{"Mean": "58.2"}}', '{"rows": [{"Mean": "58.2"}]]}', '[{"Mean": "1"}}]'])
+def test_mismatched_bracket_is_flagged(text):
+    data, repairs = _loads(text)
+    assert data
+    assert truncated(repairs)
+
+
+def test_text_without_json_raises():
+    with pytest.raises(JsonRepairError):
+        loads("The study does not report these outcomes.")
+
+
+def test_mismatched_bracket_answer_is_not_cached(mapper_env):
+    stored = []
+
+    class _Cache:
+        def put(self, key, value, model):
+            stored.append(value)
+
+    mapper_env._record_response("prompt", '{"rows": [{"Mean": "58.2"}}', 1, _Cache(), {"prompt": "p"}, "m")
+    mapper_env._record_response("prompt", '{"rows": [{"Mean": "58.2"}]}', 1, _Cache(), {"prompt": "p"}, "m")
+    assert stored == ['{"rows": [{"Mean": "58.2"}]}']
@@ -0,0 +1,98 @@
+import sqlite3
+import time
+
+import pytest
+
+from extractor import llm_cache
+from extractor.llm_cache import ResponseCache, payload_key
+from extractor.ollama_client import OllamaUnavailableError
+
+PAYLOAD = {"model": "llama3:8b", "prompt": "Extract LVEF", "options": {"num_ctx": 8192}, "stream": True}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "llm_cache.sqlite"), ttl_seconds=3600, max_bytes=1024 * 1024)
+
+
+def test_hit_and_miss(cache):
+    key = payload_key(PAYLOAD)
+    assert cache.get(key) is None
+    cache.put(key, '{"a": "1"}', "llama3:8b")
+    assert cache.get(key) == '{"a": "1"}'
+    assert cache.stats()["entries"] == 1
+
+
+def test_key_ignores_transport_fields_only():
+    key = payload_key(PAYLOAD)
+    assert payload_key({**PAYLOAD, "stream": False, "keep_alive": "5m"}) == key
+    assert payload_key({**PAYLOAD, "prompt": "Extract GLS"}) != key
+    assert payload_key({**PAYLOAD, "model": "orca-mini:3b"}) != key
+
+
+def test_expired_entry_is_invalidated(cache):
+    key = payload_key(PAYLOAD)
+    cache.put(key, '{"a": "1"}')
+    with sqlite3.connect(cache.db_path) as con:
+        con.execute("UPDATE responses SET created = ?", (time.time() - 7200,))
+    con.close()
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_eviction_bounds_stored_bytes_least_recently_used_first(tmp_path):
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), ttl_seconds=0, max_bytes=2500)
+    for name in ("a", "b", "c"):
+        cache.put(name, "x" * 1000)
+        time.sleep(0.01)
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+    cache.put("d", "é" * 500)  # 1000 bytes, 500 characters
+    assert cache.get("b") is None
+    assert cache.stats()["size_mb"] <= 2500 / (1024 * 1024)
+
+
+def test_every_connection_is_closed(cache, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking(*a, **k):
+        opened.append(connect(*a, **k))
+        return opened[-1]
+
+    monkeypatch.setattr(llm_cache.sqlite3, "connect", tracking)
+    cache.put("k", "v")
+    cache.get("k")
+    cache.get("missing")
+    cache.stats()
+    cache.clear()
+    assert len(opened) == 5
+    for con in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            con.execute("SELECT 1")
+
+
+class _DeadClient:
+    def alive(self):
+        return False
+
+
+def test_query_hit_needs_no_server_and_bypass_skips_the_cache(mapper_env, monkeypatch, tmp_path):
+    mapper = mapper_env
+    monkeypatch.setattr(mapper, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(mapper, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(mapper, "_LLM_CACHE", None)
+    monkeypatch.setattr(mapper, "get_ollama_client", lambda: _DeadClient())
+    token_limit = mapper._get_prompt_compiler().window()
+    key = payload_key(mapper._make_payload(mapper._fit_prompt("Extract LVEF", token_limit)))
+    mapper._get_llm_cache().put(key, '{"a": "1"}')
+
+    assert mapper.query_llama("Extract LVEF") == '{"a": "1"}'
+    with pytest.raises(OllamaUnavailableError):
+        mapper.query_llama("Extract LVEF", use_cache=False)
+    with pytest.raises(OllamaUnavailableError):
+        mapper.query_llama("Extract GLS")
+
+
+def test_disabled_cache_is_never_built(mapper_env):
+    assert mapper_env._get_llm_cache() is None
@@ -0,0 +1,46 @@
+import pytest
+
+from extractor import map_reduce
+
+COLUMNS = ["Study_ID", "Outcome_Name (e.g., CTRCD)", "Timepoint", "Arm_Name", "Events"]
+NR_ROW = {c: "NR" for c in COLUMNS}
+
+
+def _row(outcome="NR", timepoint="NR", arm="NR", events="NR"):
+    return {"Study_ID": "Kaya_2020", "Outcome_Name (e.g., CTRCD)": outcome, "Timepoint": timepoint,
+            "Arm_Name": arm, "Events": events}
+
+
+@pytest.mark.parametrize("policy", map_reduce.POLICIES)
+def test_all_nr_row_is_dropped_when_another_window_answered(policy):
+    partials = [(0, 1.0, [NR_ROW]), (1, 2.0, [_row("CTRCD", "12 months", events="5")])]
+    assert map_reduce.reduce_rows(partials, COLUMNS, policy) == [_row("CTRCD", "12 months", events="5")]
+
+
+def test_all_nr_answers_stay_one_nr_row():
+    assert map_reduce.reduce_rows([(0, 1.0, [NR_ROW]), (1, 1.0, [NR_ROW])], COLUMNS) == [NR_ROW]
+
+
+@pytest.mark.parametrize("policy", map_reduce.POLICIES)
+def test_partial_identity_folds_into_its_superset(policy):
+    partials = [(0, 1.0, [NR_ROW, _row("CTRCD", events="6")]),
+                (1, 2.0, [_row("CTRCD", "12 months", events="5")])]
+    rows = map_reduce.reduce_rows(partials, COLUMNS, policy)
+    assert len(rows) == 1
+    assert rows[0]["Timepoint"] == "12 months"
+    assert rows[0]["Events"] == {"first": "6", "majority": "6", "evidence": "5"}[policy]
+
+
+def test_partial_identity_with_two_supersets_stays_apart():
+    partials = [(0, 1.0, [_row("CTRCD", events="6")]),
+                (1, 1.0, [_row("CTRCD", "6 months", events="3"), _row("CTRCD", "12 months", events="5")])]
+    rows = map_reduce.reduce_rows(partials, COLUMNS)
+    assert [(r["Timepoint"], r["Events"]) for r in rows] == [("NR", "6"), ("6 months", "3"), ("12 months", "5")]
+
+
+def test_fold_follows_the_chain_to_the_fullest_identity():
+    partials = [(0, 1.0, [_row("CTRCD", events="6")]),
+                (1, 1.0, [_row("CTRCD", "12 months")]),
+                (2, 1.0, [_row("CTRCD", "12 months", "Carvedilol", events="5")])]
+    rows = map_reduce.reduce_rows(partials, COLUMNS, "first")
+    assert rows == [_row("CTRCD", "12 months", "Carvedilol", events="6")]
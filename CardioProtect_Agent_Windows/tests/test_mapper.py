@@ -0,0 +1,133 @@
+import json
+import re
+
+import pytest
+
+from conftest import CRITERIA_PDF, TEMPLATE_XLSX
+from extractor.ollama_client import OllamaUnavailableError
+
+
+def _nr_answer(json_schema):
+    """Valid all-NR answer for the sheets a call asks for."""
+    return json.dumps({s: [{c: "NR" for c in sc["items"]["properties"]}]
+                       for s, sc in json_schema["properties"].items()})
+
+
+class _DeadClient:
+    def alive(self):
+        return False
+
+
+def test_query_raises_when_ollama_is_not_alive(mapper_env, monkeypatch):
+    monkeypatch.setattr(mapper_env, "get_ollama_client", lambda: _DeadClient())
+    with pytest.raises(OllamaUnavailableError):
+        mapper_env.query_llama("prompt", use_cache=False)
+
+
+def test_unanswered_batch_is_not_cached_and_resume_asks_again(mapper_env, monkeypatch, study_pdf):
+    mapper = mapper_env
+    monkeypatch.setattr(mapper, "STUDY_FACTS_ENABLED", False)
+    down = {"9_Outcome_Continuous"}
+
+    def fake(prompt, *a, json_schema=None, **k):
+        if down & set(json_schema["properties"]):
+            raise OllamaUnavailableError("Ollama not responding")
+        return _nr_answer(json_schema)
+
+    monkeypatch.setattr(mapper, "query_llama", fake)
+    out = mapper.extract_fields(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="t7")
+    cache = mapper._load_partial(study_pdf, "t7")
+    assert out["9_Outcome_Continuous"][0]["Mean"] == "NR"
+    assert "9_Outcome_Continuous" not in cache
+    assert "1_Study_ID_Design" in cache
+
+    down.clear()
+    asked = []
+    monkeypatch.setattr(mapper, "query_llama", lambda p, *a, sheet=None, json_schema=None, **k:
+                        asked.append(sheet) or _nr_answer(json_schema))
+    cache = mapper.resume_incomplete_fields(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="t7",
+                                            target_completeness=101)
+    assert "9_Outcome_Continuous" in asked
+    assert "9_Outcome_Continuous" in cache
+
+
+def _long_doc():
+    from extractor.document import StudyDocument
+    topics = ["LVEF", "troponin", "hazard ratio", "enalapril dose", "epirubicin", "GLS", "NT-proBNP", "follow-up"]
+    pages = [{"page": p, "text": ("Results\n" if p == 1 else "") + "\n\n".join(
+        f"Paragraph {p}.{i}: the {topics[(p + i) % len(topics)]} finding was reported in {i + p} patients. " * 6
+        for i in range(12))} for p in range(1, 13)]
+    return StudyDocument.from_pages(pages, lambda r: r["text"])
+
+
+def test_prefix_prompt_fills_the_window_with_sheet_evidence(mapper_env, monkeypatch):
+    mapper = mapper_env
+    monkeypatch.setattr(mapper, "PROMPT_LAYOUT", "prefix")
+    _, schema = mapper._load_schema(TEMPLATE_XLSX)
+    doc = _long_doc()
+    sheet = "9_Outcome_Continuous"
+    prompt = mapper._batch_prompt([sheet], schema, doc, "", "Kaya_2020.pdf", schema)
+    prefix = mapper._shared_prefix(doc, schema, "", "Kaya_2020.pdf")
+    assert prompt.startswith(prefix["text"])
+    tail = prompt[len(prefix["text"]):]
+    assert "[EVIDENCE]" in tail
+    extra_ids = {int(i) for i in re.findall(r"\[\w+ #(\d+)", tail)}
+    assert extra_ids and not extra_ids & prefix["ids"]
+    window = mapper._get_prompt_compiler().window()
+    assert window * 0.8 < mapper.estimate_tokens(prompt) <= window
+
+
+def test_async_progress_reports_only_to_its_own_session(mapper_env, monkeypatch, study_pdf):
+    import asyncio
+    import shutil
+    mapper = mapper_env
+    other_pdf = study_pdf.replace("Enalapril_2020", "Placebo_2021")
+    shutil.copy(study_pdf, other_pdf)
+    reports = []
+
+    async def load(path):
+        return await asyncio.to_thread(mapper.load_document, path)
+
+    async def answer(prompt, *a, json_schema=None, **k):
+        await asyncio.sleep(0)
+        return _nr_answer(json_schema)
+
+    monkeypatch.setattr(mapper, "aload_document", load)
+    monkeypatch.setattr(mapper, "aquery_llama", answer)
+    monkeypatch.setattr(mapper, "_update_progress", lambda status, step, pct, sid: reports.append((sid, step)))
+
+    async def both():
+        await asyncio.gather(mapper.extract_fields_async(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="a"),
+                             mapper.extract_fields_async(other_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="b"))
+
+    asyncio.run(both())
+    assert {sid for sid, _ in reports} == {"a", "b"}
+    assert ("a", "Loading PDFs and schema for Enalapril_2020.pdf...") in reports
+    assert ("b", "Loading PDFs and schema for Placebo_2021.pdf...") in reports
+    assert mapper._SESSION.get() is None
+
+
+def _marked_answer(json_schema):
+    return json.dumps({s: [{c: f"{s}:{c}" for c in sc["items"]["properties"]}]
+                       for s, sc in json_schema["properties"].items()})
+
+
+def test_failed_packed_call_is_split_and_merged_in_template_order(mapper_env, monkeypatch):
+    mapper = mapper_env
+    sheet_names, schema = mapper._load_schema(TEMPLATE_XLSX)
+    batch = sheet_names[:4]
+    asked = []
+
+    def fake(prompt, *a, json_schema=None, **k):
+        sheets = list(json_schema["properties"])
+        asked.append(sheets)
+        if len(sheets) == len(batch):
+            raise RuntimeError("context overflow")
+        return _marked_answer(json_schema)
+
+    monkeypatch.setattr(mapper, "query_llama", fake)
+    out = mapper._extract_batch(1, 1, batch, schema, _long_doc(), "", "Kaya_2020.pdf", template=schema)
+    assert asked == [batch, batch, batch[:2], batch[2:]]
+    assert list(out) == batch
+    for s in batch:
+        assert out[s] == [{c: f"{s}:{c}" for c in schema[s]}]
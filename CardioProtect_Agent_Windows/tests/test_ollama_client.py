@@ -0,0 +1,25 @@
+from extractor.ollama_client import CircuitBreaker, CLOSED, OPEN
+
+
+def test_generate_failure_does_not_cache_not_alive():
+    breaker = CircuitBreaker(alive_ttl=60, failure_threshold=3)
+    breaker.record_success(probe=True)
+    breaker.record_failure()  # one slow / failed generate
+    assert breaker.cached_alive() is True
+    assert breaker.status()["circuit"] == CLOSED
+
+
+def test_probe_failure_is_cached():
+    breaker = CircuitBreaker(alive_ttl=60, failure_threshold=3)
+    breaker.record_failure(probe=True)
+    assert breaker.cached_alive() is False
+
+
+def test_threshold_opens_the_circuit():
+    breaker = CircuitBreaker(alive_ttl=60, failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.acquire()
+    breaker.record_failure()
+    assert breaker.status()["circuit"] == OPEN
+    assert not breaker.acquire()
+    assert breaker.cached_alive() is None
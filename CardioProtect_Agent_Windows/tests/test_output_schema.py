@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from extractor.output_schema import conform, sheet_schema, validate
+
+SHEETS = {"9_Outcome_Continuous": ["Study_ID", "Arm_Name", "Mean", "SD"], "1_Study_ID_Design": ["Study_ID", "Design"]}
+SCHEMA = sheet_schema(SHEETS)
+ROW = {"Study_ID": "Kaya_2020", "Arm_Name": "Enalapril", "Mean": "58.2", "SD": "5.1"}
+DESIGN = {"Study_ID": "Kaya_2020", "Design": "RCT"}
+
+
+def test_conforming_answer_has_no_errors():
+    assert validate({"9_Outcome_Continuous": [ROW], "1_Study_ID_Design": [DESIGN]}, SCHEMA) == []
+
+
+def test_missing_and_extra_columns():
+    row = {"Study_ID": "Kaya_2020", "Arm_Name": "Enalapril", "Mean": "58.2", "Median": "57"}
+    errors = validate({"9_Outcome_Continuous": [row], "1_Study_ID_Design": [DESIGN]}, SCHEMA)
+    assert "$.9_Outcome_Continuous[0]: missing 'SD'" in errors
+    assert "$.9_Outcome_Continuous[0]: unexpected 'Median'" in errors
+    assert conform({"9_Outcome_Continuous": [row]}, SHEETS)["9_Outcome_Continuous"] == [
+        {"Study_ID": "Kaya_2020", "Arm_Name": "Enalapril", "Mean": "58.2", "SD": "NR"}]
+
+
+def test_missing_sheet_is_reported_and_left_out():
+    data = {"9_Outcome_Continuous": [ROW]}
+    assert validate(data, SCHEMA) == ["$: missing '1_Study_ID_Design'"]
+    assert list(conform(data, SHEETS)) == ["9_Outcome_Continuous"]
+
+
+@pytest.mark.parametrize("value", ["NR", 58.2, None])
+def test_non_list_sheet_value_is_dropped(value):
+    data = {"9_Outcome_Continuous": value, "1_Study_ID_Design": [DESIGN]}
+    assert "$.9_Outcome_Continuous: expected array" in validate(data, SCHEMA)
+    assert conform(data, SHEETS) == {"1_Study_ID_Design": [DESIGN]}
+
+
+def test_single_row_object_becomes_a_one_row_list():
+    data = {"9_Outcome_Continuous": ROW, "1_Study_ID_Design": [DESIGN]}
+    assert "$.9_Outcome_Continuous: expected array" in validate(data, SCHEMA)
+    assert conform(data, SHEETS)["9_Outcome_Continuous"] == [ROW]
+
+
+def test_scalar_cells_are_coerced_to_strings():
+    row = {"study id": "Kaya_2020", "ARM NAME": ["Enalapril", "Placebo"], "Mean": 58.2, "SD": None}
+    errors = validate({"9_Outcome_Continuous": [row], "1_Study_ID_Design": [{"Study_ID": "K", "Design": True}]}, SCHEMA)
+    assert "$.9_Outcome_Continuous[0].Mean: expected string" in errors
+    assert "$.1_Study_ID_Design[0].Design: expected string" in errors
+    out = conform({"9_Outcome_Continuous": [row, "stray text"], "1_Study_ID_Design": {"Design": True}}, SHEETS)
+    assert out["9_Outcome_Continuous"] == [
+        {"Study_ID": "Kaya_2020", "Arm_Name": "Enalapril; Placebo", "Mean": "58.2", "SD": "NR"}]
+    assert out["1_Study_ID_Design"] == [{"Study_ID": "NR", "Design": "Yes"}]
+
+
+def test_bare_row_fills_the_only_sheet_asked():
+    only = {"9_Outcome_Continuous": SHEETS["9_Outcome_Continuous"]}
+    assert conform(ROW, only) == {"9_Outcome_Continuous": [ROW]}
+    assert conform(ROW, SHEETS) == {}
+    assert conform(["not", "an", "object"], SHEETS) == {}
+
+
+def test_parse_answer_conforms_a_near_miss_locally(mapper_env):
+    raw = 'Answer:\n```json\n{"9_Outcome_Continuous": {"arm_name": "Enalapril", "Mean": 58.2}, "Extra": []}\n```'
+    data = mapper_env._parse_answer(raw, SHEETS, SCHEMA, "batch 1")
+    assert data == {"9_Outcome_Continuous": [{"Study_ID": "NR", "Arm_Name": "Enalapril", "Mean": "58.2", "SD": "NR"}]}
+
+
+def test_parse_answer_raises_when_there_is_no_json(mapper_env):
+    with pytest.raises(ValueError):
+        mapper_env._parse_answer("I could not find these values.", SHEETS, SCHEMA, "batch 1")
+
+
+def test_parse_answer_keeps_a_conforming_answer(mapper_env):
+    answer = {"9_Outcome_Continuous": [ROW], "1_Study_ID_Design": [DESIGN]}
+    assert mapper_env._parse_answer(json.dumps(answer), SHEETS, SCHEMA, "batch 1") == answer
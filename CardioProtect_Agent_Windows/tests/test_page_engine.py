@@ -0,0 +1,40 @@
+import fitz
+
+from extractor import page_engine
+
+
+def _pdf(path, build):
+    doc = fitz.open()
+    build(doc.new_page())
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+
+def test_rotated_lines_stay_out_of_the_body(tmp_path):
+    def build(page):
+        page.insert_text((72, 100), "patients were excluded from the study", fontsize=11)
+        page.insert_text((72, 114), "four cancer-related deaths in total", fontsize=11)
+        # vertical margin note crossing both body lines
+        page.insert_text((300, 130), "Author Manuscript note", fontsize=11, rotate=90)
+
+    pages = page_engine.parse(_pdf(tmp_path / "rotated.pdf", build))
+    assert pages[0]["text"].split("\n") == [
+        "patients were excluded from the study",
+        "four cancer-related deaths in total",
+        "Author Manuscript note",
+    ]
+
+
+def test_rotated_page_reads_like_the_upright_one(tmp_path):
+    def build(page):
+        page.insert_text((72, 100), "Baseline LVEF 62 %", fontsize=11)
+        page.insert_text((72, 114), "Follow-up LVEF 58 %", fontsize=11)
+
+    upright = page_engine.parse(_pdf(tmp_path / "upright.pdf", build))[0]["text"]
+
+    def build_rotated(page):
+        build(page)
+        page.set_rotation(90)
+
+    assert page_engine.parse(_pdf(tmp_path / "turned.pdf", build_rotated))[0]["text"] == upright
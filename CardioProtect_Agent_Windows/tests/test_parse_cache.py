@@ -0,0 +1,76 @@
+import os
+import time
+
+from extractor.parse_cache import ParseCache
+
+
+def test_hit_miss_and_content_addressed_keys(tmp_path):
+    cache = ParseCache(str(tmp_path / "pc"))
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF one")
+    key = cache.key_for(str(pdf), "v1", {"ocr": 300})
+    assert cache.get(key) is None
+    cache.put(key, [{"page": 1, "text": "one"}])
+    assert cache.get(key) == [{"page": 1, "text": "one"}]
+
+    copy = tmp_path / "b.pdf"
+    copy.write_bytes(b"%PDF one")
+    assert cache.key_for(str(copy), "v1", {"ocr": 300}) == key  # same bytes, other path
+    assert cache.key_for(str(pdf), "v2", {"ocr": 300}) != key
+    assert cache.key_for(str(pdf), "v1", {"ocr": 200}) != key
+    time.sleep(0.01)
+    pdf.write_bytes(b"%PDF two")
+    assert cache.key_for(str(pdf), "v1", {"ocr": 300}) != key
+
+
+def test_eviction_drops_least_recently_used_over_budget(tmp_path):
+    cache = ParseCache(str(tmp_path / "pc"), max_bytes=2500)
+    for i, name in enumerate(("a", "b")):
+        cache.put(name, "x" * 1000)
+        os.utime(cache._path(name), (i, i))
+    assert cache.get("a") is not None  # refreshes a
+    cache.put("c", "x" * 1000)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_pages_come_from_the_cache_unless_bypassed(mapper_env, monkeypatch, study_pdf):
+    mapper = mapper_env
+    parsed = []
+    parse = mapper._iter_pdf_pages
+
+    def counting(path):
+        parsed.append(path)
+        return parse(path)
+
+    monkeypatch.setattr(mapper, "_iter_pdf_pages", counting)
+    first = mapper.read_pdf_pages(study_pdf)
+    assert mapper.read_pdf_pages(study_pdf) == first
+    assert len(parsed) == 1
+
+    assert mapper.read_pdf_pages(study_pdf, use_cache=False) == first
+    assert len(parsed) == 2
+
+    monkeypatch.setattr(mapper, "PDF_EXTRACTOR_VERSION", mapper.PDF_EXTRACTOR_VERSION + "-next")
+    mapper.read_pdf_pages(study_pdf)
+    assert len(parsed) == 3
+
+
+def test_document_is_built_from_the_one_cached_page_entry(mapper_env, monkeypatch, study_pdf):
+    mapper = mapper_env
+    parsed = []
+    parse = mapper._iter_pdf_pages
+    monkeypatch.setattr(mapper, "_iter_pdf_pages", lambda path: parsed.append(path) or parse(path))
+
+    doc = mapper.load_document(study_pdf)
+    pages = mapper.read_pdf_pages(study_pdf)
+    again = mapper.load_document(study_pdf)
+    assert len(parsed) == 1
+    cache = mapper._get_parse_cache()
+    key = cache.key_for(study_pdf, mapper.PDF_EXTRACTOR_VERSION, mapper._parse_settings())
+    assert os.listdir(mapper.PARSE_CACHE_DIR) == [os.path.basename(cache._path(key))]
+    assert again.text == doc.text and [p["page"] for p in again.pages] == [p["page"] for p in pages]
+
+    monkeypatch.setattr(mapper, "TEXT_CLEANING", False)  # cleaning follows the current settings, not the cache
+    mapper.load_document(study_pdf)
+    assert len(parsed) == 1
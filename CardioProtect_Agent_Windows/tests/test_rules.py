@@ -0,0 +1,55 @@
+from extractor import rules
+from extractor.document import StudyDocument
+
+TTE = "10_TimeToEvent"
+OUTCOME = "Outcome_Name (e.g., HF hospitalization, PFS, OS)"
+SCHEMA = {
+    "1_Study_ID_Design": ["Study_ID (FirstAuthor_Year)", "Registry_ID", "Sample_Size_Total"],
+    "2_Eligibility_Baseline": ["Study_ID", "Mean_Age (years)", "Age_SD"],
+    TTE: ["Study_ID", OUTCOME, "Effect_Size (HR)", "Lower_CI", "Upper_CI", "P_value"],
+}
+TEXT = ("Methods\n120 patients were randomized in trial NCT01234567. Mean age was 52.1 ± 10.2 years.\n"
+        "Results\nCTRCD was less frequent with carvedilol (HR 0.52, 95% CI 0.31-0.87; p=0.01).")
+
+
+def _facts():
+    doc = StudyDocument.from_pages([{"page": 1, "text": TEXT}], lambda r: r["text"])
+    return rules.prefill(doc, SCHEMA)
+
+
+def test_per_outcome_columns_stay_in_the_prompt():
+    ask = rules.ask_schema(SCHEMA, _facts())
+    assert ask["1_Study_ID_Design"] == ["Study_ID (FirstAuthor_Year)"]  # one-row sheet: rules answer it
+    assert ask["2_Eligibility_Baseline"] == SCHEMA["2_Eligibility_Baseline"]
+    assert ask[TTE] == SCHEMA[TTE]
+
+
+def test_two_outcome_time_to_event_answer_keeps_the_models_values():
+    answer = {TTE: [
+        {OUTCOME: "CTRCD", "Effect_Size (HR)": "NR", "Lower_CI": "NR", "Upper_CI": "NR", "P_value": "NR"},
+        {OUTCOME: "Death", "Effect_Size (HR)": "0.91", "Lower_CI": "0.60", "Upper_CI": "1.38", "P_value": "0.66"},
+    ]}
+    rows = rules.apply(answer, [TTE], _facts())[TTE]
+    assert [(r[OUTCOME], r["Effect_Size (HR)"], r["Lower_CI"], r["Upper_CI"], r["P_value"]) for r in rows] == [
+        ("CTRCD", "0.52", "0.31", "0.87", "0.01"),
+        ("Death", "0.91", "0.60", "1.38", "0.66"),
+    ]
+
+
+def test_rule_never_overwrites_a_reported_first_row():
+    answer = {TTE: [{OUTCOME: "CTRCD", "Effect_Size (HR)": "0.50", "Lower_CI": "NR"}]}
+    row = rules.apply(answer, [TTE], _facts())[TTE][0]
+    assert (row["Effect_Size (HR)"], row["Lower_CI"]) == ("0.50", "0.31")
+
+
+def test_study_level_fact_only_fills_unreported_arm_rows():
+    answer = {"2_Eligibility_Baseline": [{"Mean_Age (years)": "50.3", "Age_SD": "9.1"},
+                                         {"Mean_Age (years)": "NR", "Age_SD": "NR"}]}
+    rows = rules.apply(answer, ["2_Eligibility_Baseline"], _facts())["2_Eligibility_Baseline"]
+    assert [(r["Mean_Age (years)"], r["Age_SD"]) for r in rows] == [("50.3", "9.1"), ("52.1", "10.2")]
+
+
+def test_one_row_sheet_takes_the_rule_values():
+    answer = {"1_Study_ID_Design": [{"Study_ID (FirstAuthor_Year)": "Kaya_2020"}]}
+    row = rules.apply(answer, ["1_Study_ID_Design"], _facts())["1_Study_ID_Design"][0]
+    assert (row["Registry_ID"], row["Sample_Size_Total"]) == ("NCT01234567", "120")
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from conftest import CRITERIA_PDF, TEMPLATE_XLSX
+from extractor import study_design
+from extractor.document import StudyDocument
+
+OBSERVATIONAL = (
+    "Cardiotoxicity in sarcoma: a cardio-oncology registry\nAbstract\n"
+    "Background: Clinical trials and randomized studies showed that ACE inhibitors prevent cardiotoxicity.\n"
+    "Methods: In this retrospective cohort, 300 patients were followed; mean HR was 72 bpm (range 60-88).\n"
+    "Results: CTRCD developed in 14%.\n"
+    "Introduction\nRandomized controlled trials of carvedilol have been reported [3].\n"
+)
+RCT = (
+    "Enalapril for cardioprotection: a randomized controlled trial\nAbstract\n"
+    "Methods: Patients were randomly assigned to enalapril or placebo.\n"
+    "Results: CTRCD was less frequent with enalapril (HR 0.52, 95% CI 0.31-0.87).\n"
+)
+
+
+def _classify(text):
+    return study_design.classify(StudyDocument.from_pages([{"page": 1, "text": text}], lambda r: r["text"]))
+
+
+def test_trials_named_in_the_background_do_not_make_an_rct():
+    info = _classify(OBSERVATIONAL)
+    assert info["design"] == "Observational"
+    assert info["signals"]["rct"] == []
+
+
+def test_heart_rate_is_not_survival_data():
+    assert not _classify(OBSERVATIONAL)["survival"]
+    assert not _classify("Methods: a prospective cohort.\nResults: HR 72 (65-80) bpm; Villarraga HR, et al.")["survival"]
+
+
+@pytest.mark.parametrize("result", ["HR 0.52 (95% CI 0.31-0.87)", "HR, 0.52; 95% CI, 0.31-0.87", "HR = 0.52, CI 0.3-0.9",
+                                    "the hazard ratio was 0.52", "Kaplan-Meier curves"])
+def test_survival_wording_or_an_hr_with_its_ci_counts(result):
+    assert _classify(f"Methods: a prospective cohort.\nResults: {result}.")["survival"]
+
+
+def test_rct_gates_robins_and_missing_analyses():
+    info = _classify(RCT)
+    assert (info["design"], info["survival"], info["subgroups"]) == ("RCT", True, False)
+    skip = study_design.inapplicable_sheets(info, ["13_RiskOfBias_RoB2_RCTs", "14_RiskOfBias_ROBINSI_NRS",
+                                                   "10_TimeToEvent", "12_Subgroups_EffectModifiers"])
+    assert set(skip) == {"14_RiskOfBias_ROBINSI_NRS", "12_Subgroups_EffectModifiers"}
+
+
+def test_resume_does_not_ungate_sheets(mapper_env, monkeypatch, study_pdf):
+    mapper = mapper_env
+    monkeypatch.setattr(mapper, "STUDY_FACTS_ENABLED", False)
+    asked = []
+
+    def nr(prompt, *a, sheet=None, json_schema=None, **k):
+        asked.append(sheet)
+        return json.dumps({s: [{c: "NR" for c in sc["items"]["properties"]}]
+                           for s, sc in json_schema["properties"].items()})
+
+    monkeypatch.setattr(mapper, "query_llama", nr)
+    gated = set(mapper._inapplicable_sheets(mapper.load_document(study_pdf), mapper._load_schema(TEMPLATE_XLSX)[0]))
+    assert {"10_TimeToEvent", "14_RiskOfBias_ROBINSI_NRS"} <= gated
+    mapper.extract_fields(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="gate")
+    assert not gated & {s for label in asked for s in label.split(", ")}
+
+    asked.clear()
+    cache = mapper.resume_incomplete_fields(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="gate",
+                                            target_completeness=101)
+    assert asked and not gated & set(asked)
+    for sheet in gated:
+        assert all(v == "NR" for row in cache[sheet] for v in row.values())
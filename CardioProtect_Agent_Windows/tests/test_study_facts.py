@@ -0,0 +1,37 @@
+import json
+
+from conftest import CRITERIA_PDF, TEMPLATE_XLSX
+from extractor import study_facts
+
+FACTS_ANSWER = {"Study_ID": "Kaya_2020", "Study_Design": "RCT",
+                "Arms": [{"Arm_Name": "Enalapril", "N": "69"}, {"Arm_Name": "Placebo", "N": "n=66"}],
+                "Timepoints": ["baseline", "12 months"]}
+
+
+def test_facts_sidecar_and_prompt_block(mapper_env, monkeypatch, study_pdf):
+    mapper = mapper_env
+    monkeypatch.setattr(mapper, "STUDY_FACTS_ENABLED", True)
+    prompts = {}
+
+    def fake(prompt, *a, sheet=None, json_schema=None, **k):
+        if sheet == "study facts":
+            return json.dumps(FACTS_ANSWER)
+        prompts[sheet] = prompt
+        return json.dumps({s: [{c: "NR" for c in sc["items"]["properties"]}]
+                           for s, sc in json_schema["properties"].items()})
+
+    monkeypatch.setattr(mapper, "query_llama", fake)
+    out = mapper.extract_fields(study_pdf, CRITERIA_PDF, TEMPLATE_XLSX, session_id="facts")
+
+    with open(mapper._get_facts_path(study_pdf, "facts"), encoding="utf-8") as f:
+        sidecar = json.load(f)
+    assert sidecar == {"version": study_facts.STUDY_FACTS_VERSION, "facts": {
+        "Study_ID": "Kaya_2020", "Study_Design": "RCT",
+        "Arms": [{"Arm_Name": "Enalapril", "N": "69"}, {"Arm_Name": "Placebo", "N": "66"}],
+        "Timepoints": ["baseline", "12 months"]}}
+
+    block = study_facts.render(sidecar["facts"])
+    assert block.startswith("[STUDY FACTS]") and "  2. Placebo (N=66)" in block
+    assert prompts and all(block in prompt for prompt in prompts.values())
+    assert out["1_Study_ID_Design"][0]["Study_ID (FirstAuthor_Year)"] == "Kaya_2020"
+    assert [r["Arm_Name"] for r in out["3_Intervention_Cardioprotectors"]] == ["Enalapril", "Placebo"]
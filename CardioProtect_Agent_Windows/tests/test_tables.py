@@ -0,0 +1,56 @@
+from extractor import tables
+from extractor.document import StudyDocument
+
+CONTINUOUS = ["Study_ID", "Outcome_Name", "Timepoint", "Arm_Name", "N", "Mean", "SD"]
+
+BASELINE = [
+    ["", "Dexrazoxane (n=100)", "Placebo (n=98)"],
+    ["Age, years", "52.1 ± 10.2", "53.0 ± 9.8"],
+    ["Female sex", "60 (60.0)", "58 (59.2)"],
+    ["LVEF (%)", "62.3 ± 4.1", "61.8 ± 4.4"],
+]
+OUTCOMES = [
+    ["Outcome", "Dexrazoxane (n=100)", "Placebo (n=98)", "p"],
+    ["LVEF at 12 months (%)", "58.2 ± 5.1", "55.0 ± 6.2", "0.01"],
+    ["GLS (%)", "-19.1 ± 2.0", "-17.2 ± 2.4", "0.03"],
+]
+
+
+def _doc(page_text, *raw_tables):
+    rec = {"page": 1, "text": page_text, "tables": list(raw_tables)}
+    text = lambda r: r["text"] + "".join("\n" + " | ".join(c for c in row if c) for t in r["tables"] for row in t)
+    return StudyDocument.from_pages([rec], text)
+
+
+def test_baseline_table_is_not_routed_or_mapped():
+    g = tables.grid(BASELINE)
+    assert tables.baseline(g)
+    assert tables.classify(g) == []
+    assert tables.map_rows({**g, "sheets": tables.SHEETS}, "9_Outcome_Continuous", CONTINUOUS) == []
+
+
+def test_baseline_caption_keeps_the_table_in_the_shared_text():
+    doc = _doc("Table 1. Baseline characteristics of the patients\nTable 2. Outcomes at 12 months",
+               [["Variable", "Dexrazoxane", "Placebo"], ["LVEF (%)", "62.3 ± 4.1", "61.8 ± 4.4"],
+                ["GLS (%)", "-20.1 ± 2.2", "-20.0 ± 2.3"]],
+               OUTCOMES)
+    routed = tables.structured(doc)
+    assert [(t["caption"], t["sheets"]) for t in routed] == [
+        ("Table 2. Outcomes at 12 months", ["9_Outcome_Continuous"])]
+    assert "62.3 ± 4.1" in doc.text
+
+
+def test_outcome_table_still_maps_to_rows():
+    g = tables.grid(OUTCOMES)
+    assert tables.classify(g) == ["9_Outcome_Continuous"]
+    rows = tables.map_rows({**g, "sheets": tables.classify(g)}, "9_Outcome_Continuous", CONTINUOUS)
+    assert [(r["Outcome_Name"], r["Arm_Name"], r["N"], r["Mean"], r["SD"]) for r in rows][:2] == [
+        ("LVEF at 12 months (%)", "Dexrazoxane", "100", "58.2", "5.1"),
+        ("LVEF at 12 months (%)", "Placebo", "98", "55.0", "6.2")]
+
+
+def test_group_only_columns_need_an_outcome_label():
+    g = tables.grid([["", "Dexrazoxane", "Placebo"], ["LVEF (%)", "62.3 ± 4.1", "61.8 ± 4.4"],
+                     ["GLS (%)", "-20.1 ± 2.2", "-20.0 ± 2.3"]])
+    assert tables.classify(g) == []
+    assert tables.classify(g, "Table 3. Change in LVEF and GLS") == ["9_Outcome_Continuous"]